@@ -0,0 +1,363 @@
+'''
+  Long-running lookup service for the ingest workers: resolves DICOM tags,
+  keywords, label prefixes and ontology IDs to the dictionary and ontology
+  terms over HTTP, on a TCP port or a Unix socket.  Python 3.7+ only
+  (asyncio).
+
+  Everything is loaded once at startup, from the compiled sidecars where
+  there are any, so a new instance is ready in a fraction of a second:
+
+    dicom_dict_vr.dict, dicom_dict_mask.dict, dicom_dict_def.dict
+                  through dicom_dict (mmap sidecars of dict_cache)
+    the ontology files of dicom_db.ontologyFilenames
+                  through owl_index.OwlIndex (byte-offset sidecars; a
+                  term's block is parsed when it is asked for)
+
+  plus a keyword table and a sorted label list built from the VR
+  dictionary.  Answers are kept JSON-encoded in an LRU cache of cacheSize
+  entries, so a hot query is a cache hit and a write.
+
+  Endpoints (GET unless noted; every answer is JSON):
+
+    /tag/<tag>           tag as ggggeeee or (gggg,eeee); repeating group
+                         tags (60020010) are matched against the masks
+    /keyword/<keyword>   e.g. /keyword/PixelSpacing (case insensitive)
+    /label/<prefix>      entries whose label starts with prefix, up to
+                         ?limit=N (default labelLimit), in label order
+    /term/<id>           an ontology entity by local name (dicom_xxxx0065,
+                         dicom_00280011) or prefixed name
+    /tags?tag=a&tag=b    several tags at once (also tag=a,b,c)
+    POST /tags           the same, with a JSON list of tags as the body
+                         (or {"tags": [...]}); at most maxBatch tags
+    /stats               entry counts, cache statistics and uptime
+
+  A tag answer is
+
+    {"tag": "00280011", "vr": "US", "vm": "1", "label": "Columns",
+     "keyword": "Columns", "retired": false, "mask": null,
+     "definition": "Number of columns in the image.",
+     "id": "dicom_00280011", "iri": "http://purl.org/nidash/dicom#dicom_00280011"}
+
+  (iri is null when the ontology has no entity for the tag).  Batches
+  answer a list in the order of the request, with null for unknown tags;
+  single lookups of unknown terms answer 404.
+
+  Usage:
+    python3 annotation_service.py [--host H] [--port N] [--unix PATH]
+
+'''
+
+import os, sys
+import re
+import json
+import time
+import asyncio
+import functools
+from bisect import bisect_left
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import dicom_dict
+import dicom_db
+import owl_index
+
+#************************************************
+#input parameters
+host = '127.0.0.1'
+port = 8642
+unixPath = None             # serve on this Unix socket instead of host:port
+cacheSize = 8192            # answers kept by the LRU cache
+labelLimit = 20             # default number of answers to a label prefix
+maxBatch = 10000            # tags accepted in one batch request
+maxBodyBytes = 1 << 20
+#************************************************
+
+_tagForm = re.compile(r'^\(?([0-9A-Fa-f]{4}),?([0-9A-Fa-f]{4})\)?$')
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+          413: 'Payload Too Large'}
+
+
+def first_literal(terms):
+    ''' text of the first literal in terms, None if there is none '''
+    for term in terms or ():
+        value = dicom_db.literal_value(term)
+        if value is not None:
+            return value
+    return None
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class Ontology(object):
+    ''' The dictionaries and ontology indexes, loaded once, with cached lookups '''
+
+    def __init__(self, dictDir=None):
+        if dictDir is None:
+            dictDir = dicom_dict.dictDir
+        vrPath = os.path.join(dictDir, dicom_dict.vrFilename)
+        defPath = os.path.join(dictDir, dicom_dict.defFilename)
+        self.vr = dicom_dict.load_vr_dict(vrPath)
+        self.defs = dicom_dict.load_def_dict(defPath) if os.path.exists(defPath) else {}
+        self.masks = dicom_dict.load_mask_table(os.path.join(dictDir, dicom_dict.maskFilename))
+        self.owls = [owl_index.OwlIndex(os.path.join(dictDir, name))
+                     for name in dicom_db.ontologyFilenames
+                     if os.path.exists(os.path.join(dictDir, name))]
+
+        self.keywords = {}
+        labels = []
+        for tag, entry in self.vr.items():
+            if entry[dicom_dict.KEYWORD]:
+                self.keywords.setdefault(entry[dicom_dict.KEYWORD].lower(), tag)
+            labels.append((entry[dicom_dict.NAME].lower(), tag))
+        labels.sort()
+        self.labelKeys = [l for l, tag in labels]
+        self.labelTags = [tag for l, tag in labels]
+
+        self.lookup = functools.lru_cache(maxsize=cacheSize)(self._lookup)
+
+    def tag(self, tag):
+        ''' answer for an 8-character tag or (gggg,eeee), None if unknown '''
+        m = _tagForm.match(tag.strip())
+        if not m:
+            return None
+        tag = (m.group(1) + m.group(2)).upper()
+        entry = self.vr.get(tag)
+        mask = None
+        if entry is None and self.masks is not None:
+            found = self.masks.find(tag)
+            if found is not None:
+                mask, entry = found
+        if entry is None:
+            return None
+        definition = self.defs.get(tag) or (self.defs.get(mask) if mask else None)
+        localId = 'dicom_' + (mask or tag)
+        return OrderedDict([
+            ('tag', tag),
+            ('vr', entry[dicom_dict.VR]),
+            ('vm', entry[dicom_dict.VM]),
+            ('label', entry[dicom_dict.NAME]),
+            ('keyword', entry[dicom_dict.KEYWORD]),
+            ('retired', entry[dicom_dict.RETIRED] == 'Retired'),
+            ('mask', mask),
+            ('definition', definition[1] if definition else None),
+            ('id', localId),
+            ('iri', owl_index.dicomNamespace + localId if any(localId in o for o in self.owls) else None),
+        ])
+
+    def keyword(self, keyword):
+        tag = self.keywords.get(keyword.lower())
+        return self.tag(tag) if tag is not None else None
+
+    def label_prefix(self, prefix, limit):
+        prefix = prefix.lower()
+        i = bisect_left(self.labelKeys, prefix)
+        found = []
+        while i < len(self.labelKeys) and len(found) < limit and self.labelKeys[i].startswith(prefix):
+            found.append(self.tag(self.labelTags[i]))
+            i += 1
+        return found
+
+    def term(self, term):
+        ''' an ontology entity merged over its blocks in every file, None if unknown '''
+        found = None
+        for o in self.owls:
+            for entity in o.entities(term):
+                p = entity.predicates
+                if found is None:
+                    localId = re.split(r'[#/]', entity.iri)[-1]
+                    found = OrderedDict([('id', localId), ('iri', entity.iri), ('tag', None),
+                                         ('label', None), ('definition', None), ('vr', None),
+                                         ('types', []), ('sources', [])])
+                for key, pred in (('label', dicom_db.labelPredicate), ('definition', dicom_db.definitionPredicate),
+                                  ('vr', dicom_db.vrPredicate)):
+                    if found[key] is None:
+                        found[key] = first_literal(p.get(pred))
+                if found['tag'] is None:
+                    found['tag'] = dicom_db.entity_tag(found['id'], p)
+                for t in list(p.get(dicom_db.typePredicate, [])) + list(p.get('a', [])):
+                    if t not in found['types']:
+                        found['types'].append(t)
+                source = os.path.basename(o.owlPath)
+                if source not in found['sources']:
+                    found['sources'].append(source)
+        return found
+
+    def _lookup(self, kind, value, limit=None):
+        ''' JSON-encoded answer, None if there is none (cached through self.lookup) '''
+        if kind == 'tag':
+            answer = self.tag(value)
+        elif kind == 'keyword':
+            answer = self.keyword(value)
+        elif kind == 'label':
+            return _encode(self.label_prefix(value, limit))
+        elif kind == 'term':
+            answer = self.term(value)
+        else:
+            raise ValueError(kind)
+        return _encode(answer) if answer is not None else None
+
+    def batch(self, tags):
+        parts = []
+        for tag in tags:
+            answer = self.lookup('tag', tag) if isinstance(tag, str) else None
+            parts.append(answer if answer is not None else b'null')
+        return b'[' + b','.join(parts) + b']'
+
+
+class Service(object):
+    ''' HTTP/1.1 front end (keep-alive, Content-Length bodies only) for an Ontology '''
+
+    def __init__(self, ontology):
+        self.ontology = ontology
+        self.started = time.time()
+        self.requests = 0
+
+    def stats(self):
+        info = self.ontology.lookup.cache_info()
+        return OrderedDict([
+            ('entries', len(self.ontology.vr)),
+            ('masks', len(self.ontology.masks.masks) if self.ontology.masks is not None else 0),
+            ('definitions', len(self.ontology.defs)),
+            ('ontology_terms', sum(len(o) for o in self.ontology.owls)),
+            ('requests', self.requests),
+            ('cache', OrderedDict([('hits', info.hits), ('misses', info.misses),
+                                   ('size', info.currsize), ('max_size', info.maxsize)])),
+            ('uptime', round(time.time() - self.started, 3)),
+        ])
+
+    def dispatch(self, method, target, body):
+        ''' (status, JSON bytes) for one request '''
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/', 1)
+        kind = parts[0]
+        value = unquote(parts[1]) if len(parts) > 1 else ''
+        if kind == 'tags':
+            if method == 'POST':
+                try:
+                    tags = json.loads(body.decode('utf-8'))
+                except ValueError:
+                    return 400, _encode({'error': 'body is not JSON'})
+                if isinstance(tags, dict):
+                    tags = tags.get('tags')
+                if not isinstance(tags, list):
+                    return 400, _encode({'error': 'expected a list of tags'})
+            elif method == 'GET':
+                tags = [t for v in query.get('tag', []) for t in v.split(',') if t]
+            else:
+                return 405, _encode({'error': 'use GET or POST'})
+            if len(tags) > maxBatch:
+                return 413, _encode({'error': 'more than %d tags' % maxBatch})
+            return 200, self.ontology.batch(tags)
+
+        if method != 'GET':
+            return 405, _encode({'error': 'use GET'})
+        if kind == 'stats':
+            return 200, _encode(self.stats())
+        if kind in ('tag', 'keyword', 'term') and value:
+            answer = self.ontology.lookup(kind, value)
+        elif kind == 'label' and value:
+            try:
+                limit = int(query.get('limit', [labelLimit])[0])
+            except ValueError:
+                return 400, _encode({'error': 'limit is not a number'})
+            answer = self.ontology.lookup(kind, value, max(0, limit))
+        else:
+            return 404, _encode({'error': 'unknown endpoint %s' % url.path})
+        if answer is None:
+            return 404, _encode({'error': '%s %s not found' % (kind, value)})
+        return 200, answer
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    name, sep, v = h.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = v.strip()
+                keepAlive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                length = headers.get('content-length', '0') or '0'
+                length = int(length) if length.isdigit() else None
+                if length is None:
+                    # the body cannot be skipped without its length, so the connection ends here
+                    status, payload = 400, _encode({'error': 'bad Content-Length'})
+                    keepAlive = False
+                elif length > maxBodyBytes:
+                    status, payload = 413, _encode({'error': 'body too large'})
+                    keepAlive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    self.requests += 1
+                    status, payload = self.dispatch(method, target, body)
+
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                              'Content-Length: %d\r\nConnection: %s\r\n\r\n'
+                              % (status, STATUS[status], len(payload),
+                                 'keep-alive' if keepAlive else 'close')).encode('latin-1') + payload)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(service, host=None, port=None, unixPath=None):
+    if unixPath:
+        if os.path.exists(unixPath):
+            os.remove(unixPath)
+        server = await asyncio.start_unix_server(service.handle, path=unixPath)
+        where = unixPath
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        where = '%s:%d' % (host, port)
+    print ("Serving on %s" % where)
+    sys.stdout.flush()
+    async with server:
+        await server.serve_forever()
+
+
+def main(args):
+    global host, port, unixPath
+    i = 0
+    while i < len(args):
+        if args[i] == '--host' and i + 1 < len(args):
+            host = args[i + 1]
+        elif args[i] == '--port' and i + 1 < len(args):
+            port = int(args[i + 1])
+        elif args[i] == '--unix' and i + 1 < len(args):
+            unixPath = args[i + 1]
+        else:
+            print (__doc__)
+            return 1
+        i += 2
+
+    t = time.time()
+    service = Service(Ontology())
+    print ("Loaded %d entries and %d ontology terms in %.0f ms" % (len(service.ontology.vr),
+           sum(len(o) for o in service.ontology.owls), (time.time() - t) * 1000))
+    try:
+        asyncio.run(serve(service, host, port, unixPath))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+##############################################################
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,281 @@
+'''
+  Batch annotation of DICOM data element tags with the ontology terms, for
+  headers converted to NIDM in bulk.
+
+  The tags of many headers are resolved at once with NumPy instead of one
+  dict lookup per element.  Annotator keeps the VR dictionary of
+  tag_table.TagTable, joined with the ontology files, as column arrays:
+
+    tags        uint32, sorted (the TagTable array, not copied)
+    iri, label  the ontology term of the entry (owl_index.OwlIndex of
+                dicom_db.ontologyFilenames) and its rdfs:label; '' when
+                no ontology file has a term for the tag
+    name, vr, keyword
+                from the VR dictionary
+    retired     bool
+    term        bool, True where iri is set
+
+  with one row per dictionary entry, one row per repeating group mask
+  ('60xx0010') and a last, empty row for tags that are not in the
+  dictionary.
+
+  resolve() turns an array of 32-bit tags into row numbers with
+  numpy.searchsorted on the sorted tags; the tags that are not in the
+  dictionary are then matched against the masks one mask pattern at a time
+  (tag & and-mask, searchsorted on the sorted mask values), the masks with
+  the most fixed bits first, as dicom_dict.MaskTable does.  annotate()
+  gathers the columns with a single take per column, so the result is a
+  dict of arrays as long as the input:
+
+    tag, header, found, iri, label, name, vr, retired, keyword
+
+  found is True where the tag has an ontology term (a tag that is only in
+  the VR dictionary still gets its name, VR and keyword).  header is the
+  position of the header each element came from when several headers are
+  annotated together (annotate_headers), otherwise 0.  Tags given as ints
+  must fit in 32 bits; others raise ValueError.
+
+  NumPy is only needed by this module; importing it without NumPy works,
+  creating an Annotator raises ImportError.
+
+  Example:
+    import batch_annotate
+    a = batch_annotate.Annotator()
+    cols = a.annotate_headers([[0x00280010, 0x00280011], [0x60020010, 0x00091001]])
+    cols['iri']      # -> ['dicom:dicom_00280010', 'dicom:dicom_00280011', 'dicom:dicom_60xx0010', '']
+    cols['vr']       # -> ['US', 'US', 'US', '']
+
+  Usage:
+    python batch_annotate.py <tag> [<tag> ...]
+  prints one tab-separated line per tag (ggggeeee or (gggg,eeee)).
+
+'''
+
+import sys
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import os
+import dicom_db
+import dicom_dict
+import owl_index
+import tag_table
+
+#************************************************
+#input parameters
+iriPrefix = 'dicom:dicom_'      # e.g. 'http://purl.org/nidash/dicom#dicom_' for full IRIs
+#************************************************
+
+COLUMNS = ('tag', 'header', 'found', 'iri', 'label', 'name', 'vr', 'retired', 'keyword')
+
+MAX_TAG = 0xFFFFFFFF
+
+_tagForm = re.compile(r'^\(?([0-9A-Fa-f]{4}),?([0-9A-Fa-f]{4})\)?$')
+
+
+def parse_tag(s):
+    ''' 32-bit tag for 'ggggeeee' or '(gggg,eeee)' '''
+    m = _tagForm.match(s.strip())
+    if not m:
+        raise ValueError("not a DICOM tag: %r" % s)
+    return int(m.group(1) + m.group(2), 16)
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def ontology_indexes(dictDir=None):
+    ''' OwlIndex of each of dicom_db.ontologyFilenames found in dictDir '''
+    if dictDir is None:
+        dictDir = dicom_dict.dictDir
+    return [owl_index.OwlIndex(os.path.join(dictDir, name)) for name in dicom_db.ontologyFilenames
+            if os.path.exists(os.path.join(dictDir, name))]
+
+
+def term_label(indexes, localId):
+    ''' (True, rdfs:label or '') if an ontology has a term localId, else (False, '') '''
+    found = False
+    for idx in indexes:
+        if localId not in idx:
+            continue
+        found = True
+        for entity in idx.entities(localId):
+            for term in entity.predicates.get(dicom_db.labelPredicate, ()):
+                label = dicom_db.literal_value(term)
+                if label is not None:
+                    return True, label
+    return found, u''
+
+
+class Annotator(object):
+    ''' Resolves arrays of 32-bit tags against a TagTable and its masks '''
+
+    def __init__(self, table=None, indexes=None):
+        ''' table: a tag_table.TagTable (default: tag_table.load());
+        indexes: the owl_index.OwlIndex of the ontology files (default: ontology_indexes())
+        '''
+        if np is None:
+            raise ImportError("batch_annotate needs NumPy")
+        if table is None:
+            table = tag_table.load()
+        if indexes is None:
+            indexes = ontology_indexes()
+        self.table = table
+        if len(table.tags):
+            self.tags = np.frombuffer(table.tags, dtype='u%d' % table.tags.itemsize).astype(np.uint32, copy=False)
+        else:
+            self.tags = np.zeros(0, dtype=np.uint32)
+
+        n = len(table.tags)
+        localIds = [u'%08X' % t for t in table.tags]
+        names = [_text(table.names[i]) for i in table.nameIds]
+        keywords = [_text(table.keywords[i]) for i in table.keywordIds]
+        vrs = [_text(table.vrNames[c]) for c in table.vrs]
+        retired = [bool(r) for r in table.retired]
+
+        # mask rows follow the dictionary rows; per and-mask, the sorted values and their rows
+        self.maskTables = []
+        masks = table.masks.masks if table.masks is not None else {}
+        groups = {}
+        for mask in sorted(masks):
+            andMask, value = dicom_dict.mask_bits(mask)
+            vr, vm, name, ret, keyword = [_text(v) for v in masks[mask]]
+            groups.setdefault(andMask, []).append((value, len(localIds)))
+            localIds.append(_text(mask))
+            names.append(name)
+            keywords.append(keyword)
+            vrs.append(vr)
+            retired.append(ret == tag_table.RETIRED)
+        for andMask in sorted(groups, key=lambda m: (-bin(m).count('1'), m)):
+            values = sorted(groups[andMask])
+            self.maskTables.append((andMask,
+                                    np.array([v for v, row in values], dtype=np.uint32),
+                                    np.array([row for v, row in values], dtype=np.intp)))
+
+        iris = []
+        labels = []
+        for localId in localIds:
+            hasTerm, label = term_label(indexes, u'dicom_' + localId)
+            iris.append(iriPrefix + localId if hasTerm else u'')
+            labels.append(label)
+
+        # the last row is returned for tags that are not in the dictionary
+        self.missing = len(iris)
+        iris.append(u'')
+        labels.append(u'')
+        names.append(u'')
+        keywords.append(u'')
+        vrs.append(u'')
+        retired.append(False)
+        self.nentries = n
+        self.iri = np.array(iris)
+        self.label = np.array(labels)
+        self.name = np.array(names)
+        self.term = np.array([bool(i) for i in iris], dtype=bool)
+        self.keyword = np.array(keywords)
+        self.vr = np.array(vrs)
+        self.retired = np.array(retired, dtype=bool)
+
+    def as_tags(self, tags):
+        ''' uint32 array for a sequence of ints or of 'ggggeeee' / '(gggg,eeee)' strings;
+        ValueError for ints that do not fit in 32 bits
+        '''
+        a = np.asarray(tags)
+        if a.dtype.kind in 'USO':
+            a = np.array([parse_tag(_text(t)) if isinstance(t, (bytes, type(u''))) else int(t)
+                          for t in a.ravel()], dtype=object)
+        elif a.dtype.kind not in 'iu':
+            raise ValueError("tags must be integers or strings, not %s" % a.dtype)
+        a = a.ravel()
+        if len(a) and (a.min() < 0 or a.max() > MAX_TAG):
+            raise ValueError("tag out of range: %d" % (a.min() if a.min() < 0 else a.max()))
+        return a.astype(np.uint32, copy=False)
+
+    def resolve(self, tags):
+        ''' row numbers into the columns for an array of tags (self.missing where not found) '''
+        tags = self.as_tags(tags)
+        rows = np.full(len(tags), self.missing, dtype=np.intp)
+        if len(self.tags):
+            i = np.searchsorted(self.tags, tags)
+            inRange = i < len(self.tags)
+            hit = np.zeros(len(tags), dtype=bool)
+            hit[inRange] = self.tags[i[inRange]] == tags[inRange]
+            rows[hit] = i[hit]
+
+        todo = np.flatnonzero(rows == self.missing)
+        for andMask, values, maskRows in self.maskTables:
+            if not len(todo):
+                break
+            masked = tags[todo] & np.uint32(andMask)
+            j = np.searchsorted(values, masked)
+            inRange = j < len(values)
+            hit = np.zeros(len(todo), dtype=bool)
+            hit[inRange] = values[j[inRange]] == masked[inRange]
+            rows[todo[hit]] = maskRows[j[hit]]
+            todo = todo[~hit]
+        return rows
+
+    def annotate(self, tags, header=None, columns=COLUMNS):
+        ''' dict of column arrays for an array of tags; header, if given, is an int array
+        of the same length saying which header each tag is from.  Only the names in
+        columns are gathered (the string columns are the costly ones)
+        '''
+        tags = self.as_tags(tags)
+        rows = self.resolve(tags)
+        if header is None:
+            header = np.zeros(len(tags), dtype=np.intp)
+        result = {}
+        for name in columns:
+            if name == 'tag':
+                result[name] = tags
+            elif name == 'header':
+                result[name] = np.asarray(header, dtype=np.intp)
+            elif name == 'found':
+                result[name] = self.term.take(rows)
+            elif name in ('iri', 'label', 'name', 'vr', 'retired', 'keyword'):
+                result[name] = getattr(self, name).take(rows)
+            else:
+                raise ValueError("unknown column %r" % name)
+        return result
+
+    def annotate_headers(self, headers, columns=COLUMNS):
+        ''' annotate for the tags of several headers (a sequence of tag arrays), concatenated '''
+        arrays = [self.as_tags(h) for h in headers]
+        lengths = [len(a) for a in arrays]
+        if arrays:
+            tags = np.concatenate(arrays)
+        else:
+            tags = np.zeros(0, dtype=np.uint32)
+        header = np.repeat(np.arange(len(arrays), dtype=np.intp), lengths)
+        return self.annotate(tags, header, columns)
+
+
+def split_headers(columns, nheaders=None):
+    ''' the column arrays of annotate_headers split back into one dict per header
+    (nheaders: the number of headers annotated, if the last ones can be empty)
+    '''
+    header = columns['header']
+    if nheaders is None:
+        nheaders = int(header[-1]) + 1 if len(header) else 0
+    bounds = np.searchsorted(header, np.arange(nheaders + 1))
+    return [dict((name, col[bounds[h]:bounds[h + 1]]) for name, col in columns.items())
+            for h in range(nheaders)]
+
+
+def main(args):
+    cols = Annotator().annotate([parse_tag(a) for a in args])
+    for i in range(len(cols['tag'])):
+        print (u'%08X\t%s\t%s\t%s\t%s' % (cols['tag'][i], cols['iri'][i], cols['vr'][i],
+               'Retired' if cols['retired'][i] else '', cols['label'][i]))
+
+
+##############################################################
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,689 @@
+'''
+  Benchmarks for the dictionary and ontology build pipeline.
+
+  The generator scripts read the docbook Parts from fixed paths under
+  /home/karl, so this harness writes synthetic Part 03, 06 and 07 docbook
+  files of a configurable size into a scratch directory, points the
+  scripts' input parameters at them (and their outputs at the scratch
+  directory) and times each stage on its own:
+
+    docbook_parse      ET.parse of the Part 03 fixture
+    parse_row          def_generate_dict_reorg.parse_docbook_table over that tree
+    docbook_stream     def_generate_dict_reorg.parse_docbook_stream (what main runs)
+    vr_parse           Parts 06 and 07 through vr_generate_dict
+    clean_attrs        def_generate_dict_reorg.clean_attrs
+    remove_duplicates  def_generate_dict_reorg.remove_duplicates
+    build_definitions  cleaning, duplicates, sort and tag conversion together
+    read_dicts         the checked-in dicom_dict_vr.dict and dicom_dict_def.dict
+    read_owl           owl_reader over the checked-in ontology files
+    tag_match          create_dicom_ttl's tag index and tag_match for every tag
+                       of the checked-in VR dictionary
+    vr_backfill        check_add_vr.main over the checked-in dicom_ontology.owl
+    write_def_dict     def_generate_dict_reorg.write_def_dict
+    write_vr_dict      vr_generate_dict.write_vr_dict
+    write_ttl          ttl_writer rewriting dicom_ontology_nlx.owl
+
+  Each stage runs in a child process of its own (forked from the harness),
+  so its memory is not mixed up with that of the other stages.  Inputs a
+  stage needs are prepared in the child before the clock starts.  For
+  every stage the results record the best of the repeated wall times,
+  the peak resident size of the child (peak_rss_kb, reset through
+  /proc/self/clear_refs before the stage runs where Linux allows it), how
+  much it grew while the stage ran (peak_delta_kb), and on Python 3 the
+  peak of tracemalloc in an extra, untimed run (peak_alloc_kb).  The
+  stages run in the quiet mode of metrics.py, as a timed build would, and
+  what console output is left goes to /dev/null.  A stage that cannot run on this Python (the generators are
+  Python 2 only) is recorded with the error instead.
+
+  The fixtures are drawn from a small linear congruential generator of
+  this file rather than the random module, whose randint and choice give
+  other sequences on Python 2 and 3, so every run on every Python
+  measures the same input.
+
+  The results are written as JSON and compared with a baseline saved on
+  the same machine (--save-baseline; benchmark_baseline.json is not
+  checked in, timings from another machine say nothing): a stage whose
+  time or memory grew by more than regressionFactor (and by more than the
+  noise floors) is listed under "regressions", and the exit status is 1.
+  A baseline measured on other fixtures or another Python version is not
+  compared against.
+
+  Usage:
+    python benchmark.py [--tables N] [--elements N] [--repeats N]
+                        [--out results.json] [--baseline baseline.json]
+                        [--save-baseline] [--stage name ...]
+
+'''
+
+import os, sys
+import io
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import traceback
+import multiprocessing
+
+import metrics
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+#************************************************
+#input parameters
+fixtureTables = 300         # tables in the synthetic Part 03
+fixtureElements = 4000      # data elements in the synthetic Part 06
+fixtureSeed = 1
+repeats = 5
+resultsFilename = 'benchmark_results.json'
+baselineFilename = 'benchmark_baseline.json'
+regressionFactor = 1.5      # slower / bigger than the baseline by this factor is a regression
+minWallDelta = 0.02         # seconds; smaller differences are noise
+minMemoryDelta = 1024       # KB
+repoDir = os.path.dirname(os.path.abspath(__file__))
+#************************************************
+
+NS = 'http://docbook.org/ns/docbook'
+GROUPS = ['0008', '0010', '0018', '0020', '0028', '0040', '300A']
+
+
+class FixtureRandom(object):
+    ''' The same pseudo-random sequence for a seed on every Python version '''
+
+    def __init__(self, seed):
+        self.state = seed & 0xFFFFFFFFFFFFFFFF
+
+    def below(self, n):
+        ''' an int in [0, n) '''
+        self.state = (self.state * 6364136223846793005 + 1442695040888963407) & 0xFFFFFFFFFFFFFFFF
+        return (self.state >> 33) % n
+
+    def randint(self, a, b):
+        return a + self.below(b - a + 1)
+
+    def choice(self, seq):
+        return seq[self.below(len(seq))]
+
+
+def write_part03_fixture(path, ntables, seed=fixtureSeed):
+    ''' Part 03-like docbook: module tables with and without Type or Key columns, Include
+    rows, notes, repeated tags, an Example table and a table from skipTables
+    '''
+    rnd = FixtureRandom(seed)
+    out = [u'<?xml version="1.0" encoding="utf-8"?>\n<book xmlns="%s" label="PS3.3"><title>Part 3</title>\n' % NS]
+    w = out.append
+    for t in range(ntables):
+        w(u'<chapter><title>Chapter %d</title><section><para>Introduction %d</para>\n' % (t, t))
+        caption = u'Module %d Attributes' % t if t % 5 else u'Example %d' % t
+        if t % 17 == 3:
+            caption = u'Segment Types'
+        cols = [u'Attribute Name', u'Tag', u'Type', u'Attribute Description'] if t % 2 else \
+               [u'Attribute Name', u'Tag', u'Attribute Description']
+        if t % 11 == 5:
+            cols = [u'Key', u'Tag', u'Type', u'Attribute Description']
+        w(u'<table><caption>%s</caption><thead><tr>' % caption)
+        w(u''.join(u'<th><para>%s</para></th>' % c for c in cols))
+        w(u'</tr></thead><tbody>\n')
+        for r in range(rnd.randint(3, 30)):
+            tag = (rnd.choice(GROUPS), u'%04X' % rnd.randint(0, 40))
+            if r % 9 == 4:
+                w(u'<tr><td colspan="%d"><para><emphasis>Include Table %d</emphasis></para></td></tr>\n'
+                  % (len(cols), r))
+                continue
+            w(u'<tr>')
+            for c in cols:
+                if c == u'Tag':
+                    w(u'<td><para>(%s,%s)</para></td>' % tag)
+                elif c in (u'Attribute Name', u'Key'):
+                    w(u'<td><para>%sName %s%s \u00b5</para></td>' % ((u'&gt;' if r % 4 == 0 else u'',) + tag))
+                elif c == u'Type':
+                    w(u'<td><para>%s</para></td>' % rnd.choice([u'1', u'2', u'3', u'1C']))
+                else:
+                    w(u'<td><para>Definition of %s%s, variant %d.</para>' % (tag + (rnd.randint(0, 2),)))
+                    if r % 3 == 0:
+                        w(u'<note><para>A note.</para></note>')
+                    w(u'</td>')
+            w(u'</tr>\n')
+        w(u'</tbody></table></section></chapter>\n')
+    w(u'</book>\n')
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u''.join(out))
+
+
+def _registry_table(w, caption, cols, rows):
+    w(u'<table><caption>%s</caption><thead><tr>' % caption)
+    w(u''.join(u'<th><para><emphasis>%s</emphasis></para></th>' % c if c else u'<th><para/></th>' for c in cols))
+    w(u'</tr></thead><tbody>\n')
+    for row in rows:
+        w(u'<tr>' + u''.join(u'<td><para>%s</para></td>' % v if v else u'<td><para/></td>' for v in row)
+          + u'</tr>\n')
+    w(u'</tbody></table>\n')
+
+
+def write_part06_fixture(path, nelements, seed=fixtureSeed):
+    ''' Part 06-like docbook with the three registry tables, including repeating group masks '''
+    rnd = FixtureRandom(seed)
+    out = [u'<?xml version="1.0" encoding="utf-8"?>\n<book xmlns="%s"><chapter><section>\n' % NS]
+    cols = [u'Tag', u'Name', u'Keyword', u'VR', u'VM', u'']
+    rows = []
+    seen = set()
+    while len(rows) < nelements:
+        tag = (rnd.choice(GROUPS), u'%04X' % rnd.randint(0, 0xFFFF))
+        if tag in seen:
+            continue
+        seen.add(tag)
+        rows.append([u'(%s,%s)' % tag, u'Name %s%s' % tag, u'Keyword%s%s' % tag,
+                     rnd.choice([u'US', u'DS', u'LO', u'SH', u'See Note', u'US or SS']),
+                     rnd.choice([u'1', u'1-n', u'2 or 3']), rnd.choice([u'', u'', u'RET', u'DICOS'])])
+    rows += [[u'(50xx,0005)', u'Curve Dimensions', u'CurveDimensions', u'US', u'1', u'RET'],
+             [u'(60xx,0010)', u'Overlay Rows', u'OverlayRows', u'US', u'1', u''],
+             [u'(0020,31xx)', u'Source Image IDs', u'SourceImageIDs', u'CS', u'1-n', u'RET']]
+    _registry_table(out.append, u'Registry of DICOM Data Elements', cols, rows)
+    _registry_table(out.append, u'Registry of DICOM File Meta Elements', cols,
+                    [[u'(0002,0000)', u'File Meta Information Group Length', u'FileMetaInformationGroupLength',
+                      u'UL', u'1', u'']])
+    _registry_table(out.append, u'Registry of DICOM Directory Structuring Elements', cols,
+                    [[u'(0004,1130)', u'File-set ID', u'FileSetID', u'CS', u'1', u'']])
+    out.append(u'</section></chapter></book>\n')
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u''.join(out))
+
+
+def write_part07_fixture(path):
+    ''' Part 07-like docbook with the two command field tables '''
+    out = [u'<?xml version="1.0" encoding="utf-8"?>\n<book xmlns="%s"><chapter><section>\n' % NS]
+    cols = [u'Message Field', u'Tag', u'VR', u'VM', u'Description of Field', u'Keyword']
+    _registry_table(out.append, u'Command Fields', cols,
+                    [[u'Command Group Length', u'(0000,0000)', u'UL', u'1', u'Number of bytes', u'CommandGroupLength'],
+                     [u'Affected SOP Class UID', u'(0000,0002)', u'UI', u'1', u'SOP Class', u'AffectedSOPClassUID']])
+    _registry_table(out.append, u'Retired Command Fields', cols,
+                    [[u'Command Length to End', u'(0000,0001)', u'UL', u'1', u'Retired', u'CommandLengthToEnd']])
+    out.append(u'</section></chapter></book>\n')
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u''.join(out))
+
+
+def write_fixtures(workDir, ntables, nelements, seed=fixtureSeed):
+    ''' Writes the three docbook fixtures into workDir; returns their paths by Part '''
+    paths = {'03': os.path.join(workDir, 'part03.xml'),
+             '06': os.path.join(workDir, 'part06.xml'),
+             '07': os.path.join(workDir, 'part07.xml')}
+    write_part03_fixture(paths['03'], ntables, seed)
+    write_part06_fixture(paths['06'], nelements, seed)
+    write_part07_fixture(paths['07'])
+    return paths
+
+
+def load_script(path, name):
+    ''' Imports a script whose file name is not a module name (create_dicom_ttl.0.4.py) '''
+    if sys.version_info[0] >= 3:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    import imp
+    return imp.load_source(name, path)
+
+
+# stages ------------------------------------------------------------------
+# Each stage is setup(ctx) -> args, prepared before timing, and run(args) -> number
+# of items handled.  ctx holds the fixture paths and the scratch directory.
+
+def _def_gen():
+    import def_generate_dict_reorg
+    return def_generate_dict_reorg
+
+
+def _vr_gen(ctx):
+    import vr_generate_dict
+    vr_generate_dict.part06Loc = ctx['parts']['06']
+    vr_generate_dict.part07Loc = ctx['parts']['07']
+    vr_generate_dict.pydict_filename = os.path.join(ctx['workDir'], 'dicom_dict_vr.dict')
+    vr_generate_dict.maskdict_filename = os.path.join(ctx['workDir'], 'dicom_dict_mask.dict')
+    return vr_generate_dict
+
+
+def _part03_attrs(ctx):
+    d = _def_gen()
+    with open(ctx['parts']['03'], 'rb') as f:
+        return d.parse_docbook_stream(f)
+
+
+def setup_docbook_parse(ctx):
+    import xml.etree.ElementTree as ET
+    return ET, ctx['parts']['03']
+
+
+def run_docbook_parse(args):
+    ET, path = args
+    root = ET.parse(path).getroot()
+    return sum(1 for t in root.iter('{%s}table' % NS))
+
+
+def setup_parse_row(ctx):
+    import xml.etree.ElementTree as ET
+    return _def_gen(), ET.parse(ctx['parts']['03']).getroot()
+
+
+def run_parse_row(args):
+    d, root = args
+    return len(d.parse_docbook_table(root))
+
+
+def setup_docbook_stream(ctx):
+    return _def_gen(), ctx['parts']['03']
+
+
+def run_docbook_stream(args):
+    d, path = args
+    with open(path, 'rb') as f:
+        return len(d.parse_docbook_stream(f))
+
+
+def setup_vr_parse(ctx):
+    return _vr_gen(ctx), ctx['parts']['06'], ctx['parts']['07']
+
+
+def run_vr_parse(args):
+    v, part06, part07 = args
+    with open(part06, 'rb') as f:
+        attrs = v.parse_part06(f)
+    with open(part07, 'rb') as f:
+        attrs += v.parse_part07(f)
+    main_attributes, mask_attributes = v.build_attributes(attrs)
+    return len(main_attributes) + len(mask_attributes)
+
+
+def setup_clean_attrs(ctx):
+    return _def_gen(), _part03_attrs(ctx)
+
+
+def run_clean_attrs(args):
+    d, attrs = args
+    return len(d.clean_attrs(attrs))
+
+
+def setup_remove_duplicates(ctx):
+    d = _def_gen()
+    return d, d.clean_attrs(_part03_attrs(ctx))
+
+
+def run_remove_duplicates(args):
+    d, attrs = args
+    return len(d.remove_duplicates(attrs, {}))
+
+
+def setup_build_definitions(ctx):
+    return _def_gen(), _part03_attrs(ctx)
+
+
+def run_build_definitions(args):
+    d, attrs = args
+    return len(d.build_definitions(attrs, {}, {}))
+
+
+def setup_read_dicts(ctx):
+    import dict_cache
+    return dict_cache, [os.path.join(repoDir, 'dicom_dict_vr.dict'), os.path.join(repoDir, 'dicom_dict_def.dict')]
+
+
+def run_read_dicts(args):
+    dict_cache, paths = args
+    return sum(len(dict_cache.read_dict(p)) for p in paths)
+
+
+def setup_read_owl(ctx):
+    import owl_reader
+    return owl_reader, [os.path.join(repoDir, 'dicom_ontology.owl'), os.path.join(repoDir, 'dicom_ontology_nlx.owl')]
+
+
+def run_read_owl(args):
+    owl_reader, paths = args
+    n = 0
+    for p in paths:
+        with open(p, 'rb') as f:
+            for entity in owl_reader.iter_entities(f):
+                n += 1
+    return n
+
+
+def setup_tag_match(ctx):
+    import dict_cache
+    cdt = load_script(os.path.join(repoDir, 'create_dicom_ttl.0.4.py'), 'create_dicom_ttl')
+    vrDict = dict_cache.read_dict(os.path.join(repoDir, 'dicom_dict_vr.dict'))
+    # Neurolex-like rows [label, nlx ID, gggg_eeee, VR] for every other tag, so half the lookups miss
+    tags = sorted(vrDict)
+    rows = [[vrDict[t][2], 'nlx_%d' % i, t[:4] + '_' + t[4:], vrDict[t][0]]
+            for i, t in enumerate(tags) if i % 2 == 0]
+    return cdt, rows, ['(%s,%s)' % (t[:4], t[4:]) for t in tags]
+
+
+def run_tag_match(args):
+    cdt, rows, tags = args
+    index = cdt.build_tag_index(rows)
+    for tag in tags:
+        cdt.tag_match(tag, index)
+    return len(tags)
+
+
+def setup_vr_backfill(ctx):
+    import check_add_vr
+    check_add_vr.inDir = repoDir + os.sep
+    check_add_vr.outDir = ctx['workDir'] + os.sep
+    check_add_vr.vrDir = repoDir + os.sep
+    return check_add_vr
+
+
+def run_vr_backfill(check_add_vr):
+    check_add_vr.main()
+    with open(check_add_vr.outDir + check_add_vr.outFilename, 'rb') as f:
+        return sum(1 for line in f if line.startswith(b'###  '))
+
+
+def setup_write_def_dict(ctx):
+    d = _def_gen()
+    d.pydict_filename = os.path.join(ctx['workDir'], 'dicom_dict_def.dict')
+    d.dupReport_filename = os.path.join(ctx['workDir'], 'dicom_dict_def_duplicates.txt')
+    d.moduleDefs_filename = os.path.join(ctx['workDir'], 'dicom_dict_def_modules.json')
+    dupCounts = {}
+    moduleDefs = {}
+    attrsSort = d.build_definitions(_part03_attrs(ctx), dupCounts, moduleDefs)
+    return d, attrsSort, dupCounts, moduleDefs
+
+
+def run_write_def_dict(args):
+    d, attrsSort, dupCounts, moduleDefs = args
+    d.write_def_dict(attrsSort, dupCounts, moduleDefs)
+    return len(attrsSort)
+
+
+def setup_write_vr_dict(ctx):
+    v = _vr_gen(ctx)
+    with open(ctx['parts']['06'], 'rb') as f:
+        attrs = v.parse_part06(f)
+    with open(ctx['parts']['07'], 'rb') as f:
+        attrs += v.parse_part07(f)
+    main_attributes, mask_attributes = v.build_attributes(attrs)
+    return v, main_attributes, mask_attributes
+
+
+def run_write_vr_dict(args):
+    v, main_attributes, mask_attributes = args
+    v.write_vr_dict(main_attributes, mask_attributes)
+    return len(main_attributes) + len(mask_attributes)
+
+
+def setup_write_ttl(ctx):
+    import owl_reader
+    import ttl_writer
+
+    def term(t):
+        # the writer only takes "..." literals; make the """...""" ones of the Protege file over
+        if t.startswith('"""'):
+            end = t.rindex('"""')
+            suffix = t[end + 3:]
+            return ttl_writer.literal(t[3:end], datatype=suffix[2:] if suffix.startswith('^^') else None,
+                                      lang=suffix[1:] if suffix.startswith('@') else None)
+        return t
+
+    with open(os.path.join(repoDir, 'dicom_ontology_nlx.owl'), 'rb') as f:
+        entities = [(e.subject, [(p, [term(o) for o in objects]) for p, objects in e.predicates.items()])
+                    for e in owl_reader.iter_entities(f)]
+    return ttl_writer, entities, os.path.join(ctx['workDir'], 'rewritten.ttl')
+
+
+def run_write_ttl(args):
+    ttl_writer, entities, path = args
+    with io.open(path, 'w', encoding='utf-8') as f:
+        w = ttl_writer.TurtleWriter(f, ttl_writer.nlxPrefixes, layout='protege')
+        w.write_prefixes()
+        w.write_ontology_header()
+        for subject, predicates in entities:
+            w.write_entity(subject, predicates)
+        w.close()
+    return len(entities)
+
+
+STAGES = [
+    ('docbook_parse', setup_docbook_parse, run_docbook_parse),
+    ('parse_row', setup_parse_row, run_parse_row),
+    ('docbook_stream', setup_docbook_stream, run_docbook_stream),
+    ('vr_parse', setup_vr_parse, run_vr_parse),
+    ('clean_attrs', setup_clean_attrs, run_clean_attrs),
+    ('remove_duplicates', setup_remove_duplicates, run_remove_duplicates),
+    ('build_definitions', setup_build_definitions, run_build_definitions),
+    ('read_dicts', setup_read_dicts, run_read_dicts),
+    ('read_owl', setup_read_owl, run_read_owl),
+    ('tag_match', setup_tag_match, run_tag_match),
+    ('vr_backfill', setup_vr_backfill, run_vr_backfill),
+    ('write_def_dict', setup_write_def_dict, run_write_def_dict),
+    ('write_vr_dict', setup_write_vr_dict, run_write_vr_dict),
+    ('write_ttl', setup_write_ttl, run_write_ttl),
+]
+
+
+# running -----------------------------------------------------------------
+
+def _rss_kb():
+    ''' current resident size in KB (Linux), or None '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _reset_peak():
+    ''' Resets the peak resident size of this process to the current one (Linux 4.0+);
+    returns False where that is not possible
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _maxrss_kb():
+    ''' peak resident size in KB: VmHWM, which _reset_peak can reset, or ru_maxrss '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+
+def _stage_child(conn, ctx, setup, run, nrepeats):
+    ''' Runs in the child process: times run(setup(ctx)) nrepeats times and sends the result '''
+    try:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        sys.stdout.flush()
+        os.dup2(devnull, 1)
+        metrics.quiet = True
+        times = []
+        result = {}
+        for i in range(nrepeats):
+            args = setup(ctx)
+            gc.collect()
+            # where the peak cannot be reset, the setup's peak counts as the stage's
+            _reset_peak()
+            rss0 = _rss_kb()
+            t = time.time()
+            items = run(args)
+            times.append(time.time() - t)
+            if i == 0:
+                maxrss = _maxrss_kb()
+                result['peak_rss_kb'] = maxrss
+                if maxrss is not None and rss0 is not None:
+                    result['peak_delta_kb'] = max(0, maxrss - rss0)
+                result['items'] = items
+            del args
+        if tracemalloc is not None:
+            # one more run for the allocation peak; tracing slows it down too much to time it
+            args = setup(ctx)
+            gc.collect()
+            tracemalloc.start()
+            run(args)
+            result['peak_alloc_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        result['wall'] = min(times)
+        result['runs'] = times
+        conn.send(result)
+    except Exception:
+        conn.send({'error': traceback.format_exc().strip().split('\n')[-1]})
+    conn.close()
+
+
+def run_stage(ctx, name, setup, run, nrepeats=None):
+    ''' Result dict of one stage, measured in a child process '''
+    if nrepeats is None:
+        nrepeats = repeats
+    parent, child = multiprocessing.Pipe(False)
+    p = multiprocessing.Process(target=_stage_child, args=(child, ctx, setup, run, nrepeats))
+    p.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'error': 'stage process exited with status %s' % p.exitcode}
+    p.join()
+    return result
+
+
+def run_benchmarks(workDir, ntables=None, nelements=None, nrepeats=None, only=None):
+    ''' Writes the fixtures into workDir, runs the stages (all, or the names in only)
+    and returns the results
+    '''
+    if ntables is None:
+        ntables = fixtureTables
+    if nelements is None:
+        nelements = fixtureElements
+    ctx = {'workDir': workDir, 'parts': write_fixtures(workDir, ntables, nelements)}
+    if repoDir not in sys.path:
+        sys.path.insert(0, repoDir)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'fixture': {'tables': ntables, 'elements': nelements, 'seed': fixtureSeed,
+                    'part03_bytes': os.path.getsize(ctx['parts']['03']),
+                    'part06_bytes': os.path.getsize(ctx['parts']['06'])},
+        'repeats': nrepeats or repeats,
+        'stages': {},
+    }
+    for name, setup, run in STAGES:
+        if only and name not in only:
+            continue
+        result = run_stage(ctx, name, setup, run, nrepeats)
+        results['stages'][name] = result
+        if 'error' in result:
+            print ("%-18s skipped: %s" % (name, result['error']))
+        else:
+            print ("%-18s %8.3f s  %8s KB peak  %6d items" % (name, result['wall'],
+                   result.get('peak_delta_kb', '?'), result['items']))
+    return results
+
+
+def find_regressions(results, baseline):
+    ''' [{stage, metric, baseline, current, ratio}] for the stages that got slower or bigger '''
+    regressions = []
+    if baseline.get('fixture') != results.get('fixture'):
+        print ("warning: the baseline was measured on other fixtures (%s); not compared"
+               % baseline.get('fixture'))
+        return regressions
+    if baseline.get('python') != results.get('python'):
+        print ("warning: the baseline was measured with Python %s; not compared" % baseline.get('python'))
+        return regressions
+    for name, result in sorted(results['stages'].items()):
+        base = baseline.get('stages', {}).get(name)
+        if not base or 'error' in base or 'error' in result:
+            continue
+        for metric, floor in (('wall', minWallDelta), ('peak_delta_kb', minMemoryDelta)):
+            old = base.get(metric)
+            new = result.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * regressionFactor and new - old > floor:
+                regressions.append({'stage': name, 'metric': metric, 'baseline': old, 'current': new,
+                                    'ratio': round(float(new) / old, 2) if old else None})
+    return regressions
+
+
+def write_json(path, data):
+    text = json.dumps(data, indent=1, sort_keys=True, separators=(',', ': '))
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(text if isinstance(text, type(u'')) else text.decode('utf-8'))
+        f.write(u'\n')
+
+
+def main(args):
+    options = {'--tables': None, '--elements': None, '--repeats': None, '--out': resultsFilename,
+               '--baseline': os.path.join(repoDir, baselineFilename)}
+    saveBaseline = False
+    only = []
+    i = 0
+    while i < len(args):
+        if args[i] == '--save-baseline':
+            saveBaseline = True
+        elif args[i] == '--stage' and i + 1 < len(args):
+            only.append(args[i + 1])
+            i += 1
+        elif args[i] in options and i + 1 < len(args):
+            options[args[i]] = args[i + 1]
+            i += 1
+        else:
+            print (__doc__)
+            return 2
+        i += 1
+
+    workDir = tempfile.mkdtemp(prefix='dicom_bench_')
+    try:
+        results = run_benchmarks(workDir,
+                                 int(options['--tables']) if options['--tables'] else None,
+                                 int(options['--elements']) if options['--elements'] else None,
+                                 int(options['--repeats']) if options['--repeats'] else None,
+                                 only)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    regressions = []
+    baselinePath = options['--baseline']
+    if saveBaseline:
+        write_json(baselinePath, results)
+        print ("Wrote baseline %s" % baselinePath)
+    elif os.path.exists(baselinePath):
+        with io.open(baselinePath, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f))
+        results['baseline'] = baselinePath
+        for r in regressions:
+            print ("REGRESSION %s %s: %s -> %s (x%s)" % (r['stage'], r['metric'], r['baseline'],
+                   r['current'], r['ratio']))
+    results['regressions'] = regressions
+
+    write_json(options['--out'], results)
+    print ("Wrote %s" % options['--out'])
+    return 1 if regressions else 0
+
+
+##############################################################
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
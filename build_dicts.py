@@ -0,0 +1,249 @@
+'''
+  Regenerates both dictionaries, dicom_dict_vr.dict (vr_generate_dict.py,
+  from Parts 06 and 07) and dicom_dict_def.dict (def_generate_dict_reorg.py,
+  from Part 03), with the parsing spread over a pool of worker processes.
+
+  Building the ElementTree tables is CPU bound and the three Parts do not
+  depend on each other, so Part 06 and Part 07 are each one job and Part 03,
+  which is by far the largest, is cut into chunks of whole elements that
+  are parsed independently:
+
+    - one pass with expat (no tree is built) records the byte range of every
+      element down to splitDepth levels below <book>
+    - elements bigger than the chunk size are replaced by their children
+      (tables are never split), and the resulting pieces are grouped in
+      document order into chunks of about the chunk size
+    - each worker reads the byte ranges of its chunk, wraps them in the
+      <book> start tag of the Part (so the docbook namespace is declared)
+      and runs def_generate_dict_reorg.parse_docbook_stream over them
+
+  The results are collected in job order and chunk order, which is the order
+  the serial scripts see the tables in, before the duplicates are removed
+  and the entries sorted by tag, so the .dict files are the same as the
+  ones written by running the two scripts one after the other.
+
+  The Part locations are the ones set in vr_generate_dict.py and
+  def_generate_dict_reorg.py.
+
+  The counters of the parse functions are kept in the worker processes, so
+  the rows are counted here as the results come back.
+
+  Usage:
+    python build_dicts.py [number of worker processes]
+    (--quiet, --profile, --trace-memory, --metrics <file>: see metrics.py)
+
+'''
+
+import sys
+import io
+import mmap
+import multiprocessing
+import xml.parsers.expat
+
+import metrics
+import vr_generate_dict
+import def_generate_dict_reorg
+
+#************************************************
+#input parameters
+jobs = None             # worker processes; None = one per CPU
+chunksPerJob = 4        # Part 03 chunks per worker, to even out the chunk sizes
+splitDepth = 3          # how far below <book> elements are cut into chunks
+#************************************************
+
+_xmlDecl = b'<?xml version="1.0" encoding="utf-8"?>\n'
+
+
+def element_ranges(path, maxDepth=None):
+    ''' Scans the XML file at path with expat and returns
+    (root start tag, root name, [(depth, name, start, end)]) for the elements
+    down to maxDepth levels below the root, in document order; start and end
+    are byte offsets, end exclusive.
+    '''
+    if maxDepth is None:
+        maxDepth = splitDepth
+    f = open(path, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    ranges = []
+    root = []
+    open_ = []      # (depth, name, start, end of <x/>) of the open elements we keep
+    state = {'depth': -1}
+
+    parser = xml.parsers.expat.ParserCreate()
+
+    def start(name, attrs):
+        state['depth'] += 1
+        depth = state['depth']
+        at = parser.CurrentByteIndex
+        if depth == 0:
+            root.append(mm[at:mm.find(b'>', at) + 1])
+            root.append(name)
+        elif depth <= maxDepth:
+            tagEnd = mm.find(b'>', at) + 1
+            # <x/> has no end tag; for these expat reports the end at the following markup
+            open_.append((depth, name, at, tagEnd if mm[tagEnd - 2:tagEnd] == b'/>' else None))
+
+    def end(name):
+        depth = state['depth']
+        state['depth'] -= 1
+        if 0 < depth <= maxDepth:
+            d, n, at, emptyEnd = open_.pop()
+            if emptyEnd is None:
+                emptyEnd = mm.find(b'>', parser.CurrentByteIndex) + 1
+            ranges.append((d, n, at, emptyEnd))
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.ParseFile(f)
+
+    mm.close()
+    f.close()
+
+    # end handlers come children first; put the ranges back in document order
+    ranges.sort(key=lambda r: (r[2], r[0]))
+    return root[0], root[1], ranges
+
+
+def split_ranges(ranges, chunkSize):
+    ''' Turns the element ranges from element_ranges into pieces no bigger than
+    chunkSize where possible, by replacing big elements with their children.
+    Returns [(start, end)] in document order.
+    '''
+    pieces = []
+    i = 0
+    while i < len(ranges):
+        depth, name, start, end = ranges[i]
+        # children of this element are the following ranges that start before it ends
+        j = i + 1
+        while j < len(ranges) and ranges[j][2] < end:
+            j += 1
+        if end - start > chunkSize and j > i + 1 and name != 'table':
+            pieces += split_ranges(ranges[i + 1:j], chunkSize)
+        else:
+            pieces.append((start, end))
+        i = j
+    return pieces
+
+
+def group_pieces(pieces, chunkSize):
+    ''' Groups consecutive pieces into chunks of about chunkSize bytes '''
+    chunks = []
+    chunk = []
+    size = 0
+    for start, end in pieces:
+        if chunk and size + (end - start) > chunkSize:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append((start, end))
+        size += end - start
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def chunk_part(path, nchunks):
+    ''' Returns (root start tag, root name, [[(start, end)]]) splitting the Part at path
+    into about nchunks chunks
+    '''
+    rootTag, rootName, ranges = element_ranges(path)
+    top = [r for r in ranges if r[0] == 1]
+    if not top:
+        return rootTag, rootName, []
+    total = top[-1][3] - top[0][2]
+    chunkSize = max(1, total // max(1, nchunks))
+    return rootTag, rootName, group_pieces(split_ranges(ranges, chunkSize), chunkSize)
+
+
+def parse_part03_chunk(args):
+    ''' Worker: parses the tables in the byte ranges of one Part 03 chunk '''
+    path, rootTag, rootName, chunk = args
+    parts = [_xmlDecl, rootTag]
+    f = open(path, 'rb')
+    for start, end in chunk:
+        f.seek(start)
+        parts.append(f.read(end - start))
+    f.close()
+    parts.append(b'</' + rootName.encode('utf-8') + b'>')
+    return def_generate_dict_reorg.parse_docbook_stream(io.BytesIO(b''.join(parts)))
+
+
+def parse_vr_part(args):
+    ''' Worker: parses Part 06 or Part 07 for the VR dictionary '''
+    part, path = args
+    response = open(path, 'rb')
+    if part == '06':
+        attrs = vr_generate_dict.parse_part06(response)
+    else:
+        attrs = vr_generate_dict.parse_part07(response)
+    response.close()
+    return attrs
+
+
+def parse_parts(part03, part06, part07, nworkers=None):
+    ''' Parses the three Parts with nworkers processes
+    Returns (Element dicts from Parts 06 and 07, Element dicts from Part 03)
+    in the order the serial scripts would have produced them
+    '''
+    if nworkers is None:
+        nworkers = jobs or multiprocessing.cpu_count()
+
+    rootTag, rootName, chunks = chunk_part(part03, nworkers * chunksPerJob)
+    metrics.say("Parsing %s in %d chunks and Parts 06 and 07 with %d processes" % (part03, len(chunks), nworkers))
+    metrics.count('chunks', len(chunks))
+
+    pool = multiprocessing.Pool(nworkers)
+    try:
+        # start the VR Parts first; the Part 03 chunks fill in around them
+        vrJobs = [pool.apply_async(parse_vr_part, (('06', part06),)),
+                  pool.apply_async(parse_vr_part, (('07', part07),))]
+        defJobs = [pool.apply_async(parse_part03_chunk, ((part03, rootTag, rootName, chunk),))
+                   for chunk in chunks]
+
+        # collect in submission order so the merge does not depend on which worker finished first
+        vrAttrs = []
+        for job in vrJobs:
+            vrAttrs += job.get()
+        defAttrs = []
+        for job in defJobs:
+            defAttrs += job.get()
+        pool.close()
+        metrics.count('vr rows', len(vrAttrs))
+        metrics.count('def rows', len(defAttrs))
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return vrAttrs, defAttrs
+
+
+def main(nworkers=None):
+    with metrics.stage('parse'):
+        vrAttrs, defAttrs = parse_parts(def_generate_dict_reorg.fLoc, vr_generate_dict.part06Loc,
+                                        vr_generate_dict.part07Loc, nworkers)
+
+    with metrics.stage('build_attributes'):
+        main_attributes, mask_attributes = vr_generate_dict.build_attributes(vrAttrs)
+    with metrics.stage('write_vr'):
+        vr_generate_dict.write_vr_dict(main_attributes, mask_attributes)
+    metrics.count('tags written', len(main_attributes))
+    metrics.count('masks written', len(mask_attributes))
+
+    dupCounts = {}
+    moduleDefs = {}
+    with metrics.stage('build_definitions'):
+        attrsSort = def_generate_dict_reorg.build_definitions(defAttrs, dupCounts, moduleDefs)
+    with metrics.stage('write_def'):
+        def_generate_dict_reorg.write_def_dict(attrsSort, dupCounts, moduleDefs)
+    metrics.count('definitions written', len(attrsSort))
+
+
+##############################################################
+if __name__ == "__main__":
+    # --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py
+    args = metrics.start('build_dicts', sys.argv[1:])
+    main(int(args[0]) if args else None)
+    metrics.finish()
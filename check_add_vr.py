@@ -12,15 +12,16 @@
   This code checks to see if an entry specifies the VR value and 
   if not, retrieves it from the file 
   /home/karl/Work/INCF/XML_code/dicom_dict_vr.py
+  (through dicom_dict.py, which parses it only once per run, or with
+  useDb = True from the SQLite database of dicom_db.py built next to it)
   which was created by the code: 
   /home/karl/Work/INCF/XML_code/vr_generate_dict.py
 
-  This code skips reads lines until it finds 
-  a line containing "Datatype Properties" and continues to read lines 
-  until is finds a line that contains "dicom#dicom".  It collects 
-  lines in the variable "entry" until it encounters a line containing 
-  " ." which is the ending character for an entry. If it finds
-  a line containing "dicom:VR" then it writes the entry after removing 
+  The owl file is read one entity block at a time by owl_reader.py, which
+  yields each "###  http://purl.org/nidash/dicom#dicom..." block (up to 
+  the " ." that ends the entry) together with its parsed predicates. 
+  Blocks before the "Datatype Properties" section are skipped. If the 
+  entry has a "dicom:VR" predicate then it writes the entry after removing 
   an extra blank line that was written into the original owl file as
   the line previous to the line containing the VR info. The code then 
   writes that entry to the output file and then reads on, collecting the 
@@ -38,6 +39,16 @@
   unchanged into the output file.
 
 
+  Incremental mode (python check_add_vr.py --incremental) patches the
+  ontology file in place instead of writing the Datatype section to a new
+  file. A hash of every entity block is kept in a state file next to the
+  ontology (dicom_ontology.owl.vrstate); blocks whose hash is unchanged 
+  since the last run (and a VR dictionary that has not changed) are not
+  looked at again. Only blocks whose VR is missing or differs from the
+  dictionary are rewritten; every other byte of the file, including the 
+  header and the Object Properties section, is copied unchanged.
+
+
 Sample Complete Entry
 ------------------------------------------------
 ###  http://purl.org/nidash/dicom#dicom_00280011
@@ -68,7 +79,12 @@ Massachusetts General Hospital, 2018
 
 import os, sys
 import re
-import ast
+import json
+import hashlib
+
+import dicom_dict
+import metrics
+import owl_reader
 
 #************************************************
 #input parameters
@@ -79,45 +95,52 @@ outFilename = 'dicom_ontology_new.owl'
 vrDir = '/home/karl/Work/INCF/XML_code/'
 vrFilename = 'dicom_dict_vr.dict'
 startEntry = 'dicom#dicom'
-endEntry = ' .'
 startPlace = 'Datatype Properties'
+vrPredicate = 'dicom:VR'
+stateSuffix = '.vrstate'    # per-entity hashes for --incremental
+useDb = False               # look the VRs up in the dicom_db.py database next to the VR dictionary
 #************************************************
 
-def search_vr(entry):
-    #make 1 string rather than searching in each string individually
-    #this is faster than using some version of "any"
-    combined = ' '.join(entry) 
-    test = 'dicom:VR' in combined
+def search_vr(entity):
+    # the predicates of the entity were already parsed by owl_reader
+    test = vrPredicate in entity.predicates
 
     return test
 
 
-def get_tag(entry):
+def get_tag(entity):
 
-    # check each line in entry for the dicom tag
-    for e in entry:
-        if 'rdf:type' in e:
-            t = re.search('dicom_(.+?) ', e)
-            tag = t.group(1)
-            if tag:
-                #print "The DICOM tag is: ", tag
-                return tag
-            else:
-                #this will crash the program since no tag value is returned
-                print "no dicom tag value found in: ", entry 
+    # the dicom tag is the part of the subject after "dicom_",
+    # e.g. dicom:dicom_00280011 -> 00280011
+    t = re.search('dicom_(.+)$', entity.subject)
+    if t:
+        tag = t.group(1)
+        #print "The DICOM tag is: ", tag
+        return tag
+    else:
+        metrics.say("no dicom tag value found in: ", entity.subject)
+        return ''
     
 
+def lookup_vr(vrDir, vrFilename, tag):
+    # the dictionary is parsed once per process by dicom_dict and kept
+    # in memory, so this is a plain dict lookup after the first call;
+    # with useDb it is an indexed query on the database built next to it
+    if useDb:
+        import dicom_db
+        return dicom_db.open_db(vrDir+vrFilename).get_vr(tag)
+    return dicom_dict.get_vr(tag, vrDir+vrFilename)
+
+
 def get_vr(vrDir, vrFilename, tag):
+    vr = None
     if tag:
-        vrF = open(vrDir+vrFilename, 'r').read()
-        dicomDict = ast.literal_eval(vrF)
-        if tag:
-            vr = dicomDict.get(tag,'')[0]
-            #print "vr value is = ", vr    
-            return vr
-    else:
-        print "vr value not found for tag = ", tag
-        return None
+        vr = lookup_vr(vrDir, vrFilename, tag)
+        #print "vr value is = ", vr    
+    if vr is None:
+        metrics.count('vr not found')
+        metrics.say("vr value not found for tag = ", tag)
+    return vr
 
 
 def add_vr_to_entry(vr, entry):
@@ -146,43 +169,186 @@ def remove_sequential_blanks_in_entry(entry):
 
 def main():
 
-    # open the dicom ontology file and start reading
+    # open the dicom ontology file and read it one entity block at a time
     with open(inDir+inFilename, 'r') as inFile, open(outDir+outFilename, 'w') as outFile:
-        entry = []
-        copy = False 
         dt = False
-        for line in inFile: 
-            if startPlace in line: #find "Datatype Properties" line and start here
+        for entity in owl_reader.iter_entities(inFile):
+            if entity.section == startPlace and not dt: #find "Datatype Properties" section and start here
+                dt = True
+                metrics.say("starting place is:", startPlace)
+
+            if dt == True and startEntry in entity.iri: #start check in Datatype Prop section
+                entry = list(entity.lines)
+                metrics.count('entities')
+
+                #now check the entry as a whole
+                vrFlag = search_vr(entity) #see if the entry has a VR line
+                tag = get_tag(entity)  #extract the tag from entry
+                metrics.say(tag, vrFlag)
+                if vrFlag == False and ("xxxx" not in tag):
+                    vr = get_vr(vrDir, vrFilename, tag)      #get vr value from the dict
+                else:
+                    vr = None
+                if vr is not None:
+                    metrics.count('vr added')
+                    entry1 = add_vr_to_entry(vr, entry)
+                    write_entry(entry1, outFile)    #write entry with added vr to outfile
+                else:
+                    entry2 = remove_sequential_blanks_in_entry(entry)
+                    write_entry(entry2, outFile)    #write unchanged entry to outfile
+
+
+
+def entry_vr(entity):
+    # VR value written in the entity, e.g. '"US"^^xsd:string' -> 'US'
+    values = entity.predicates.get(vrPredicate)
+    if not values:
+        return None
+    v = re.match(r'"([^"]*)"', values[0])
+    if v:
+        return v.group(1)
+    return values[0]
+
+
+def replace_vr_in_entry(vr, entry):
+    # swap the value on the existing "dicom:VR" line, keeping the rest of the line
+    for i in range(len(entry)):
+        if vrPredicate in entry[i]:
+            entry[i] = re.sub(r'dicom:VR(\s+)"[^"]*"', r'dicom:VR\g<1>"%s"' % vr, entry[i], 1)
+            break
+
+    return entry
+
+
+def block_hash(entry):
+    # entry holds the byte lines read from the owl file
+    return hashlib.sha1(b''.join(entry)).hexdigest()
+
+
+def native_lines(entry):
+    # the patch functions work on str lines; on Python 3 decode the byte lines
+    return [line if isinstance(line, str) else line.decode('utf-8') for line in entry]
+
+
+def byte_lines(entry):
+    return [line if isinstance(line, bytes) else line.encode('utf-8') for line in entry]
+
+
+def read_state(stateFile):
+    try:
+        with open(stateFile, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'dict': None, 'hashes': {}}
+
+
+def write_state(stateFile, state):
+    with open(stateFile+'.tmp', 'w') as f:
+        json.dump(state, f, sort_keys=True)
+    os.rename(stateFile+'.tmp', stateFile)
+
+
+def main_incremental(onlyTags=None):
+
+    # Patch the VR of the Datatype entries of the ontology in place. Entries whose block 
+    # is unchanged since the last run are skipped unless the VR dictionary changed.
+    # If onlyTags is given, only entries for those tags are checked.
+    owlFile = inDir+inFilename
+    stateFile = owlFile+stateSuffix
+    vrStat = os.stat(vrDir+vrFilename)
+    dictSignature = [vrStat.st_size, vrStat.st_mtime]
+
+    state = read_state(stateFile)
+    oldHashes = state['hashes']
+    if state['dict'] != dictSignature:
+        oldHashes = {}      # every entry has to be checked against the new dictionary
+    hashes = {}
+    seen = {}
+    patches = []            # (start byte, end byte, new lines)
+    checked = 0
+
+    with open(owlFile, 'rb') as inFile:
+        dt = False
+        for entity in owl_reader.iter_entities(inFile):
+            if entity.section == startPlace:
                 dt = True
-                print "starting place is:", startPlace
-
-            if dt == True: #start check after Datatype Prop line
-                if startEntry in line:
-                    copy = True
-                    #print 'start of entry'
-                if endEntry in line:
-                    copy = False
-                    entry.append(line)        #append the last line of entry
-                    #print 'end of entry'
-
-                    #now check the entry list as a whole
-                    vrFlag = search_vr(entry) #see if the entry has a VR line
-                    tag = get_tag(entry)  #extract the tag from entry
-                    print tag, vrFlag
-                    if vrFlag == False and ("xxxx" not in tag):
-                        vr = get_vr(vrDir, vrFilename, tag)      #get vr value from the dict
-                        entry1 = add_vr_to_entry(vr, entry)
-                        write_entry(entry1, outFile)    #write entry with added vr to outfile
-                        entry = []            #clear entry list when finished
-                    else:
-                        entry2 = remove_sequential_blanks_in_entry(entry)
-                        write_entry(entry2, outFile)    #write unchanged entry to outfile
-                        entry = []
-                elif copy:
-                    entry.append(line)
+            if not (dt and startEntry in entity.iri):
+                continue
+
+            # an IRI can have more than one block; key each by its occurrence
+            n = seen.get(entity.iri, 0)
+            seen[entity.iri] = n+1
+            key = '%s %d' % (entity.iri, n)
+            entry = list(entity.lines)
+            metrics.count('entities')
+            h = block_hash(entry)
+            tag = get_tag(entity)
+            if "xxxx" in tag:
+                continue
+            if onlyTags is not None and tag not in onlyTags:
+                # not checked: keep what the state said about it
+                if key in state['hashes']:
+                    hashes[key] = state['hashes'][key]
+                continue
+            if oldHashes.get(key) == h:
+                metrics.count('unchanged entities')
+                hashes[key] = h
+                continue
+
+            checked = checked+1
+            vr = lookup_vr(vrDir, vrFilename, tag)
+            oldVr = entry_vr(entity)
+            if vr is not None and oldVr is None:
+                entry = byte_lines(add_vr_to_entry(vr, native_lines(entry)))
+            elif vr is not None and oldVr != vr:
+                entry = byte_lines(replace_vr_in_entry(vr, native_lines(entry)))
+            else:
+                hashes[key] = h
+                continue
+
+            metrics.say(tag, oldVr, '->', vr)
+            patches.append((entity.start_byte, entity.end_byte, entry))
+            hashes[key] = block_hash(entry)
+
+    metrics.count('entities checked', checked)
+    metrics.count('entities patched', len(patches))
+    if patches:
+        # copy the file, replacing only the patched blocks
+        with open(owlFile, 'rb') as inFile, open(owlFile+'.tmp', 'wb') as outFile:
+            pos = 0
+            for start, end, entry in patches:
+                outFile.write(inFile.read(start-pos))
+                inFile.seek(end)
+                write_entry_lines(entry, outFile)
+                pos = end
+            outFile.write(inFile.read())
+        os.rename(owlFile+'.tmp', owlFile)
+
+    # a partial run against another dictionary leaves the other entries unchecked,
+    # so the state stays with the dictionary they were checked against
+    if onlyTags is not None and state['dict'] != dictSignature:
+        dictSignature = state['dict']
+    write_state(stateFile, {'dict': dictSignature, 'hashes': hashes})
+    metrics.say("checked %d entries, patched %d" % (checked, len(patches)))
+
+    return len(patches)
+
+
+def write_entry_lines(entry, outFile):
+    # unlike write_entry, add nothing after the entry
+    for line in entry:
+        outFile.write(line)
 
 
 
 ##############################################################
 if __name__ == "__main__":
-    main()
+    # also --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py
+    args = metrics.start('check_add_vr', sys.argv[1:])
+    if '--incremental' in args:
+        with metrics.stage('main_incremental'):
+            main_incremental()
+    else:
+        with metrics.stage('main'):
+            main()
+    metrics.finish()
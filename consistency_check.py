@@ -0,0 +1,386 @@
+'''
+  Consistency check between the generated dictionaries
+  (dicom_dict_vr.dict, dicom_dict_mask.dict, dicom_dict_def.dict) and the
+  ontology files (dicom_ontology.owl, dicom_ontology_nlx.owl).
+
+  All sources are read as streams of (tag, values) in tag order and joined
+  on the 8-character tag in a single sorted merge:
+
+    - the dictionaries through their compiled sidecars (dict_cache.py),
+      which iterate in tag order from the mmap without evaluating the .dict
+      files; the text of dicom_dict_def.dict is only scanned
+      (dict_cache.iter_dict_entries) for tags defined more than once
+    - each ontology file through owl_reader, one block at a time; of every
+      data element (rdf:type owl:DatatypeProperty) only the tag, label, VR,
+      definitions and IRI are kept, and those rows are sorted by tag
+
+  Checks, by name as they appear in the report:
+
+    vr_mismatch             VR of the ontology entry differs from the VR
+                            dictionary (or the mask dictionary for 60xx-style tags)
+    missing_vr              the ontology entry has no dicom:VR
+    label_mismatch          rdfs:label differs from the Name of the VR
+                            dictionary (source "def": the Name in the
+                            definitions dictionary differs from it);
+                            zero-width spaces and runs of blanks are ignored
+    retired_mismatch        the VR dictionary says Retired but the entry is not
+                            below the "Retired Data Element" class of the
+                            ontology (hierarchy.py), or the other way round
+    missing_definition      the ontology entry has no obo:IAO_0000115
+                            (source "def": no entry in the definitions dictionary)
+    truncated_definition    a definition ends in "See", "described in", ...
+                            where the docbook text referred to another section
+    duplicate_tag           several ontology entities carry the same tag, or
+                            dicom_dict_def.dict defines a tag more than once
+                            with different values
+    orphan                  ontology data element whose tag is in neither the
+                            VR nor the mask dictionary, or that has no tag
+    missing_in_ontology     tag of the VR or mask dictionary with no data
+                            element in the ontology file
+
+  The report is JSON:
+
+    {"sources": {"vr": path, ...},
+     "counts": {check: {source: n}},
+     "issues": [{"check": ..., "tag": ..., "source": ..., "iri": ...,
+                 "expected": ..., "found": ...}, ...]}
+
+  with the issues in tag order; "source" is the ontology file name or the
+  dictionary ("vr", "def") the issue is about.
+
+  Usage:
+    python consistency_check.py [report.json] [--check name,name]
+  also --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py.
+  The exit status is 1 if any issue was found.
+
+'''
+
+import os, sys
+import io
+import re
+import json
+from collections import OrderedDict
+
+import dicom_db
+import dict_cache
+import hierarchy
+import metrics
+import owl_reader
+
+#************************************************
+#input parameters
+reportFilename = 'dicom_consistency.json'
+elementType = 'owl:DatatypeProperty'        # ontology entities that are data elements
+retiredLabel = 'Retired Data Element'       # label of the class retired elements belong under
+typePredicates = ('rdf:type', 'a')
+truncatedEnding = re.compile(r'(?:\b[Ss]ee|\b(?:described|defined|specified|given|listed|shown) in)\s*[:,]?\s*$')
+#************************************************
+
+CHECKS = ('vr_mismatch', 'missing_vr', 'label_mismatch', 'retired_mismatch', 'missing_definition',
+          'truncated_definition', 'duplicate_tag', 'orphan', 'missing_in_ontology')
+
+# fields of the dictionary values
+VR, NAME, RETIRED = 0, 2, 3
+DEF_NAME, DEF_TEXT = 0, 1
+
+_blanks = re.compile(u'[\\s\u200b]+')
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def normalize(s):
+    ''' s without zero-width spaces and with single blanks, for comparing labels '''
+    return _blanks.sub(u' ', _text(s)).strip() if s is not None else None
+
+
+def first_literal(terms):
+    for term in terms or ():
+        value = dicom_db.literal_value(term)
+        if value is not None:
+            return value
+    return None
+
+
+def is_truncated(definition):
+    return bool(truncatedEnding.search(_text(definition)))
+
+
+class Element(object):
+    ''' what is kept of one ontology data element '''
+
+    __slots__ = ('iri', 'tag', 'label', 'vr', 'definitions', 'isElement')
+
+    def __init__(self, iri):
+        self.iri = iri
+        self.tag = self.label = self.vr = None
+        self.definitions = []
+        self.isElement = False
+
+
+def read_ontology(owlPath):
+    ''' (data elements sorted by (tag, IRI), IRI of the retired class or None) of owlPath.
+    Elements without a tag sort first, with tag None.
+    '''
+    prefixes = {}
+    elements = OrderedDict()
+    retiredIri = None
+    with open(owlPath, 'rb') as f:
+        for entity in owl_reader.iter_entities(f, prefixes):
+            iri = _text(entity.iri)
+            p = entity.predicates
+            label = first_literal(p.get(dicom_db.labelPredicate))
+            if retiredIri is None and normalize(label) == retiredLabel:
+                retiredIri = iri
+            e = elements.get(iri)
+            if e is None:
+                e = elements[iri] = Element(iri)
+            if not e.isElement:
+                e.isElement = any(_text(t) == elementType for pred in typePredicates
+                                  for t in p.get(pred, ()))
+            if e.tag is None:
+                e.tag = dicom_db.entity_tag(re.split(r'[#/]', iri)[-1], p)
+            if e.label is None:
+                e.label = label
+            if e.vr is None:
+                e.vr = first_literal(p.get(dicom_db.vrPredicate))
+            for term in p.get(dicom_db.definitionPredicate, ()):
+                value = dicom_db.literal_value(term)
+                if value is not None and value not in e.definitions:
+                    e.definitions.append(value)
+            metrics.count('ontology blocks')
+    found = [e for e in elements.values() if e.isElement]
+    found.sort(key=lambda e: (e.tag or u'', e.iri))
+    return found, retiredIri
+
+
+def group_by_tag(elements):
+    ''' (tag, [elements]) from elements sorted by tag '''
+    tag, group = None, []
+    for e in elements:
+        if group and e.tag != tag:
+            yield tag, group
+            group = []
+        tag = e.tag
+        group.append(e)
+    if group:
+        yield tag, group
+
+
+def merge_join(streams):
+    ''' Sorted merge of (tag, value) streams with unique, ascending tags.
+    Yields (tag, [value or None for each stream]) in tag order.
+    '''
+    iters = [iter(s) for s in streams]
+    heads = [next(it, None) for it in iters]
+    while True:
+        tags = [_text(h[0]) for h in heads if h is not None]
+        if not tags:
+            return
+        tag = min(tags)
+        values = []
+        for i, h in enumerate(heads):
+            if h is not None and _text(h[0]) == tag:
+                values.append(h[1])
+                heads[i] = next(iters[i], None)
+            else:
+                values.append(None)
+        yield tag, values
+
+
+def def_duplicates(defPath):
+    ''' [(tag, entries, distinct values)] for the tags dicom_dict_def.dict defines more than
+    once with different values, in tag order
+    '''
+    with io.open(defPath, 'r', encoding='utf-8') as f:
+        text = f.read()
+    seen = {}
+    for tag, values in dict_cache.iter_dict_entries(text):
+        s = seen.get(tag)
+        if s is None:
+            seen[tag] = [1, set([values])]
+        else:
+            s[0] += 1
+            s[1].add(values)
+    return [(tag, seen[tag][0], len(seen[tag][1])) for tag in sorted(seen) if len(seen[tag][1]) > 1]
+
+
+class Report(object):
+    ''' issues collected in tag order, with counts per check and source '''
+
+    def __init__(self, checks=CHECKS):
+        self.checks = set(checks)
+        self.issues = []
+        self.counts = OrderedDict((c, OrderedDict()) for c in CHECKS if c in self.checks)
+
+    def add(self, check, tag, source, iri=None, expected=None, found=None):
+        if check not in self.checks:
+            return
+        issue = OrderedDict([('check', check), ('tag', tag), ('source', source)])
+        if iri is not None:
+            issue['iri'] = iri
+        if expected is not None:
+            issue['expected'] = expected
+        if found is not None:
+            issue['found'] = found
+        self.issues.append(issue)
+        counts = self.counts[check]
+        counts[source] = counts.get(source, 0) + 1
+
+    def total(self):
+        return len(self.issues)
+
+
+def check_dicts(report, tag, vr, mask, definition):
+    ''' checks between the dictionaries themselves '''
+    entry = vr or mask
+    if definition is None:
+        if vr is not None:
+            report.add('missing_definition', tag, 'def')
+        return
+    if is_truncated(definition[DEF_TEXT]):
+        report.add('truncated_definition', tag, 'def', found=_text(definition[DEF_TEXT])[-60:])
+    if entry is not None and normalize(definition[DEF_NAME]) != normalize(entry[NAME]):
+        report.add('label_mismatch', tag, 'def', expected=entry[NAME], found=definition[DEF_NAME])
+
+
+def check_elements(report, tag, vr, mask, group, source, isRetired):
+    ''' checks of the ontology elements with one tag against the dictionaries '''
+    if group is None:
+        if vr is not None or mask is not None:
+            report.add('missing_in_ontology', tag, source)
+        return
+    if tag is None:
+        for e in group:
+            report.add('orphan', None, source, e.iri, found=e.label)
+        return
+    if len(group) > 1:
+        report.add('duplicate_tag', tag, source, found=[e.iri for e in group])
+    entry = vr or mask
+    for e in group:
+        if entry is None:
+            report.add('orphan', tag, source, e.iri, found=e.label)
+            continue
+        if e.vr is None:
+            report.add('missing_vr', tag, source, e.iri, expected=entry[VR])
+        elif e.vr.strip() != entry[VR].strip():
+            report.add('vr_mismatch', tag, source, e.iri, expected=entry[VR], found=e.vr)
+        if normalize(e.label) != normalize(entry[NAME]):
+            report.add('label_mismatch', tag, source, e.iri, expected=entry[NAME], found=e.label)
+        retired = entry[RETIRED] == 'Retired'
+        if isRetired is not None and retired != isRetired(e.iri):
+            report.add('retired_mismatch', tag, source, e.iri, expected=retired, found=not retired)
+        if not e.definitions:
+            report.add('missing_definition', tag, source, e.iri)
+        for d in e.definitions:
+            if is_truncated(d):
+                report.add('truncated_definition', tag, source, e.iri, found=_text(d)[-60:])
+
+
+def check(vrPath=None, checks=CHECKS):
+    ''' Joins the dictionaries next to vrPath (default: those in dicom_dict.dictDir) with the
+    ontology files there; returns the report as a dict ready for json.dump
+    '''
+    sources = OrderedDict(dicom_db.source_paths(vrPath))
+    owlPaths = [path for kind, path in dicom_db.source_paths(vrPath) if kind == 'owl']
+    report = Report(checks)
+
+    with metrics.stage('open_dicts'):
+        vr = dict_cache.open_dict(sources['vr'])
+        mask = dict_cache.open_dict(sources['mask']) if 'mask' in sources else {}
+        defs = dict_cache.open_dict(sources['def']) if 'def' in sources else {}
+
+    ontologies = []     # (file name, (tag, elements) stream, retired test)
+    for owlPath in owlPaths:
+        with metrics.stage('read_ontology'):
+            elements, retiredIri = read_ontology(owlPath)
+        metrics.count('ontology elements', len(elements))
+        isRetired = None
+        if retiredIri is not None:
+            with metrics.stage('hierarchy'):
+                h = hierarchy.open_hierarchy(owlPath)
+            isRetired = lambda iri, h=h, r=retiredIri: h.is_descendant(iri, r)
+        ontologies.append((os.path.basename(owlPath), group_by_tag(elements), isRetired))
+
+    with metrics.stage('join'):
+        # elements without a tag come first, as tag None
+        streams = [vr.iteritems(),
+                   mask.iteritems() if mask else iter(()),
+                   defs.iteritems() if defs else iter(())]
+        untagged = []
+        for name, groups, isRetired in ontologies:
+            first = next(groups, None)
+            if first is not None and first[0] is None:
+                untagged.append((name, first[1], isRetired))
+                first = None
+            streams.append(_prepend(first, groups))
+        for name, group, isRetired in untagged:
+            check_elements(report, None, None, None, group, name, isRetired)
+
+        for tag, values in merge_join(streams):
+            metrics.count('tags joined')
+            v, m, d = values[:3]
+            check_dicts(report, tag, v, m, d)
+            for (name, groups, isRetired), group in zip(ontologies, values[3:]):
+                check_elements(report, tag, v, m, group, name, isRetired)
+
+    if 'def' in sources and 'duplicate_tag' in report.checks:
+        with metrics.stage('def_duplicates'):
+            for tag, n, distinct in def_duplicates(sources['def']):
+                report.add('duplicate_tag', tag, 'def', expected=1, found=distinct)
+
+    result = OrderedDict()
+    result['sources'] = sources
+    result['counts'] = report.counts
+    result['issues'] = report.issues
+    return result
+
+
+def _prepend(first, rest):
+    if first is not None:
+        yield first
+    for item in rest:
+        yield item
+
+
+def main(args):
+    outPath = reportFilename
+    checks = CHECKS
+    i = 0
+    while i < len(args):
+        if args[i] == '--check' and i + 1 < len(args):
+            checks = [c.strip() for c in args[i + 1].split(',') if c.strip()]
+            unknown = [c for c in checks if c not in CHECKS]
+            if unknown:
+                sys.stderr.write("unknown check(s) %s; known: %s\n" % (', '.join(unknown), ', '.join(CHECKS)))
+                return 2
+            i += 1
+        else:
+            outPath = args[i]
+        i += 1
+
+    result = check(checks=checks)
+    with metrics.stage('write_report'):
+        text = json.dumps(result, indent=1, separators=(',', ': '))
+        with io.open(outPath, 'w', encoding='utf-8') as f:
+            f.write(_text(text) + u'\n')
+
+    total = 0
+    for name, counts in result['counts'].items():
+        for source, n in counts.items():
+            metrics.say(u'%-22s %-24s %6d' % (name, source, n))
+            total += n
+    metrics.say(u'%d issues, written to %s' % (total, outPath))
+    return 1 if total else 0
+
+
+##############################################################
+if __name__ == "__main__":
+    # also --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py
+    args = metrics.start('consistency_check', sys.argv[1:])
+    status = main(args)
+    metrics.finish()
+    sys.exit(status)
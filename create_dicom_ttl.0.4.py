@@ -19,16 +19,24 @@ Massachusetts General Hospital
 '''
 
 import os, sys
+import io
 import re
-from operator import itemgetter
 import pickle
 
+import label_match
+import metrics
+import ttl_writer
+import triple_export
+
 #************************************************
 #input parameters
 #outDir = '/home/karl/Work/INCF/nidm/nidm/nidm/nidm-experiment/imports/'
 outDir = '/home/karl/Work/INCF/dicom-ontology/'
 outFile = 'dicom_numericalID.ttl'
 tagDefFile = 'all_tag_definition.txt'
+matchFile = 'label_match_candidates.tsv'   # candidate matches from string_match for review
+matchLabels = False     # match the Neurolex rows on labels (string_match) instead of tags (--match-labels)
+exportTriples = True    # also write outFile's statements as .nt and .trp (triple_export.py)
 # The following file version is the one that replaces the greek mu with "u"
 # Use of mu means dealing with unicode processing 
 inFile = '/home/karl/Work/INCF/dicom-ontology/Clunie_DICOM_definitions-us.txt'
@@ -48,41 +56,27 @@ dcID = 'dc:identifier'
 labelStr = 'label'
 subClass = 'subClassOf'
 provNS = 'prov:'
-xsdString = '^^xsd:string '
 definitionStr = 'obo:IAO_0000115'
 editorNote = 'obo:IAO_0000116 "To be discussed."'
-curationStatusReady = 'obo:IAO_0000114  obo:IAO_0000122 '
-curationStatusReqDisc = 'obo:IAO_0000114  obo:IAO_0000428 '
+curationStatus = 'obo:IAO_0000114'
+statusReady = 'obo:IAO_0000122'
+statusReqDisc = 'obo:IAO_0000428'
+nlxNS = 'nlx:'
 classLink = 'http://purl.org/nidash/dicom#'
 nlxLink = 'http://uri.neuinfo.org/nif/nifstd/'
 idStart = 500
+ontologyBase = 'http://www.owl-ontologies.com/Ontology1298855822.owl'
 #************************************************
 
-def write_ontology_header(ttlFile):
-
-    ttlFile.write("@prefix : <http://www.semanticweb.org/owl/owlapi/turtle#> .\n")
-    ttlFile.write("@prefix owl: <http://www.w3.org/2002/07/owl#> .\n")
-    ttlFile.write("@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n")
-    ttlFile.write("@prefix xml: <http://www.w3.org/XML/1998/namespace> .\n")
-    ttlFile.write("@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n")
-    ttlFile.write("@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n")
-    ttlFile.write("@prefix nidm: <http://www.incf.org/ns/nidash/nidm#> .\n")
-    ttlFile.write("@prefix dc: <http://purl.org/dc/elements/1.1/> . .\n")
-    ttlFile.write("@prefix obo: <http://purl.obolibrary.org/obo/> .\n")
-    ttlFile.write("@prefix nlx: <http://uri.neuinfo.org/nif/nifstd/> .\n")
-    ttlFile.write("@base <http://www.owl-ontologies.com/Ontology1298855822.owl> .\n")
-    ttlFile.write("\n")
-    ttlFile.write(classLink+"[ rdf:type owl:Ontology ] .\n")
-
-
-def write_class_header(ttlFile):
-    ttlFile.write('\n')
-    ttlFile.write('#################################################################\n')
-    ttlFile.write('#\n')
-    ttlFile.write('#    Datatype Properties\n')
-    ttlFile.write('#\n')
-    ttlFile.write('#################################################################\n')
-    ttlFile.write('\n')
+def write_ontology_header(ttl):
+    # the prefixes of dicom_ontology.owl plus nlx: for the Neurolex IDs; the
+    # writer checks every term against them, so the file parses as Turtle
+    ttl.write_prefixes()
+    ttl.write_ontology_header()
+
+
+def write_class_header(ttl):
+    ttl.write_section('Datatype Properties')
     
 
 # The following two functions are used to create camelCase version of DICOM tag label
@@ -103,136 +97,132 @@ def write_class_header(ttlFile):
 #    return s
 
 
-# The following two functions are used to match term labels from the two input files
-# Used in string_match function
-def max_list_value(list,i):
-    # this function returns a tuple of the (index, maxValue) for a list
-    # you supply the list and the index of the place within the list that you 
-    # want the max of.
-    return max(enumerate(sub[i] for sub in list), key=itemgetter(1))
-
-
-def string_match(label,nlxData):
+# The following function is used to match term labels from the two input files
+# The matching itself (token index and scoring) is done in label_match.py
+def string_match(label,nlxData,labelIndex,matchOut=None):
     # this code takes an input string (dicom tag label) and tries to find an 
-    # exact match in another list of labels. If no exact match is found, finds 
-    # the closest match from a list of labels in which there is at least one 
-    # match between the original label and the possible label.
+    # exact match in another list of labels. If no exact match is found, takes 
+    # the best scoring label from the list of labels that share at least one
+    # word with the original label (see label_match.py for the scoring).
+    # Nothing is asked on the console: every candidate is written to matchOut
+    # (an open text file, see label_match.write_candidate_header) for review.
+    # labelIndex is label_match.LabelIndex([row[0] for row in nlxData]), built once.
 
-    # find the length of the list of possible labels
-    neuroLines = len(nlxData)
-    exactMatch = 'False'
+    neurolexID = 'NF'
+    dicomTagID = 'NF'
+    vrCode = 'NF'
     noMatch = 'True' 
 
-    print "considering DICOM file label = "+label
+    metrics.say("considering DICOM file label = "+label)
 
-    for i in range(neuroLines):
-        partMatch = 'False'
-        tempStore = []
-        # check for exact match
-        #print "DICOM_label=",label, " nlxData_label=",nlxData[i][0]
-        if nlxData[i][0] == label:
-            vrCode = nlxData[i][3]
-            dicomTagID = nlxData[i][2]
+    # check for exact match
+    i = labelIndex.find_exact(label)
+    exact = i is not None
+    if exact:
+        metrics.say("match for ", label)
+        candidates = [(i, 1.0)]
+    else:
+        candidates = labelIndex.candidates(label)
+        if candidates:
+            metrics.say('partial match for '+label)
+
+    for n, (i, score) in enumerate(candidates):
+        if matchOut is not None:
+            label_match.write_candidate(matchOut, label, nlxData[i], score, exact, n == 0)
+        if n == 0:
+            # put values for best match into variables for return 
             neurolexID = nlxData[i][1]
-            print "match for ", label
-            exactMatch = 'True'
+            dicomTagID = nlxData[i][2]
+            vrCode = nlxData[i][3]
             noMatch = 'False'
-            break
-    # if no exact match, find how many words in the orig label are in the possible label 
-    # if none, go to next nlxLabel in nlxData
-        else:
-            matchCount = 0
-            labelPart = label.split()
-            filteredLabelPart = [s for s in labelPart if len(s) > 2] #don't match 2-or-less length words
-            for lp in filteredLabelPart:
-                #print lp
-                if lp in nlxData[i][0]:
-                    matchCount = 1+matchCount
-
-            # if at least one matching word, store needed info as list in list tempStore
-            if matchCount != 0:
-                partMatch = 'True'
-                tempStore.append([nlxData[i][0], nlxData[i][2], nlxData[i][1], nlxData[i][3], matchCount])
-
-    if (partMatch == 'True') and (exactMatch == 'False'):
-        print "Dicom label = "+label+"\n"
-        print "Neurolex entry = ", tempStore
-
-        if len(tempStore) > 1: #if only a single term matches then assume that it's not a match
-            isMatch = input("Is this a match (1/0)?")
-            if isMatch:
-                print 'partial match for '+label
-                maxAndWhere = max_list_value(tempStore,-1)  # tuple
-                print maxAndWhere
-                k=maxAndWhere[0]    #put the index of the best match into k
-                # put values for best match into variables for return 
-                neurolexID = tempStore[k][2]
-                dicomTagID = tempStore[k][1]
-                vrCode = tempStore[k][3]
-                noMatch = 'False'
-            else:
-                partMatch = 'False'
-        else:
-            partMatch = 'False'
-
-    if (partMatch == 'False') and (exactMatch == 'False'):
-        noMatch = 'True'
-        neurolexID = 'NF'
-        dicomTagID = 'NF'
-        vrCode = 'NF'
-        print "no match for "+label
+
+    if noMatch == 'True':
+        metrics.count('label misses')
+        metrics.say("no match for "+label)
+    else:
+        metrics.count('label matches')
             
     return neurolexID, dicomTagID, vrCode, noMatch
 
 
 
-def tag_match(tag,nlxData):
+def build_tag_index(nlxData):
+    '''
+    Puts the Neurolex rows into a dict keyed by the DICOM tag in the common
+    format (8char string, no non-alphanumeric characters) so that tag_match 
+    is a single lookup instead of a scan of the whole list for every term.
+    The Neurolex ID has the form XXXX_XXXX. A tag can have more than one 
+    Neurolex row, so each value is the list of all rows for that tag, in 
+    file order. Rows without a DICOM ID ("NF ") are left out.
+    '''
+    nlxIndex = {}
+    for row in nlxData:
+        nlxDicomTagPartsList = row[2].split("_")
+        if len(nlxDicomTagPartsList) < 2:
+            continue
+        nlxDicomTagID = nlxDicomTagPartsList[0]+nlxDicomTagPartsList[1]
+        nlxIndex.setdefault(nlxDicomTagID, []).append(row)
+
+    return nlxIndex
+
+
+
+def tag_match(tag,nlxIndex):
     '''
     This code takes an input string (dicom tag) and tries to find an 
-    exact match in another list of labels. The two strings have different
-    initial formats so first have to put them in common format (8char string,
-    no non-alphanumeric characters)
+    exact match in the Neurolex rows indexed by build_tag_index. The two 
+    strings have different initial formats so first have to put the Clunie 
+    tag in the common format (8char string, no non-alphanumeric characters)
+    Returns the list of matching Neurolex rows [label, nlxID, dicomID, vr]
+    (all of them if there is more than one), the tag and the match flag.
     '''
 
     # set match status flags
-    neuroLines = len(nlxData)
     noMatch = 'True'
-    neurolexID = 'NF'
-    vrCode = 'NF'
+    hits = []
+    dicomTagID = 'NF'
 
     # get the DICOM tag from the Clunie file in the format (XXXX,XXXX)
     dicomTagIDGroup = re.search(r'.*\(([A-Za-z0-9\,]*)\)', tag)
     if not dicomTagIDGroup:
-        print "bad dicom tag format for: "+tag
+        metrics.say("bad dicom tag format for: "+tag)
     else:
         dicomTagPartsList = dicomTagIDGroup.group(1).split(",")
         dicomTagID = dicomTagPartsList[0]+dicomTagPartsList[1]
         #print dicomTag
+        hits = nlxIndex.get(dicomTagID, [])
 
-    for i in range(neuroLines):
-        # This assumes that the correctly formatted tag is present 
-        # (already checked in main)
-        # To get the from XXXX_XXXX to XXXXXXXX
-        nlxDicomTagPartsList = nlxData[i][2].split("_")
-        nlxDicomTagID = nlxDicomTagPartsList[0]+nlxDicomTagPartsList[1]
-        #print nlxDicomTag
-
-        # check for exact match
-        if nlxDicomTagID == dicomTagID:
-            vrCode = nlxData[i][3]
-            neurolexID = nlxData[i][1]
-            noMatch = 'False'
-            break
-        else:
-            pass
-
+    if hits:
+        noMatch = 'False'
 
     if noMatch == 'True':
-        print "no match for "+dicomTagID
+        metrics.count('tag misses')
+        metrics.say("no match for "+dicomTagID)
+    elif len(hits) > 1:
+        metrics.count('tag matches')
+        metrics.count('tags with several matches')
+        metrics.say("%d matches for %s" % (len(hits), dicomTagID))
     else:
-        print "match for "+dicomTagID
+        metrics.count('tag matches')
+        metrics.say("match for "+dicomTagID)
 
-    return neurolexID, dicomTagID, vrCode, noMatch
+    return hits, dicomTagID, noMatch
+
+
+
+def unique(values):
+    # values in their original order, without repeats
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+
+def unquote(value):
+    # "text" -> text; the literal is escaped again by ttl_writer.literal
+    value = value.strip()
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        value = value[1:-1]
+    return value
 
 
 
@@ -241,74 +231,87 @@ def main():
     neurolexID = ''
     dicomTagID = ''
     vrCode = ''
-    ttlFile = open(outDir+outFile, "w")
+    prefixes = ttl_writer.ontologyPrefixes + [('nlx', nlxLink)]
+    triples = triple_export.TripleSet(prefixes) if exportTriples else None
+    ttlFile = io.open(outDir+outFile, "w", encoding='utf-8')
+    ttl = ttl_writer.TurtleWriter(ttlFile, prefixes, layout='owl', base=ontologyBase,
+                                  triples=triples)
 
-    write_ontology_header(ttlFile)
-    write_class_header(ttlFile)
+    write_ontology_header(ttl)
+    write_class_header(ttl)
 
     # Neurolex/Interlex section*****************************
     # put the label, Neurolex ID (if present), DICOM ID, and VR into a file that will be
     # matched up to the label from the DICOM (Clunie-supplied) file 
-    nlxFileData = open(nlxFile, "r")
-    entries = nlxFileData.readlines()
-    for entry in entries:
-
-        dicomIDGroup = re.search(r'.*DICOM:([A-Za-z0-9\_]*),', entry)
-        if not dicomIDGroup:
-            print "no dicom ID found in: ", entry
-            dicomID = "NF "
-        else:
-            dicomID = dicomIDGroup.group(1)
-            #print dicomID
-
-
-        nlxIDGroup = re.search(r'.*,(nlx_[0-9]*),', entry)
-        if not nlxIDGroup:
-            print "no nlx ID found in: ", entry
-            nlxID = "NF "
-        else:
-            nlxID = nlxIDGroup.group(1)
-            #print nlxID 
-
-
-        vr =  entry[-3:].rstrip("\n")  #get rid of newline character 
-        vrGroup = re.search(r'(\"\,*)', vr)
-        if vrGroup:
-            if "US or SS" in entry:
-                vr = "US or SS"
-            elif "OB or OW" in entry:
-                vr = "OB or OW"
-            elif "OW or OB" in entry:
-                vr = "OB or OW"
-            elif "OP or OW" in entry:
-                vr = "OP or OW"
-            elif "US,SS,or OW" in entry:
-                vr = "US or SS"
-            elif "US or SS or OW" in entry:
-                vr = "US or SS or OW"
-            elif "does not exist" in entry:
-                vr = "does not exist"
+    with metrics.stage('read_neurolex'):
+        nlxFileData = open(nlxFile, "r")
+        entries = nlxFileData.readlines()
+        for entry in entries:
+
+            dicomIDGroup = re.search(r'.*DICOM:([A-Za-z0-9\_]*),', entry)
+            if not dicomIDGroup:
+                metrics.say("no dicom ID found in: ", entry)
+                dicomID = "NF "
             else:
-                print "bad or missing VR value found in: ", entry
-                vr = "NF "
-        else:
-            vr = vr
+                dicomID = dicomIDGroup.group(1)
+                #print dicomID
 
-        #vr = vr.rstrip("\n")  #get rid of the newline character that appears 
 
-        # problem her is that sometimes there are "" around Category sometimes not
-        dicomLabelGroup =  re.search(r'.*:Category:([A-Za-z0-9\s\-\/\(\)\'\&\"]*),', entry)
-        if not dicomLabelGroup:
-            print "no dicom label found in: ", entry
-            dicomLabel = "NF "
-        else:
-            dicomLabel = dicomLabelGroup.group(1)
-            if dicomLabel[-1] == '"':
-                dicomLabel = dicomLabel[:-1]
-            #print dicomLabel
+            nlxIDGroup = re.search(r'.*,(nlx_[0-9]*),', entry)
+            if not nlxIDGroup:
+                metrics.say("no nlx ID found in: ", entry)
+                nlxID = "NF "
+            else:
+                nlxID = nlxIDGroup.group(1)
+                #print nlxID 
+
+
+            vr =  entry[-3:].rstrip("\n")  #get rid of newline character 
+            vrGroup = re.search(r'(\"\,*)', vr)
+            if vrGroup:
+                if "US or SS" in entry:
+                    vr = "US or SS"
+                elif "OB or OW" in entry:
+                    vr = "OB or OW"
+                elif "OW or OB" in entry:
+                    vr = "OB or OW"
+                elif "OP or OW" in entry:
+                    vr = "OP or OW"
+                elif "US,SS,or OW" in entry:
+                    vr = "US or SS"
+                elif "US or SS or OW" in entry:
+                    vr = "US or SS or OW"
+                elif "does not exist" in entry:
+                    vr = "does not exist"
+                else:
+                    metrics.say("bad or missing VR value found in: ", entry)
+                    vr = "NF "
+            else:
+                vr = vr
 
-        # store extracted strings in a list for future retrieval - this is all relevant NLX data
-        nlxData.append([dicomLabel, nlxID, dicomID, vr])
+            #vr = vr.rstrip("\n")  #get rid of the newline character that appears 
+
+            # problem her is that sometimes there are "" around Category sometimes not
+            dicomLabelGroup =  re.search(r'.*:Category:([A-Za-z0-9\s\-\/\(\)\'\&\"]*),', entry)
+            if not dicomLabelGroup:
+                metrics.say("no dicom label found in: ", entry)
+                dicomLabel = "NF "
+            else:
+                dicomLabel = dicomLabelGroup.group(1)
+                if dicomLabel[-1] == '"':
+                    dicomLabel = dicomLabel[:-1]
+                #print dicomLabel
+
+            # store extracted strings in a list for future retrieval - this is all relevant NLX data
+            nlxData.append([dicomLabel, nlxID, dicomID, vr])
+            metrics.count('neurolex rows')
+
+        # look up the Neurolex rows by tag rather than scanning nlxData for every term
+        nlxIndex = build_tag_index(nlxData)
+        if matchLabels:
+            labelIndex = label_match.LabelIndex([row[0] for row in nlxData])
+            matchOut = io.open(outDir+matchFile, 'w', encoding='utf-8')
+            label_match.write_candidate_header(matchOut)
 
 
     # DICOM document section************************************
@@ -317,77 +320,85 @@ def main():
     multiTags = []
     allEntries = []
     idStart = 500
-    dicomFileData = open(inFile, "r")
-    lines = dicomFileData.readlines()
-    for line in lines:
-
-        # create a 5 digit ID with leading zeros to ID the tags
-        idStart = idStart + 1
-        numericalTagID = str(idStart).zfill(5)
+    with metrics.stage('write_terms'):
+        dicomFileData = open(inFile, "r")
+        lines = dicomFileData.readlines()
+        for line in lines:
+
+            # create a 5 digit ID with leading zeros to ID the tags
+            idStart = idStart + 1
+            numericalTagID = str(idStart).zfill(5)
  
-        # get the label
-        labelGroup = re.search(r'.*Name="([A-Za-z0-9\s\-\/\(\)\'\&]*)"\t', line)
-        label = labelGroup.group(1)
-        # get the tab
-        tagGroup = re.search(r'.*Tag=("[A-Za-z0-9\s\,\(\)]*")\t', line)
-        tag = tagGroup.group(1)  #left the quotes around the tag
-        # get the definition
-        definitionGroup = re.search(r'.*Description=(".*)', line)
-        definition = definitionGroup.group(1) # has quotes already
-
-        # find the corresponding term from the extracted Neurolex info
-        #neurolexID, dicomTagID, vrCode, noMatch = string_match(label,nlxData)
-        neurolexID, dicomTagID, vrCode, noMatch = tag_match(tag,nlxData)
-
-        #tempList = [dicomTagID, definition]
-        #allEntries.append(tempList)
-
-        # determine which tags have multiple entries and create a non-repeating list
-        # of the multiple-entry tag (multitags). tagList is a non-repeating list of all tags.
-        # {just store tag}
-        #if dicomTagID in tagList and dicomTagID not in multiTags:
-        #    multiTags.append(dicomTagID)
-        #else:
-        #    tagList.append(dicomTagID)
-
-        #{store all multiple tags and their definitions} - HOW TO STORE FIRST ONE OF MULTIPLE?
-        # look at each tag in turn and all tags after that tag.
-        #if dicomTagID in tagList and dicomTagID not in multiTags:
-        #    tempList = [dicomTagID, definition]
-        #    multiTags.append(tempList)
-        #else:
-        #    tagList.append(dicomTagID)
-
-        #labelCC = create_camelcase_label(label)
-        #print label
-        ttlFile.write("###  "+classLink+dicomPrefix+numericalTagID+"\n")
-        ttlFile.write("\n")
-        ttlFile.write(dicomNS+dicomPrefix+numericalTagID+" "+rdfType+" "+owlDatatypeProperty+"  ;\n")
-        ttlFile.write("\n")
-        ttlFile.write("        "+rdfsLabel+" "+'"'+label+'"'+xsdString+";\n")
-        ttlFile.write("\n")
-        ttlFile.write("        "+curationStatusReqDisc+";\n")
-        ttlFile.write("\n")
-        ttlFile.write("        "+definitionStr+" "+definition+xsdString+";\n")
-        ttlFile.write("\n")
-        ttlFile.write("        "+dicomTag+" "+tag+xsdString+";\n")
-        ttlFile.write("\n")
-
-        if noMatch == 'False':
-            ttlFile.write("        "+owlSameAs+" "+nlxID+"  ;\n")
-            ttlFile.write("\n")
-            ttlFile.write("        "+vrInDicom+" "+'"'+vrCode+'"'+xsdString+"  ;\n")
-            ttlFile.write("\n")
-            ttlFile.write("        "+rdfsSub+" "+dcID+"  .\n")
-        else:
-            ttlFile.write("        "+rdfsSub+" "+dcID+"  .\n")
-
-        ttlFile.write("\n")
-
-        ttlFile.write("\n")
-        ttlFile.write("\n")
-
-    ttlFile.close()
+            # get the label
+            labelGroup = re.search(r'.*Name="([A-Za-z0-9\s\-\/\(\)\'\&]*)"\t', line)
+            label = labelGroup.group(1)
+            # get the tab
+            tagGroup = re.search(r'.*Tag=("[A-Za-z0-9\s\,\(\)]*")\t', line)
+            tag = tagGroup.group(1)  #left the quotes around the tag
+            # get the definition
+            definitionGroup = re.search(r'.*Description=(".*)', line)
+            definition = definitionGroup.group(1) # has quotes already
+
+            # find the corresponding term from the extracted Neurolex info
+            if matchLabels:
+                neurolexID, dicomTagID, vrCode, noMatch = string_match(label,nlxData,labelIndex,matchOut)
+                nlxHits = [[label, neurolexID, dicomTagID, vrCode]]
+            else:
+                nlxHits, dicomTagID, noMatch = tag_match(tag,nlxIndex)
+
+            #tempList = [dicomTagID, definition]
+            #allEntries.append(tempList)
+
+            # determine which tags have multiple entries and create a non-repeating list
+            # of the multiple-entry tag (multitags). tagList is a non-repeating list of all tags.
+            # {just store tag}
+            #if dicomTagID in tagList and dicomTagID not in multiTags:
+            #    multiTags.append(dicomTagID)
+            #else:
+            #    tagList.append(dicomTagID)
+
+            #{store all multiple tags and their definitions} - HOW TO STORE FIRST ONE OF MULTIPLE?
+            # look at each tag in turn and all tags after that tag.
+            #if dicomTagID in tagList and dicomTagID not in multiTags:
+            #    tempList = [dicomTagID, definition]
+            #    multiTags.append(tempList)
+            #else:
+            #    tagList.append(dicomTagID)
+
+            #labelCC = create_camelcase_label(label)
+            #print label
+            # the definition and the tag are read with their quotes
+            predicates = [
+                (rdfType, [owlDatatypeProperty]),
+                (rdfsLabel, [ttl_writer.literal(label)]),
+                (curationStatus, [statusReqDisc]),
+                (definitionStr, [ttl_writer.literal(unquote(definition))]),
+                (dicomTag, [ttl_writer.literal(unquote(tag))]),
+            ]
+
+            if noMatch == 'False':
+                # a tag can have several Neurolex entries; keep all of them
+                # (rows without an ID or VR in the Neurolex file have "NF ")
+                neurolexIDs = unique([nlxNS+h[1] for h in nlxHits if h[1].startswith('nlx_')])
+                vrCodes = unique([h[3] for h in nlxHits if h[3] != "NF "])
+                predicates.append((owlSameAs, neurolexIDs))
+                predicates.append((vrInDicom, [ttl_writer.literal(v) for v in vrCodes]))
+
+            predicates.append((rdfsSub, [dcID]))
+            ttl.write_entity(dicomNS+dicomPrefix+numericalTagID, predicates)
+            metrics.count('terms')
+
+        ttl.close()
+        ttlFile.close()
+        if matchLabels:
+            matchOut.close()
+            print ("Wrote the label match candidates to %s" % (outDir+matchFile))
+
+    if triples is not None:
+        with metrics.stage('export_triples'):
+            ntPath, binPath = triple_export.export(triples, outDir + os.path.splitext(outFile)[0])
+        metrics.count('triples', len(triples))
+        print ("Wrote %d triples to %s and %s" % (len(triples), ntPath, binPath))
 
     #print multiTags
     #print len(multiTags)
@@ -398,4 +409,9 @@ def main():
     #fp.close()
 ##############################################################
 if __name__ == "__main__":
+    # --match-labels, and --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py
+    args = metrics.start('create_dicom_ttl', sys.argv[1:])
+    if '--match-labels' in args:
+        matchLabels = True
     main()
+    metrics.finish()
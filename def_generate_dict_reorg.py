@@ -39,9 +39,20 @@ Massachusetts General Hospital, 2018
 
 import urllib2
 import xml.etree.ElementTree as ET
-import os, io
+import os, sys, io
+import re
+import json
+
+import metrics
 
 pydict_filename = 'dicom_dict_def.dict'  
+dupReport_filename = 'dicom_dict_def_duplicates.txt'    # per-tag duplicate counts
+moduleDefs_filename = 'dicom_dict_def_modules.json'     # every definition of every tag, by module
+moduleKey = 'Caption'   # the entry key holding the caption of the table a row came from
+fLoc = '/home/karl/Work/INCF/DICOM_docbook_latest/source/docbook/part03/part03.xml' 
+
+#global br
+br = '{http://docbook.org/ns/docbook}' # Shorthand variable for book_root
 
 
 def parse_header(header_row):
@@ -196,18 +207,54 @@ def clean_attrs(attrs):
 
 
 
-def remove_duplicates(attrs):
+def freeze_attr(attr):
+    ''' Canonical, hashable form of an entry dict: its (key, value) pairs in key order.
+    The table caption is left out, so rows repeated in several modules are still duplicates
+    '''
+    return tuple(sorted((k, v) for k, v in attr.items() if k != moduleKey))
+
+
+
+def remove_duplicates(attrs, counts=None):
     ''' This removes duplicate entries from the final list of entries.
     Note that duplicate means that the entire entry is the same. The 
     tags with different definitions will be kept.
+    As before, the last copy of each entry is the one that is kept, and the kept
+    entries stay in their original order. Entries are compared through a set of 
+    their frozen form, so this is a single pass over the list.
+    If a dict is passed as counts, it is filled with 
+    Tag: [number of entries kept, number of exact duplicates removed]
     '''
+    seen = set()
     b = []
-    b = [i for n, i in enumerate(attrs) if i not in attrs[n+1:]]
-    
+    for i in reversed(attrs):
+        key = freeze_attr(i)
+        if key in seen:
+            if counts is not None:
+                counts.setdefault(i.get('Tag'), [0, 0])[1] += 1
+            continue
+        seen.add(key)
+        b.append(i)
+        if counts is not None:
+            counts.setdefault(i.get('Tag'), [0, 0])[0] += 1
+    b.reverse()
+
     return b
 
 
 
+def write_duplicate_report(f, counts):
+    ''' Writes one tab-separated line per tag that has more than one definition or
+    had exact duplicates removed: Tag, definitions kept, duplicates removed
+    '''
+    f.write("Tag\tKept\tRemoved\n")
+    for tag in sorted(counts):
+        kept, removed = counts[tag]
+        if kept > 1 or removed > 0:
+            f.write("%s\t%d\t%d\n" % (tag[1:-1].replace(",", ""), kept, removed))  # (gggg,eeee) -> ggggeeee
+
+
+
 def join_attr_descr(cell_values, field_names):
     """ 
     Table headings are Attribute Name, Tag, [Type], Attribute Description; 
@@ -231,39 +278,55 @@ def join_attr_descr(cell_values, field_names):
  
 
 
+skipTables = ["Compressed Palette Color Lookup Table Data", "Segment Types", "Discrete Segment Type", \
+              "Linear Segment Type", "Indirect Segment Type", "Whole Slide Microscopy Image Flavors", \
+              "Whole Slide Microscopy Image Derived Pixels", "Types of Positioner and Detector Motion", \
+              "Defined Terms for Printer and Execution Status Info", "Content Assessment Results Directory Record Results Keys"]
+
+
+def parse_table(table):
+    """ Parses a single docbook <table> element for DICOM Element data
+    Returns a list of dicts with each dict representing the data for an Element from the table,
+    or an empty list if the table is skipped
+    """
+    caption = table.find('%scaption' %br).text
+     #make sure there is a caption; otherwise probably a retired module + check if in list of tables to be skipped
+    if caption and (caption not in skipTables):   
+        if not "Example" in caption:
+            # Get the column headers using the above function
+            field_names = parse_header(table.find('%sthead' %br).find('%str' %br))
+            # Get the row values from the table; make sure it has a Tag and Description
+            if ("Tag" in field_names) and ("Key" or "Attribute Description" or "Description" in field_names):
+                # Get all the Element data from the table, remembering which table each row is from
+                module = " ".join(caption.split())
+                rows = [parse_row(field_names, row) for row in table.find('%stbody' %br).iter('%str' %br)]
+                for r in rows:
+                    r[moduleKey] = module
+                metrics.count('tables')
+                metrics.count('rows', len(rows))
+                return rows
+            else:
+                pass    # if no Key, Tag or Description
+        else:
+            pass    # skip if an Example
+    else:
+        #print "no caption or a skipped Table"
+        pass    # if there is no caption then skip; retired module
+
+    return []
+
+
 def parse_docbook_table(book_root):
     """ Parses the given XML book_root for the table with caption matching caption for DICOM Element data
     Returns a list of dicts with each dict representing the data for an Element from the table
+    (the caption of the table is kept under moduleKey)
     """
     #br = '{http://docbook.org/ns/docbook}' # Shorthand variable for book_root
     attrsAll = []
-    attrsRow = []
-    skipTables = ["Compressed Palette Color Lookup Table Data", "Segment Types", "Discrete Segment Type", \
-                  "Linear Segment Type", "Indirect Segment Type", "Whole Slide Microscopy Image Flavors", \
-                  "Whole Slide Microscopy Image Derived Pixels", "Types of Positioner and Detector Motion", \
-                  "Defined Terms for Printer and Execution Status Info", "Content Assessment Results Directory Record Results Keys"]
 
     # Find the table in book_root with caption
     for table in book_root.iter('%stable' %br):
-        caption = table.find('%scaption' %br).text
-        #if table.find('%scaption' %br).text == caption:  #from when I had a list of captions to loop through
-         #make sure there is a caption; otherwise probably a retired module + check if in list of tables to be skipped
-        if caption and (caption not in skipTables):   
-            if not "Example" in caption:
-                # Get the column headers using the above function
-                field_names = parse_header(table.find('%sthead' %br).find('%str' %br))
-                # Get the row values from the table; make sure it has a Tag and Description
-                if ("Tag" in field_names) and ("Key" or "Attribute Description" or "Description" in field_names):
-                    # Get all the Element data from the table
-                    attrsRow = [parse_row(field_names, row) for row in table.find('%stbody' %br).iter('%str' %br)]
-                    attrsAll.append(attrsRow)   #since now looping through all tables have to collect attrs inside this module
-                else:
-                    pass    # if no Key, Tag or Description
-            else:
-                pass    # skip if an Example
-        else:
-            #print "no caption or a skipped Table"
-            pass    # if there is no caption then skip; retired module
+        attrsAll.append(parse_table(table))   #since now looping through all tables have to collect attrs inside this module
 
     # now have to flatten the list of lists (of dictionaries) into a list of dictionaries
     attrsAllFlat = [item for sublist in attrsAll for item in sublist]
@@ -271,6 +334,43 @@ def parse_docbook_table(book_root):
     return attrsAllFlat
 
 
+def iter_docbook_tables(source):
+    """ Streams the docbook in source (a filename or file object) with iterparse and 
+    yields each <table> element as soon as its end tag has been read.  The table's
+    subtree is cleared once the caller asks for the next one, and everything outside 
+    of the tables (sections, paragraphs, figures...) is cleared as soon as it closes,
+    so memory is bounded by the largest table rather than by the whole book.
+    Only outermost tables are yielded; a table nested inside another one is
+    handled together with its parent.
+    """
+    tableTag = '%stable' %br
+    depth = 0       # how many <table> elements we are inside of
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if elem.tag == tableTag:
+            if event == 'start':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield elem
+                    elem.clear()
+        elif event == 'end' and depth == 0:
+            elem.clear()
+
+
+def parse_docbook_stream(source):
+    """ Same as parse_docbook_table, but reads the docbook table by table from source 
+    (a filename or file object) instead of from a fully built tree
+    Returns a list of dicts with each dict representing the data for an Element from the table
+    """
+    attrsAllFlat = []
+    for table in iter_docbook_tables(source):
+        attrsAllFlat += parse_table(table)
+
+    return attrsAllFlat
+
+
 def write_dict(f, entries): 
     ''' The XML parsing module works with utf-8, but f.write assumes ascii so I 
         have to specifically encode the write to be in utf-8 otherwise it chokes
@@ -279,7 +379,7 @@ def write_dict(f, entries):
     '''
     f.write("{\n    ")      #just start with dict: "{"
     for entry in entries:
-        print entry
+        metrics.say(entry)
 
         if "Type" in entry:
             #.encode('utf-8')
@@ -290,74 +390,176 @@ def write_dict(f, entries):
             elif "Key" in entry: 
                 f.write(",\n    "+""""{0}": ("{1}", "{2}", "{3}")""".format(entry["Tag"], entry["Key"].encode('utf-8'), entry["Attribute Description"].encode('utf-8'), entry["Type"]))
             else:
-                print "has Type, but not any of specified key collections"
+                metrics.say("has Type, but not any of specified key collections")
         else:
             if "Description" in entry:
                 f.write(",\n    "+""""{0}": ("{1}", "{2}")""".format(entry["Tag"], entry["Attribute Name"].encode('utf-8'), entry["Description"].encode('utf-8')))
             elif "Attribute Description" in entry:
                 f.write(",\n    "+""""{0}": ("{1}", "{2}")""".format(entry["Tag"], entry["Attribute Name"].encode('utf-8'), entry["Attribute Description"].encode('utf-8')))
             else:
-                print "Entry not in any known format"
+                metrics.say("Entry not in any known format")
         #f.write(",\n    ".join(entry_format.format(**attr) for attr in attributes)) #orig version
     f.write("\n}\n") # ending "}"
 
 
 
-# Program starts here
+def entry_definition(entry):
+    """ The definition column of an entry, as write_dict picks it """
+    if "Description" in entry:
+        return entry["Description"]
+    return entry.get("Attribute Description", "")
 
-#global br
-br = '{http://docbook.org/ns/docbook}' # Shorthand variable for book_root
-attrs = []
-main_attributes = []
-
-# Run on DICOM Part 03 and look for Tables that have Tags and Definitions
-# Next two lines are used to query the online docbook part, which is the latest version
-#url = 'http://medical.nema.org/medical/dicom/current/source/docbook/part06/part06.xml'
-#response = urllib2.urlopen(url)
-# But here I use the offline version so I don't have to be online
-fLoc = '/home/karl/Work/INCF/DICOM_docbook_latest/source/docbook/part03/part03.xml' 
-response = open(fLoc)
-tree = ET.parse(response)
-root = tree.getroot()
-response.close()  
-
-
-# There are too many in Part 03 to list so loop through and weed out
-#for p in patientModules:
-#    attrs += parse_docbook_table(root, p)
-
-# parse each table in selected docbook Part rather than looping through a list of Tables
-attrs = parse_docbook_table(root)
-
-# Remove entries that have blank fields or that have a bad Tag
-attrsClean = clean_attrs(attrs)
-# Remove entries in which all fields are the same
-attrsNoDuplicates = remove_duplicates(attrsClean)
-
-# attrs dict now populated; sort by tag value
-attrsSort = sorted(attrsNoDuplicates, key=lambda x: x["Tag"])
-
-for a in attrsSort:
-    group, elem = a['Tag'][1:-1].split(",")
-
-    # Convert the micro symbol to "u" for easier handling as string  #original, but we want units so utf-8
-    # e.g. (0018,1153), (0018,8150) and (0018,8151)
-    #attr["Attribute Name"] = attr["Attribute Name"].replace(u"µ", "u") # replace micro symbol
-
-    # handle retired 'repeating group' tags
-    # e.g. (50xx,eeee) or (gggg,31xx)
-    #if 'x' in group or 'x' in elem:
-    #    attr["Tag"] = group + elem
-    #    mask_attributes.append(attr)
-    #else:
-        #attr["Tag"] = '0x%s%s' %(group, elem)  
-    a["Tag"] = '{g}{e}'.format(g=group,e=elem)   #writing out as 8-characters; don't need 32-bit value
-
-# write into a file
-py_file = file(pydict_filename, "wb")
-write_dict(py_file, attrsSort)
-py_file.close()
-
-# report back
-print ("Finished creating python file %s containing the dicom dictionary" % pydict_filename)
-print ("Wrote %d tags" % (len(attrsSort)))
+
+def consolidate_modules(attrs, moduleDefs):
+    """ Fills the dict moduleDefs with every definition of every tag in attrs (cleaned entries,
+    before the duplicates are removed), in document order:
+      "definitions": [definition strings, each stored once]
+      "tags": {tag: [[module, type, index into definitions], ...]}
+      "modules": {module: [tags in the order of the table]}
+    Unlike the .dict file, where the last definition of a tag wins, nothing is dropped
+    except rows repeating the same module, type and definition.
+    """
+    pool = moduleDefs.setdefault("definitions", [])
+    tags = moduleDefs.setdefault("tags", {})
+    modules = moduleDefs.setdefault("modules", {})
+    poolIds = dict((d, i) for i, d in enumerate(pool))
+    # what the lists already hold, so a row is checked against a set rather than a list
+    tagItems = dict((tag, set(tuple(item) for item in items)) for tag, items in tags.items())
+    moduleTagSets = dict((module, set(moduleTags)) for module, moduleTags in modules.items())
+
+    for a in attrs:
+        group, elem = a['Tag'][1:-1].split(",")
+        tag = '{g}{e}'.format(g=group, e=elem)
+        module = a.get(moduleKey, "")
+        definition = entry_definition(a)
+        defIndex = poolIds.get(definition)
+        if defIndex is None:
+            defIndex = poolIds[definition] = len(pool)
+            pool.append(definition)
+        item = (module, a.get("Type", ""), defIndex)
+        seen = tagItems.setdefault(tag, set())
+        if item not in seen:
+            seen.add(item)
+            tags.setdefault(tag, []).append(list(item))
+        seen = moduleTagSets.setdefault(module, set())
+        if tag not in seen:
+            seen.add(tag)
+            modules.setdefault(module, []).append(tag)
+
+    return moduleDefs
+
+
+def build_definitions(attrs, dupCounts=None, moduleDefs=None):
+    """ Cleans the rows parsed from the tables, removes the duplicates and sorts them by tag
+    Returns the list of entries with the Tag written as 8 characters, ready for write_dict
+    If a dict is passed as moduleDefs, it is filled by consolidate_modules
+    """
+    if dupCounts is None:
+        dupCounts = {}
+
+    # There are too many in Part 03 to list so loop through and weed out
+    #for p in patientModules:
+    #    attrs += parse_docbook_table(root, p)
+
+    # Remove entries that have blank fields or that have a bad Tag
+    with metrics.stage('clean_attrs'):
+        attrsClean = clean_attrs(attrs)
+    if moduleDefs is not None:
+        with metrics.stage('consolidate_modules'):
+            consolidate_modules(attrsClean, moduleDefs)
+    # Remove entries in which all fields are the same
+    with metrics.stage('remove_duplicates'):
+        attrsNoDuplicates = remove_duplicates(attrsClean, dupCounts)
+    metrics.count('entries', len(attrsClean))
+    metrics.count('duplicates removed', len(attrsClean) - len(attrsNoDuplicates))
+    multiDefs = len([t for t in dupCounts if dupCounts[t][0] > 1])
+    metrics.say("Removed %d duplicate entries; %d tags have more than one definition" % 
+                (len(attrsClean) - len(attrsNoDuplicates), multiDefs))
+
+    # attrs dict now populated; sort by tag value
+    attrsSort = sorted(attrsNoDuplicates, key=lambda x: x["Tag"])
+
+    for a in attrsSort:
+        group, elem = a['Tag'][1:-1].split(",")
+
+        # Convert the micro symbol to "u" for easier handling as string  #original, but we want units so utf-8
+        # e.g. (0018,1153), (0018,8150) and (0018,8151)
+        #attr["Attribute Name"] = attr["Attribute Name"].replace(u"µ", "u") # replace micro symbol
+
+        # handle retired 'repeating group' tags
+        # e.g. (50xx,eeee) or (gggg,31xx)
+        #if 'x' in group or 'x' in elem:
+        #    attr["Tag"] = group + elem
+        #    mask_attributes.append(attr)
+        #else:
+            #attr["Tag"] = '0x%s%s' %(group, elem)  
+        a["Tag"] = '{g}{e}'.format(g=group,e=elem)   #writing out as 8-characters; don't need 32-bit value
+
+    return attrsSort
+
+
+def write_module_defs(f, moduleDefs):
+    """ Writes the consolidated definitions from consolidate_modules as JSON to the text file f """
+    text = json.dumps(moduleDefs, indent=1, sort_keys=True, ensure_ascii=False, separators=(',', ': '))
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    # one [module, type, definition] per line rather than one value per line
+    text = re.sub(r'\[\n\s*("(?:[^"\\]|\\.)*"),\n\s*("(?:[^"\\]|\\.)*"),\n\s*(\d+)\n\s*\]',
+                  r'[\1, \2, \3]', text)
+    f.write(text + u"\n")
+
+
+def write_def_dict(attrsSort, dupCounts, moduleDefs=None):
+    """ Writes the sorted entries to pydict_filename, the duplicate counts to dupReport_filename
+    and, if given, the consolidated definitions to moduleDefs_filename
+    """
+    dup_file = open(dupReport_filename, "w")
+    write_duplicate_report(dup_file, dupCounts)
+    dup_file.close()
+
+    if moduleDefs is not None:
+        module_file = io.open(moduleDefs_filename, "w", encoding="utf-8")
+        write_module_defs(module_file, moduleDefs)
+        module_file.close()
+        metrics.say("Wrote %d definitions of %d tags in %d modules to %s" % (len(moduleDefs["definitions"]),
+                    len(moduleDefs["tags"]), len(moduleDefs["modules"]), moduleDefs_filename))
+
+    # write into a file
+    py_file = open(pydict_filename, "wb")
+    write_dict(py_file, attrsSort)
+    py_file.close()
+
+    # report back
+    metrics.say("Finished creating python file %s containing the dicom dictionary" % pydict_filename)
+    metrics.say("Wrote %d tags" % (len(attrsSort)))
+
+
+def main():
+    # Run on DICOM Part 03 and look for Tables that have Tags and Definitions
+    # Next two lines are used to query the online docbook part, which is the latest version
+    #url = 'http://medical.nema.org/medical/dicom/current/source/docbook/part06/part06.xml'
+    #response = urllib2.urlopen(url)
+    # But here I use the offline version so I don't have to be online
+    # The Part is streamed table by table rather than parsed into a full tree with
+    # ET.parse, which needs several times the size of part03.xml in memory
+    # (build_dicts.py runs the same steps with the Part split over several processes)
+    with metrics.stage('parse'):
+        response = open(fLoc)
+        attrs = parse_docbook_stream(response)
+        response.close()  
+
+    dupCounts = {}
+    moduleDefs = {}
+    with metrics.stage('build_definitions'):
+        attrsSort = build_definitions(attrs, dupCounts, moduleDefs)
+    with metrics.stage('write'):
+        write_def_dict(attrsSort, dupCounts, moduleDefs)
+    metrics.count('tags written', len(attrsSort))
+
+
+##############################################################
+if __name__ == "__main__":
+    # --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py
+    metrics.start('def_generate_dict_reorg', sys.argv[1:])
+    main()
+    metrics.finish()
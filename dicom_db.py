@@ -0,0 +1,343 @@
+'''
+  SQLite store for the DICOM dictionaries and the ontology entities, so
+  that a tag can be looked up in all of them with indexed queries instead
+  of each script opening and joining the text files itself.
+
+  build_db() loads
+
+    dicom_dict_vr.dict    -> vr (tag, vr, vm, name, retired, keyword)
+    dicom_dict_mask.dict  -> vr_mask (mask, and_mask, value, fixed_bits, ...)
+    dicom_dict_def.dict   -> definition (tag, name, definition, type)
+                             and the FTS5 table definition_fts over the
+                             names and definitions
+    the ontology files    -> entity (source, iri, id, tag, label,
+                             definition, vr, types, section, start_byte,
+                             end_byte), one row per entity and file
+
+  where id is the local name (dicom_00280011, dicom_00570) and tag the
+  8-character tag, taken from the dicom:dicom_00000065 "(gggg,eeee)"
+  statement or from an id that is a tag.  The blocks of an entity that is
+  declared in several sections are merged; the first value found is kept.
+
+  Everything is inserted with executemany in one transaction (journal and
+  fsync off, since the file is written under a temporary name and renamed
+  when complete), and the indexes on tag and id are created afterwards.
+  The meta table records the size and mtime of every source; open_db()
+  rebuilds the database when one of them changes.
+
+  Example:
+    import dicom_db
+    db = dicom_db.open_db()
+    db.get_vr('00280011')               # -> 'US'
+    db.get_vr('60020010')               # -> 'US' (from the 60xx0010 mask)
+    db.entities('dicom_00280011')       # -> [{'source': 'dicom_ontology.owl', ...}, ...]
+    db.search('pixel spacing')          # -> [(tag, name), ...] best match first
+
+  Usage:
+    python dicom_db.py                  builds the database
+    python dicom_db.py <tag or id> ...  prints what the database has for them
+
+'''
+
+import os, sys
+import re
+import sqlite3
+
+import dicom_dict
+import owl_reader
+
+#************************************************
+#input parameters
+dbFilename = 'dicom_dict.sqlite'    # written next to the VR dictionary
+ontologyFilenames = ('dicom_ontology.owl', 'dicom_ontology_nlx.owl')
+tagPredicate = 'dicom:dicom_00000065'
+vrPredicate = 'dicom:VR'
+labelPredicate = 'rdfs:label'
+definitionPredicate = 'obo:IAO_0000115'
+typePredicate = 'rdf:type'
+#************************************************
+
+SCHEMA_VERSION = '1'
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE vr (tag TEXT PRIMARY KEY, vr TEXT, vm TEXT, name TEXT, retired TEXT, keyword TEXT);
+CREATE TABLE vr_mask (mask TEXT PRIMARY KEY, and_mask INTEGER, value INTEGER, fixed_bits INTEGER,
+                      vr TEXT, vm TEXT, name TEXT, retired TEXT, keyword TEXT);
+CREATE TABLE definition (tag TEXT PRIMARY KEY, name TEXT, definition TEXT, type TEXT);
+CREATE VIRTUAL TABLE definition_fts USING fts5(tag UNINDEXED, name, definition);
+CREATE TABLE entity (source TEXT, iri TEXT, id TEXT, tag TEXT, label TEXT, definition TEXT, vr TEXT,
+                     types TEXT, section TEXT, start_byte INTEGER, end_byte INTEGER,
+                     PRIMARY KEY (source, iri));
+'''
+
+INDEXES = '''
+CREATE INDEX entity_id ON entity (id);
+CREATE INDEX entity_tag ON entity (tag);
+CREATE INDEX vr_mask_bits ON vr_mask (and_mask, value);
+'''
+
+_literal = re.compile(r'^("""|")(.*)\1(?:\^\^\S+|@\S+)?$', re.S)
+_escape = re.compile(r'\\(.)')
+_tagLiteral = re.compile(r'^\(?([0-9A-Fa-fx]{4}),?([0-9A-Fa-fx]{4})\)?$')
+_tagId = re.compile(r'^dicom_([0-9A-Fa-fx]{8})$')
+
+# open databases, keyed by absolute path
+_open = {}
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def db_path(dictPath=None):
+    if dictPath is None:
+        dictPath = os.path.join(dicom_dict.dictDir, dicom_dict.vrFilename)
+    return os.path.join(os.path.dirname(os.path.abspath(dictPath)), dbFilename)
+
+
+def source_paths(vrPath=None):
+    ''' [(kind, path)] of the files the database is built from, all next to vrPath '''
+    if vrPath is None:
+        vrPath = os.path.join(dicom_dict.dictDir, dicom_dict.vrFilename)
+    d = os.path.dirname(os.path.abspath(vrPath))
+    paths = [('vr', os.path.abspath(vrPath)),
+             ('mask', os.path.join(d, dicom_dict.maskFilename)),
+             ('def', os.path.join(d, dicom_dict.defFilename))]
+    paths += [('owl', os.path.join(d, name)) for name in ontologyFilenames]
+    return [(kind, path) for kind, path in paths if os.path.exists(path)]
+
+
+def _signature(path):
+    st = os.stat(path)
+    return u'%d %r' % (st.st_size, st.st_mtime)
+
+
+def literal_value(term):
+    ''' text of a literal as written in the file ("Columns"^^xsd:string -> Columns), None otherwise '''
+    m = _literal.match(_text(term))
+    if not m:
+        return None
+    return _escape.sub(r'\1', m.group(2))
+
+
+def entity_tag(localId, predicates):
+    ''' 8-character tag of an ontology entity, or None '''
+    for term in predicates.get(tagPredicate, ()):
+        value = literal_value(term)
+        m = _tagLiteral.match(value.strip()) if value else None
+        if m:
+            return (m.group(1) + m.group(2)).upper().replace('X', 'x')
+    m = _tagId.match(localId)
+    if m:
+        return m.group(1).upper().replace('X', 'x')
+    return None
+
+
+def entity_rows(owlPath):
+    ''' one row for the entity table per entity in owlPath, in file order '''
+    source = os.path.basename(owlPath)
+    rows = {}
+    order = []
+    with open(owlPath, 'rb') as f:
+        for entity in owl_reader.iter_entities(f):
+            iri = _text(entity.iri)
+            localId = re.split(r'[#/]', iri)[-1]
+            p = entity.predicates
+            label = _first_literal(p.get(labelPredicate))
+            definition = _first_literal(p.get(definitionPredicate))
+            vr = _first_literal(p.get(vrPredicate))
+            types = [_text(t) for t in list(p.get(typePredicate, [])) + list(p.get('a', []))]
+            row = rows.get(iri)
+            if row is None:
+                rows[iri] = [source, iri, localId, entity_tag(localId, p), label, definition, vr,
+                             types, entity.section, entity.start_byte, entity.end_byte]
+                order.append(iri)
+                continue
+            # another block of the same entity: fill in what the first ones did not have
+            for i, value in ((3, entity_tag(localId, p)), (4, label), (5, definition), (6, vr)):
+                if row[i] is None:
+                    row[i] = value
+            row[7] += [t for t in types if t not in row[7]]
+    for iri in order:
+        row = rows[iri]
+        row[7] = u' '.join(row[7])
+        yield tuple(row)
+
+
+def _first_literal(terms):
+    for term in terms or ():
+        value = literal_value(term)
+        if value is not None:
+            return value
+    return None
+
+
+def build_db(vrPath=None, outPath=None):
+    ''' Builds the database from the dictionaries and ontology files next to vrPath
+    (default: those in dicom_dict.dictDir); returns its path
+    '''
+    if vrPath is None:
+        vrPath = os.path.join(dicom_dict.dictDir, dicom_dict.vrFilename)
+    if outPath is None:
+        outPath = db_path(vrPath)
+    sources = source_paths(vrPath)
+
+    tmpPath = outPath + '.tmp'
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    conn = sqlite3.connect(tmpPath)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript(SCHEMA)
+        with conn:      # one transaction for all the inserts
+            meta = [(u'schema', SCHEMA_VERSION)]
+            for kind, path in sources:
+                meta.append((u'%s %s' % (kind, os.path.basename(path)), _signature(path)))
+                if kind == 'vr':
+                    conn.executemany('INSERT INTO vr VALUES (?, ?, ?, ?, ?, ?)',
+                                     ((_text(tag),) + tuple(_text(v) for v in values)
+                                      for tag, values in dicom_dict.load_vr_dict(path).items()))
+                elif kind == 'mask':
+                    conn.executemany('INSERT INTO vr_mask VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     _mask_rows(dicom_dict.load_dict(path)))
+                elif kind == 'def':
+                    rows = [(_text(tag), _text(values[0]), _text(values[1]) if len(values) > 1 else None,
+                             _text(values[2]) if len(values) > 2 else None)
+                            for tag, values in dicom_dict.load_def_dict(path).items()]
+                    conn.executemany('INSERT INTO definition VALUES (?, ?, ?, ?)', rows)
+                    conn.executemany('INSERT INTO definition_fts VALUES (?, ?, ?)',
+                                     ((tag, name, definition or u'') for tag, name, definition, t in rows))
+                else:
+                    conn.executemany('INSERT INTO entity VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     entity_rows(path))
+            conn.executemany('INSERT INTO meta VALUES (?, ?)', meta)
+            conn.executescript(INDEXES)
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+    os.rename(tmpPath, outPath)
+    return outPath
+
+
+def _mask_rows(masks):
+    for mask in masks:
+        andMask, value = dicom_dict.mask_bits(mask)
+        yield ((_text(mask), andMask, value, bin(andMask).count('1')) +
+               tuple(_text(v) for v in masks[mask]))
+
+
+def is_stale(dbPath, vrPath=None):
+    ''' True if the database is missing or was built from other versions of the sources '''
+    if not os.path.exists(dbPath):
+        return True
+    expected = dict((u'%s %s' % (kind, os.path.basename(path)), _signature(path))
+                    for kind, path in source_paths(vrPath))
+    expected[u'schema'] = SCHEMA_VERSION
+    try:
+        conn = sqlite3.connect(dbPath)
+        try:
+            found = dict(conn.execute('SELECT key, value FROM meta'))
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return True
+    return found != expected
+
+
+def open_db(vrPath=None):
+    ''' DicomDB for the sources next to vrPath (default: dicom_dict.dictDir), (re)building
+    the database if needed; opened and checked once per process, as dicom_dict does
+    '''
+    path = db_path(vrPath)
+    db = _open.get(path)
+    if db is None:
+        if is_stale(path, vrPath):
+            build_db(vrPath, path)
+        db = _open[path] = DicomDB(path)
+    return db
+
+
+class DicomDB(object):
+    ''' Indexed lookups in a database written by build_db '''
+
+    def __init__(self, dbPath):
+        self.path = dbPath
+        self.conn = sqlite3.connect(dbPath)
+        self.conn.row_factory = sqlite3.Row
+
+    def close(self):
+        self.conn.close()
+
+    def get_entry(self, tag):
+        ''' (VR, VM, Name, Retired, Keyword) for tag or a mask such as '60xx0010', or None;
+        tags that are not in the vr table are matched against the repeating group masks
+        '''
+        tag = _text(tag)
+        row = self.conn.execute('SELECT vr, vm, name, retired, keyword FROM vr WHERE tag = ?',
+                                (tag,)).fetchone()
+        if row is None:
+            row = self.conn.execute('SELECT vr, vm, name, retired, keyword FROM vr_mask WHERE mask = ?',
+                                    (tag,)).fetchone()
+        if row is None:
+            try:
+                value = int(tag, 16)
+            except ValueError:
+                return None
+            # the mask with the most fixed bits wins, as in dicom_dict.MaskTable
+            row = self.conn.execute('SELECT vr, vm, name, retired, keyword FROM vr_mask '
+                                    'WHERE (? & and_mask) = value ORDER BY fixed_bits DESC, and_mask '
+                                    'LIMIT 1', (value,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def get_vr(self, tag):
+        ''' VR string for tag, or None '''
+        entry = self.get_entry(tag)
+        if entry is None:
+            return None
+        return entry[dicom_dict.VR]
+
+    def definition(self, tag):
+        ''' (Name, Definition, Type) for tag, or None '''
+        row = self.conn.execute('SELECT name, definition, type FROM definition WHERE tag = ?',
+                                (_text(tag),)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def entities(self, term):
+        ''' the entity rows (as dicts) for an 8-character tag or a local id such as dicom_00280011 '''
+        term = _text(term)
+        if re.match(r'^[0-9A-Fa-fx]{8}$', term):
+            rows = self.conn.execute('SELECT * FROM entity WHERE tag = ? ORDER BY source, start_byte',
+                                     (term.upper().replace('X', 'x'),))
+        else:
+            rows = self.conn.execute('SELECT * FROM entity WHERE id = ? ORDER BY source, start_byte',
+                                     (term.split(':')[-1],))
+        return [dict(zip(row.keys(), tuple(row))) for row in rows]
+
+    def search(self, query, limit=10):
+        ''' [(tag, name)] of the definitions best matching an FTS5 query, best first '''
+        rows = self.conn.execute('SELECT tag, name FROM definition_fts WHERE definition_fts MATCH ? '
+                                 'ORDER BY bm25(definition_fts) LIMIT ?', (_text(query), limit))
+        return [tuple(row) for row in rows]
+
+
+def main(args):
+    if not args:
+        path = build_db()
+        print ("Wrote %s" % path)
+        return 0
+    db = open_db()
+    for term in args:
+        print ("%s: %s" % (term, db.get_entry(term)))
+        print ("  definition: %s" % (db.definition(term),))
+        for e in db.entities(term):
+            print ("  %s %s: %s" % (e['source'], e['id'], e['label']))
+    return 0
+
+
+##############################################################
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
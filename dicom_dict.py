@@ -0,0 +1,254 @@
+'''
+  Loading layer for the generated DICOM dictionaries.
+
+  The dictionaries written by vr_generate_dict.py (dicom_dict_vr.dict) and
+  def_generate_dict_reorg.py (dicom_dict_def.dict) are plain Python
+  literals keyed by the 8-character tag string, e.g.
+
+    "00280011": ("US", "1", "Columns", "", "Columns")
+
+  Evaluating the 384 KB VR dictionary with ast.literal_eval is by far the
+  most expensive thing a lookup does, so every dictionary is opened once per
+  process and kept in memory.  The dictionaries are read through the
+  compiled sidecars of dict_cache.py (mmap, rebuilt when the .dict changes);
+  if a sidecar cannot be written the .dict is evaluated directly.  All scripts that need
+  a VR (or any other field) for a tag should go through get_vr()/get_entry()
+  here rather than opening the .dict files themselves.
+
+  Tags of the repeating groups (overlays 60xx, curves 50xx, 002031xx, ...)
+  are not in dicom_dict_vr.dict but in dicom_dict_mask.dict, keyed by the
+  mask with 'x' for the free digits.  A tag that is not in the main
+  dictionary is looked up in the masks through a MaskTable, which turns
+  every mask into an (and-mask, value) pair of integers once, e.g.
+
+    60xx0010 -> (0xFF00FFFF, 0x60000010)
+
+  and keeps one dict of values per distinct and-mask.  There are only a few
+  distinct and-masks, so matching a tag is a handful of dict probes on
+  tag & and-mask, without any string work.
+
+  A tag is defined in every Part 03 module table it appears in, and
+  dicom_dict_def.dict keeps only one of those definitions.  All of them are
+  in dicom_dict_def_modules.json (written by def_generate_dict_reorg.py
+  next to the .dict), which load_module_defs() reads into a ModuleDefs:
+  per tag a list of (module, Type, definition), with each distinct
+  definition stored once, and the tags of each module.  The JSON file is
+  not checked in; run def_generate_dict_reorg.py on Part 03 to write it.
+
+  Example:
+    import dicom_dict
+    dicom_dict.get_vr('00280011')        # -> 'US'
+    dicom_dict.get_entry('00280011')     # -> ('US', '1', 'Columns', '', 'Columns')
+    dicom_dict.get_vr('60020010')        # -> 'US' (from the 60xx0010 mask)
+    dicom_dict.load_module_defs().get('00280011', 'Image Pixel Module Attributes')
+                                         # -> ('Image Pixel Module Attributes', '1', 'Number of columns in the image.')
+
+'''
+
+import os
+import io
+import json
+
+import dict_cache
+import metrics
+
+#************************************************
+#input parameters
+dictDir = os.path.dirname(os.path.abspath(__file__))
+vrFilename = 'dicom_dict_vr.dict'
+maskFilename = 'dicom_dict_mask.dict'
+defFilename = 'dicom_dict_def.dict'
+moduleFilename = 'dicom_dict_def_modules.json'
+#************************************************
+
+# field positions in the dicom_dict_vr.dict tuples
+VR, VM, NAME, RETIRED, KEYWORD = range(5)
+
+# parsed dictionaries and mask tables, keyed by absolute path of the .dict file
+_loaded = {}
+_masks = {}
+
+
+def load_dict(dictPath):
+    ''' Return the mapping stored in dictPath, opening the file only the first
+    time it is asked for in this process.
+    '''
+    key = os.path.abspath(dictPath)
+    d = _loaded.get(key)
+    if d is not None:
+        metrics.count('dict cache hits')
+    else:
+        metrics.count('dict loads')
+        try:
+            d = dict_cache.open_dict(key)
+        except (IOError, OSError):
+            # e.g. read-only checkout: no sidecar, evaluate the .dict instead
+            d = dict_cache.read_dict(key)
+        _loaded[key] = d
+    return d
+
+
+def clear_cache():
+    ''' Forget all parsed dictionaries (e.g. after regenerating a .dict) '''
+    _loaded.clear()
+    _masks.clear()
+
+
+def load_vr_dict(dictPath=None):
+    ''' tag -> (VR, VM, Name, Retired, Keyword) '''
+    if dictPath is None:
+        dictPath = os.path.join(dictDir, vrFilename)
+    return load_dict(dictPath)
+
+
+def load_def_dict(dictPath=None):
+    ''' tag -> (Attribute Name, Description[, Type]) '''
+    if dictPath is None:
+        dictPath = os.path.join(dictDir, defFilename)
+    return load_dict(dictPath)
+
+
+def mask_bits(mask):
+    ''' (and-mask, value) integers for a tag mask such as '60xx0010' '''
+    andMask = int(''.join('0' if c in 'xX' else 'F' for c in mask), 16)
+    value = int(mask.replace('x', '0').replace('X', '0'), 16)
+    return andMask, value
+
+
+class MaskTable(object):
+    ''' Matches 32-bit tags against the repeating group masks of a mask dictionary '''
+
+    def __init__(self, masks):
+        # a plain dict (there are only a few dozen masks), so the table can be pickled
+        masks = dict((mask, masks[mask]) for mask in masks)
+        tables = {}
+        for mask in masks:
+            andMask, value = mask_bits(mask)
+            tables.setdefault(andMask, {})[value] = mask
+        # masks with more fixed bits first, so the most specific mask wins
+        self.tables = sorted(tables.items(), key=lambda t: (-bin(t[0]).count('1'), t[0]))
+        self.masks = masks
+
+    def match_mask(self, tag):
+        ''' the mask (e.g. '60xx0010') that tag (an int) falls under, or None '''
+        for andMask, values in self.tables:
+            mask = values.get(tag & andMask)
+            if mask is not None:
+                return mask
+        return None
+
+    def match(self, tag):
+        ''' the entry of the mask that tag (an int) falls under, or None '''
+        mask = self.match_mask(tag)
+        return self.masks[mask] if mask is not None else None
+
+    def find(self, tag):
+        ''' (mask, entry) for an int, the 8-character tag or the mask itself, or None '''
+        if not isinstance(tag, int):
+            if tag in self.masks:
+                return tag, self.masks[tag]
+            try:
+                tag = int(tag, 16)
+            except ValueError:
+                return None
+        mask = self.match_mask(tag)
+        return (mask, self.masks[mask]) if mask is not None else None
+
+    def get(self, tag):
+        ''' like match, but also takes the 8-character tag or the mask itself '''
+        found = self.find(tag)
+        return found[1] if found is not None else None
+
+
+def load_mask_table(maskPath=None):
+    ''' MaskTable for the mask dictionary at maskPath, or None if there is no such file '''
+    if maskPath is None:
+        maskPath = os.path.join(dictDir, maskFilename)
+    key = os.path.abspath(maskPath)
+    if key not in _masks:
+        _masks[key] = MaskTable(load_dict(key)) if os.path.exists(key) else None
+    return _masks[key]
+
+
+def _mask_path(dictPath):
+    # the mask dictionary is written next to the VR dictionary
+    if dictPath is None:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(dictPath)), maskFilename)
+
+
+def get_entry(tag, dictPath=None):
+    ''' Return the (VR, VM, Name, Retired, Keyword) tuple for tag or None.
+    tag is the 8-character string (or a mask such as '60xx0010'); tags that are not in
+    the main dictionary are matched against the repeating group masks
+    '''
+    metrics.count('dict lookups')
+    entry = load_vr_dict(dictPath).get(tag)
+    if entry is None:
+        metrics.count('mask lookups')
+        masks = load_mask_table(_mask_path(dictPath))
+        if masks is not None:
+            entry = masks.get(tag)
+    return entry
+
+
+def get_vr(tag, dictPath=None):
+    ''' Return the VR string for tag, or None if the tag is not in the dictionary '''
+    entry = get_entry(tag, dictPath)
+    if entry is None:
+        return None
+    return entry[VR]
+
+
+class ModuleDefs(object):
+    ''' Every definition of every tag, by the module table it comes from '''
+
+    def __init__(self, data):
+        ''' data: the dict written by def_generate_dict_reorg.write_module_defs '''
+        self.pool = data["definitions"]
+        self.tagDefs = data["tags"]
+        self.modules = data["modules"]
+
+    def definitions(self, tag):
+        ''' [(module, Type, definition)] for tag, in document order '''
+        return [(module, t, self.pool[i]) for module, t, i in self.tagDefs.get(tag, ())]
+
+    def get(self, tag, module=None):
+        ''' (module, Type, definition) of tag in module, or the first one if module is None
+        or the tag is not in that module; None for an unknown tag
+        '''
+        defs = self.tagDefs.get(tag)
+        if not defs:
+            return None
+        found = defs[0]
+        if module is not None:
+            for d in defs:
+                if d[0] == module:
+                    found = d
+                    break
+        return (found[0], found[1], self.pool[found[2]])
+
+    def tags(self, module):
+        ''' the tags of a module, in the order of its table '''
+        return self.modules.get(module, [])
+
+    def __contains__(self, tag):
+        return tag in self.tagDefs
+
+    def __len__(self):
+        return len(self.tagDefs)
+
+
+def load_module_defs(path=None):
+    ''' ModuleDefs for dicom_dict_def_modules.json, read once per process '''
+    if path is None:
+        path = os.path.join(dictDir, moduleFilename)
+    key = os.path.abspath(path)
+    defs = _loaded.get(key)
+    if defs is None:
+        if not os.path.exists(key):
+            raise IOError("%s does not exist; run def_generate_dict_reorg.py on Part 03 to write it"
+                          % key)
+        with io.open(key, 'r', encoding='utf-8') as f:
+            defs = _loaded[key] = ModuleDefs(json.load(f))
+    return defs
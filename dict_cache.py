@@ -0,0 +1,270 @@
+'''
+  Compiled binary sidecars for the generated .dict files.
+
+  dicom_dict_vr.dict and dicom_dict_def.dict are written as Python literals,
+  so every consumer has to evaluate them before it can do a single lookup.
+  This module compiles a .dict into a small binary file written next to it
+  (dicom_dict_vr.dict -> dicom_dict_vr.dictc) that can be opened with mmap
+  and queried without building any Python objects up front.
+
+  The sidecar records the size and mtime of the .dict it was built from and
+  is rebuilt automatically by open_dict() whenever the source changes.
+
+  File layout (all integers little endian):
+
+    header    magic 'DCDC', version (H), fields per record (H),
+              number of records (I), number of strings (I),
+              source mtime (d), source size (q)
+    tags      count * 8 bytes, the ASCII tags in sorted order
+    records   count * fields string ids (I); NOSTR marks a missing field
+              (the def dict mixes 2- and 3-field entries)
+    offsets   (strings + 1) byte offsets (I) into the string data
+    strings   utf-8 string data; identical strings are stored once
+
+  Example:
+    import dict_cache
+    d = dict_cache.open_dict('dicom_dict_vr.dict')
+    d['00280011']        # -> ('US', '1', 'Columns', '', 'Columns')
+
+'''
+
+import os
+import io
+import re
+import ast
+import mmap
+import struct
+import sys
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+#************************************************
+#input parameters
+cacheSuffix = 'c'           # dicom_dict_vr.dict -> dicom_dict_vr.dictc
+#************************************************
+
+MAGIC = b'DCDC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIdq')
+TAG_WIDTH = 8
+NOSTR = 0xFFFFFFFF
+
+PY3 = sys.version_info[0] >= 3
+
+_entryStart = re.compile(r'\n\s*(?="[0-9A-Fa-fx]{8}":\s*\()')
+_entry = re.compile(r'"([0-9A-Fa-fx]{8})":\s*\("(.*)"\)$', re.S)
+_typeValue = re.compile(r'^[123]C?$')
+
+
+def cache_path(dictPath):
+    return dictPath + cacheSuffix
+
+
+def _source_signature(dictPath):
+    st = os.stat(dictPath)
+    return st.st_mtime, st.st_size
+
+
+def iter_dict_entries(text, nfields=3):
+    ''' Yield (tag, values) for every entry of a .dict text, in file order
+    and including repeated tags.
+
+    def_generate_dict_reorg.write_dict does not escape its strings, so
+    dicom_dict_def.dict is not a valid Python literal (definitions contain
+    double quotes, backslashes and line breaks).  Entries are therefore
+    split on the '"ggggeeee": (' that starts each of them, and the fields
+    on '", "'.  When an entry splits into more than nfields fields (the
+    def dict has Name, Description and an optional Type), the definition
+    contained '", "' and is put back together, treating the last field as
+    the Type column when it looks like one (1, 1C, 2, 2C, 3).
+    '''
+    body = text.strip()
+    if body.startswith('{'):
+        body = body[1:]
+    if body.endswith('}'):
+        body = body[:-1]
+    for chunk in _entryStart.split(body):
+        chunk = chunk.strip().rstrip(',').rstrip()
+        if not chunk:
+            continue
+        m = _entry.match(chunk)
+        if not m:
+            raise ValueError("cannot parse dictionary entry: %r" % chunk[:80])
+        parts = m.group(2).split('", "')
+        if len(parts) > nfields and _typeValue.match(parts[-1]):
+            parts = [parts[0], '", "'.join(parts[1:-1]), parts[-1]]
+        elif len(parts) > nfields:
+            parts = [parts[0], '", "'.join(parts[1:])]
+        yield m.group(1), tuple(parts)
+
+
+def read_dict(dictPath):
+    ''' Evaluate a .dict file into a dict; repeated tags keep the last entry
+    as they would with ast.literal_eval
+    '''
+    with io.open(dictPath, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        return ast.literal_eval(text)
+    except (SyntaxError, ValueError):
+        return dict(iter_dict_entries(text))
+
+
+def compile_dict(dictPath, outPath=None, entries=None):
+    ''' Write the binary sidecar for dictPath and return its path.
+    entries may be passed in if the dict has already been evaluated.
+    '''
+    if outPath is None:
+        outPath = cache_path(dictPath)
+    mtime, size = _source_signature(dictPath)
+    if entries is None:
+        entries = read_dict(dictPath)
+
+    tags = sorted(entries)
+    nfields = max([len(v) for v in entries.values()] or [0])
+
+    strings = []        # string id -> utf-8 bytes
+    stringIds = {}      # utf-8 bytes -> string id
+    records = []
+    for tag in tags:
+        if len(tag) != TAG_WIDTH:
+            raise ValueError("tag %r in %s is not %d characters" % (tag, dictPath, TAG_WIDTH))
+        values = entries[tag]
+        for i in range(nfields):
+            if i >= len(values):
+                records.append(NOSTR)
+                continue
+            s = values[i]
+            if not isinstance(s, bytes):
+                s = s.encode('utf-8')
+            sid = stringIds.get(s)
+            if sid is None:
+                sid = len(strings)
+                stringIds[s] = sid
+                strings.append(s)
+            records.append(sid)
+
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+
+    # write to a temporary file and rename so readers never see half a file
+    tmpPath = outPath + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, nfields, len(tags), len(strings), mtime, size))
+        f.write(b''.join(t.encode('ascii') if not isinstance(t, bytes) else t for t in tags))
+        f.write(struct.pack('<%dI' % len(records), *records))
+        f.write(struct.pack('<%dI' % len(offsets), *offsets))
+        f.write(b''.join(strings))
+    os.rename(tmpPath, outPath)
+
+    return outPath
+
+
+def is_stale(dictPath, cachePath=None):
+    ''' True if the sidecar is missing, unreadable or built from another version of dictPath '''
+    if cachePath is None:
+        cachePath = cache_path(dictPath)
+    try:
+        with open(cachePath, 'rb') as f:
+            header = f.read(HEADER.size)
+    except (IOError, OSError):
+        return True
+    if len(header) != HEADER.size:
+        return True
+    magic, version, nfields, count, nstrings, mtime, size = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        return True
+    return (mtime, size) != _source_signature(dictPath)
+
+
+def open_dict(dictPath):
+    ''' Return a read-only mapping over dictPath, (re)building its sidecar if needed '''
+    cachePath = cache_path(dictPath)
+    if is_stale(dictPath, cachePath):
+        compile_dict(dictPath, cachePath)
+    return CompiledDict(cachePath)
+
+
+class CompiledDict(Mapping):
+    ''' mmap-backed view of a compiled .dict sidecar.
+
+    Behaves like the dict that ast.literal_eval would have returned: keys
+    are the 8-character tags (iterated in sorted order) and values are
+    tuples of strings.  Values are decoded on access only.
+    '''
+
+    def __init__(self, cachePath):
+        self.path = cachePath
+        with open(cachePath, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nfields, count, nstrings, mtime, size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a compiled dictionary" % cachePath)
+        self.nfields = nfields
+        self._count = count
+        self._tagsAt = HEADER.size
+        self._recordsAt = self._tagsAt + count * TAG_WIDTH
+        self._offsetsAt = self._recordsAt + count * nfields * 4
+        self._stringsAt = self._offsetsAt + (nstrings + 1) * 4
+        self._record = struct.Struct('<%dI' % nfields)
+
+    def close(self):
+        self._mm.close()
+
+    def _tag(self, i):
+        at = self._tagsAt + i * TAG_WIDTH
+        return self._mm[at:at + TAG_WIDTH]
+
+    def _find(self, tag):
+        ''' binary search of the sorted tag index; returns the record number or -1 '''
+        if not isinstance(tag, bytes):
+            try:
+                tag = tag.encode('ascii')
+            except (AttributeError, UnicodeError):
+                return -1
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._tag(mid) < tag:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._tag(lo) == tag:
+            return lo
+        return -1
+
+    def _string(self, sid):
+        start, end = struct.unpack_from('<2I', self._mm, self._offsetsAt + sid * 4)
+        s = self._mm[self._stringsAt + start:self._stringsAt + end]
+        return s.decode('utf-8') if PY3 else s
+
+    def _values(self, i):
+        ids = self._record.unpack_from(self._mm, self._recordsAt + i * self.nfields * 4)
+        return tuple(self._string(sid) for sid in ids if sid != NOSTR)
+
+    def __getitem__(self, tag):
+        i = self._find(tag)
+        if i < 0:
+            raise KeyError(tag)
+        return self._values(i)
+
+    def __contains__(self, tag):
+        return self._find(tag) >= 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            t = self._tag(i)
+            yield t.decode('ascii') if PY3 else t
+
+    def iteritems(self):
+        ''' (tag, values) pairs in tag order '''
+        for i in range(self._count):
+            t = self._tag(i)
+            yield (t.decode('ascii') if PY3 else t), self._values(i)
@@ -0,0 +1,253 @@
+'''
+  Differences between two DICOM releases, computed from the generated
+  dictionaries instead of by comparing the .dict files by eye.
+
+  Each side of the comparison can be
+    - a directory with a generated dicom_dict_vr.dict, dicom_dict_mask.dict
+      and dicom_dict_def.dict (e.g. a checkout of this repository at an
+      older commit)
+    - a docbook source directory (the one holding part03/part03.xml,
+      part06/part06.xml and part07/part07.xml); the dictionaries are then
+      built in memory with build_dicts.parse_parts, as build_dicts.py would
+      write them
+    - a single .dict file (both sides must then be the same kind of .dict)
+
+  The dictionaries are walked in tag order side by side (a sorted merge on
+  the 8-character tags, the compiled dictionaries of dict_cache.py iterate
+  in that order already), and the report lists for each dictionary
+
+    added      tags only in the new release
+    removed    tags only in the old release
+    retired    tags whose Retired field became "Retired" (VR and mask
+               dictionaries)
+    changed    tag -> {field: [old, new]} for VR, VM, Name, Retired, Keyword
+               (VR and mask dictionaries) or Name, Definition, Type
+               (definitions)
+
+  under "vr", "mask" and "def", and under "affected" the tags whose
+  ontology entries have to be updated: tags that are new or whose VR
+  changed, including the repeating group masks (60xx0010), which are the
+  tags of their ontology entries.  With --update these are passed to
+  check_add_vr.main_incremental, which patches only the entries for those
+  tags; the VR dictionary in vrDir of check_add_vr.py has to be the new one.
+
+  Usage:
+    python dict_diff.py <old> <new> [report.json] [--update]
+
+'''
+
+import os, sys
+import io
+import json
+
+import dicom_dict
+import dict_cache
+
+#************************************************
+#input parameters
+reportFilename = 'dicom_dict_diff.json'
+vrFields = ('VR', 'VM', 'Name', 'Retired', 'Keyword')
+defFields = ('Name', 'Definition', 'Type')
+affectingFields = ('VR',)       # changes that need the ontology entry to be updated
+#************************************************
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def sorted_items(d):
+    ''' (tag, values) of a dictionary in tag order '''
+    if isinstance(d, dict_cache.CompiledDict):
+        return d.iteritems()
+    return ((k, d[k]) for k in sorted(d))
+
+
+def merge_dicts(old, new):
+    ''' Sorted merge of two tag -> values mappings.
+    Yields (tag, old values or None, new values or None) in tag order.
+    '''
+    oldItems = sorted_items(old)
+    newItems = sorted_items(new)
+    o = next(oldItems, None)
+    n = next(newItems, None)
+    while o is not None or n is not None:
+        if n is None or (o is not None and _text(o[0]) < _text(n[0])):
+            yield _text(o[0]), o[1], None
+            o = next(oldItems, None)
+        elif o is None or _text(n[0]) < _text(o[0]):
+            yield _text(n[0]), None, n[1]
+            n = next(newItems, None)
+        else:
+            yield _text(o[0]), o[1], n[1]
+            o = next(oldItems, None)
+            n = next(newItems, None)
+
+
+def diff_dicts(old, new, fields):
+    ''' Compares two dictionaries whose values hold the given fields (missing trailing
+    fields count as ''). Returns {'added': [tags], 'removed': [tags], 'retired': [tags],
+    'changed': {tag: {field: [old, new]}}}
+    '''
+    added = []
+    removed = []
+    retired = []
+    changed = {}
+    for tag, oldValues, newValues in merge_dicts(old, new):
+        if oldValues is None:
+            added.append(tag)
+            continue
+        if newValues is None:
+            removed.append(tag)
+            continue
+        diffs = {}
+        for i, field in enumerate(fields):
+            a = _text(oldValues[i]) if i < len(oldValues) else u''
+            b = _text(newValues[i]) if i < len(newValues) else u''
+            if a != b:
+                diffs[field] = [a, b]
+        if diffs:
+            changed[tag] = diffs
+            if 'Retired' in diffs and diffs['Retired'][1] == 'Retired':
+                retired.append(tag)
+
+    return {'added': added, 'removed': removed, 'retired': retired, 'changed': changed}
+
+
+def def_values(entry):
+    ''' (Name, Definition[, Type]) of an entry from def_generate_dict_reorg.build_definitions,
+    picking the columns the same way as def_generate_dict_reorg.write_dict
+    '''
+    name = entry.get("Attribute Name", entry.get("Key"))
+    if "Description" in entry:
+        descr = entry["Description"]
+    else:
+        descr = entry.get("Attribute Description")
+    if name is None or descr is None:
+        return None
+    if "Type" in entry:
+        return (name, descr, entry["Type"])
+    return (name, descr)
+
+
+def build_from_docbook(docbookDir, nworkers=None):
+    ''' (VR dictionary, mask dictionary, definition dictionary) built in memory from a
+    docbook source directory
+    '''
+    # the generators only run on Python 2; comparing .dict files does not need them
+    import build_dicts
+    import vr_generate_dict
+    import def_generate_dict_reorg
+
+    vrAttrs, defAttrs = build_dicts.parse_parts(os.path.join(docbookDir, 'part03', 'part03.xml'),
+                                                os.path.join(docbookDir, 'part06', 'part06.xml'),
+                                                os.path.join(docbookDir, 'part07', 'part07.xml'),
+                                                nworkers)
+
+    main_attributes, mask_attributes = vr_generate_dict.build_attributes(vrAttrs)
+    vrDict = {}
+    for attr in main_attributes:
+        vrDict[attr['Tag']] = tuple(attr[f] for f in vrFields)
+    maskDict = {}
+    for attr in mask_attributes:
+        maskDict[attr['Tag']] = tuple(attr[f] for f in vrFields)
+
+    # later entries win, as they do when the .dict file is read back
+    defDict = {}
+    for entry in def_generate_dict_reorg.build_definitions(defAttrs):
+        values = def_values(entry)
+        if values is not None:
+            defDict[entry['Tag']] = values
+
+    return vrDict, maskDict, defDict
+
+
+def load_release(path, nworkers=None):
+    ''' (VR dictionary, mask dictionary, definition dictionary) for one side of the diff,
+    None for those it does not have
+    '''
+    if os.path.isdir(os.path.join(path, 'part06')):
+        return build_from_docbook(path, nworkers)
+    if os.path.isdir(path):
+        vrPath = os.path.join(path, dicom_dict.vrFilename)
+        maskPath = os.path.join(path, dicom_dict.maskFilename)
+        defPath = os.path.join(path, dicom_dict.defFilename)
+        return (dicom_dict.load_vr_dict(vrPath) if os.path.exists(vrPath) else None,
+                dicom_dict.load_dict(maskPath) if os.path.exists(maskPath) else None,
+                dicom_dict.load_def_dict(defPath) if os.path.exists(defPath) else None)
+
+    d = dicom_dict.load_dict(path)
+    nfields = max([len(v) for v in d.values()] or [0]) if not isinstance(d, dict_cache.CompiledDict) else d.nfields
+    if nfields != len(vrFields):
+        return None, None, d
+    if any('x' in _text(tag) for tag in d):
+        return None, d, None        # the repeating group masks
+    return d, None, None
+
+
+def diff_releases(oldPath, newPath, nworkers=None):
+    ''' The report described at the top of this file, as a dict ready for json.dump '''
+    oldVr, oldMask, oldDef = load_release(oldPath, nworkers)
+    newVr, newMask, newDef = load_release(newPath, nworkers)
+
+    report = {'old': oldPath, 'new': newPath}
+    affected = set()
+    for kind, old, new in (('vr', oldVr, newVr), ('mask', oldMask, newMask)):
+        if old is None or new is None:
+            continue
+        report[kind] = diff_dicts(old, new, vrFields)
+        affected.update(report[kind]['added'])
+        for tag, diffs in report[kind]['changed'].items():
+            if any(f in diffs for f in affectingFields):
+                affected.add(tag)
+    if oldDef is not None and newDef is not None:
+        report['def'] = diff_dicts(oldDef, newDef, defFields)
+        del report['def']['retired']        # the definitions have no Retired field
+    report['affected'] = sorted(affected)
+
+    return report
+
+
+def write_report(f, report):
+    text = json.dumps(report, indent=1, sort_keys=True, ensure_ascii=False, separators=(',', ': '))
+    f.write(_text(text) + u"\n")
+
+
+def summary(report):
+    lines = []
+    for kind in ('vr', 'mask', 'def'):
+        if kind in report:
+            d = report[kind]
+            counts = "%d added, %d removed" % (len(d['added']), len(d['removed']))
+            if 'retired' in d:
+                counts += ", %d retired" % len(d['retired'])
+            lines.append("%s: %s, %d changed" % (kind, counts, len(d['changed'])))
+    lines.append("%d tags affect the ontology" % len(report['affected']))
+    return "\n".join(lines)
+
+
+def main(args):
+    update = '--update' in args
+    args = [a for a in args if a != '--update']
+    if len(args) < 2:
+        print (__doc__)
+        return 1
+    outFile = args[2] if len(args) > 2 else reportFilename
+
+    report = diff_releases(args[0], args[1])
+    with io.open(outFile, 'w', encoding='utf-8') as f:
+        write_report(f, report)
+    print (summary(report))
+    print ("Wrote %s" % outFile)
+
+    if update and report['affected']:
+        import check_add_vr
+        check_add_vr.main_incremental(onlyTags=set(report['affected']))
+    return 0
+
+
+##############################################################
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
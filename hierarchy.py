@@ -0,0 +1,410 @@
+'''
+  Compiled class hierarchy of an ontology file, for ancestor, descendant
+  and is-a questions without scanning the file or loading it into an RDF
+  store.
+
+  build_hierarchy() runs owl_reader over the ontology once, takes the
+  rdfs:subClassOf (child -> parent) and dct:hasPart (whole -> part, the
+  part being below the whole) statements of every section as edges, and
+  computes the transitive closure as one bitset per node: Python ints are
+  OR-ed up the edges in topological order (nodes on a cycle are iterated
+  until nothing changes).  The hierarchy is a DAG (a tag can sit under
+  several terms), so the bitsets are used rather than pre/post-order
+  intervals, which only describe trees.
+
+  The result is written next to the ontology (dicom_ontology_nlx.owl ->
+  dicom_ontology_nlx.owl.hier) and rebuilt by open_hierarchy() whenever the
+  size or mtime of the ontology no longer match.  Layout (integers little
+  endian):
+
+    header    magic 'DCHY', version (H), reserved (H), nodes (I), bytes
+              per bitset row (I), edges (I), prefix text size (I), mtime (d)
+              and size (q) of the ontology file
+    prefixes  utf-8 "prefix=IRI" pairs separated by spaces
+    offsets   (nodes + 1) byte offsets (I) into the node IRIs
+    nodes     utf-8 IRIs, sorted; a node's id is its rank
+    edges     edges * (child, parent, kind) (I), sorted; kind 0 is
+              subClassOf, 1 hasPart
+    up        nodes rows: the ancestors of each node over both relations
+    down      nodes rows: the descendants of each node (up transposed)
+    isa       nodes rows: the ancestors over subClassOf only
+
+  Bit j of a row is bit (j & 7) of its byte j >> 3.  A question about two
+  nodes reads one byte of the mmap; listing the ancestors or descendants of
+  a node decodes one row.
+
+  Example:
+    import hierarchy
+    h = hierarchy.open_hierarchy()
+    h.is_descendant('dicom:dicom_00280011', 'dc:identifier')    # -> True
+    h.descendants('dicom:dicom_00000071')     # -> ['http://purl.org/nidash/dicom#dicom_00000072', ...]
+
+  Usage:
+    python hierarchy.py [--owl file.owl] --build
+    python hierarchy.py [--owl file.owl] <term> [<term> ...]
+
+'''
+
+import os, sys
+import mmap
+import struct
+import binascii
+
+import dicom_dict
+import owl_reader
+
+#************************************************
+#input parameters
+ontologyFilename = 'dicom_ontology_nlx.owl'    # default ontology, in dicom_dict.dictDir
+hierSuffix = '.hier'
+subClassPredicate = 'rdfs:subClassOf'
+hasPartPredicate = 'dct:hasPart'
+dicomNamespace = 'http://purl.org/nidash/dicom#'
+#************************************************
+
+MAGIC = b'DCHY'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIIIdq')
+
+SUBCLASS, HASPART = 0, 1
+
+PY3 = sys.version_info[0] >= 3
+
+# open hierarchies, keyed by absolute path of the ontology file
+_open = {}
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def _int_bytes(v, n):
+    ''' n little-endian bytes of the non-negative int v '''
+    if PY3:
+        return v.to_bytes(n, 'little')
+    return binascii.unhexlify('%0*x' % (2 * n, v))[::-1] if n else b''
+
+
+def _bytes_int(b):
+    if PY3:
+        return int.from_bytes(b, 'little')
+    return int(binascii.hexlify(b[::-1]), 16) if b else 0
+
+
+def _bits(v):
+    ''' positions of the set bits of v, lowest first '''
+    found = []
+    while v:
+        low = v & -v
+        found.append(low.bit_length() - 1)
+        v ^= low
+    return found
+
+
+def hier_path(owlPath):
+    return owlPath + hierSuffix
+
+
+def _signature(owlPath):
+    st = os.stat(owlPath)
+    return st.st_mtime, st.st_size
+
+
+def read_edges(owlPath):
+    ''' ({prefix: IRI}, [(child IRI, parent IRI, kind)]) from the statements of owlPath '''
+    prefixes = {}
+    edges = set()
+    with open(owlPath, 'rb') as f:
+        for entity in owl_reader.iter_entities(f, prefixes):
+            subject = _text(entity.iri)
+            for kind, pred in ((SUBCLASS, subClassPredicate), (HASPART, hasPartPredicate)):
+                for obj in entity.predicates.get(pred, ()):
+                    obj = _text(owl_reader.expand(obj, prefixes))
+                    if obj.startswith('"') or obj.startswith('[') or obj.startswith('_:'):
+                        continue    # only named classes are nodes
+                    if kind == SUBCLASS:
+                        edges.add((subject, obj, kind))
+                    else:
+                        edges.add((obj, subject, kind))     # the part is below the whole
+    return prefixes, sorted(edges)
+
+
+def closure(nnodes, parents):
+    ''' ancestors bitset (int) of every node; parents[n] is the list of parent ids of n '''
+    children = [[] for n in range(nnodes)]
+    pending = [len(parents[n]) for n in range(nnodes)]
+    for n in range(nnodes):
+        for p in parents[n]:
+            children[p].append(n)
+    up = [0] * nnodes
+    # parents before children
+    ready = [n for n in range(nnodes) if pending[n] == 0]
+    done = 0
+    while ready:
+        p = ready.pop()
+        done += 1
+        for c in children[p]:
+            up[c] |= up[p] | (1 << p)
+            pending[c] -= 1
+            if pending[c] == 0:
+                ready.append(c)
+    if done < nnodes:
+        # nodes on a cycle (and below one): repeat until nothing changes
+        left = [n for n in range(nnodes) if pending[n] > 0]
+        changed = True
+        while changed:
+            changed = False
+            for n in left:
+                v = up[n]
+                for p in parents[n]:
+                    v |= up[p] | (1 << p)
+                if v != up[n]:
+                    up[n] = v
+                    changed = True
+    return up
+
+
+def build_hierarchy(owlPath, outPath=None):
+    ''' Compiles the hierarchy of owlPath and writes it; returns the path written '''
+    if outPath is None:
+        outPath = hier_path(owlPath)
+    mtime, size = _signature(owlPath)
+    prefixes, edges = read_edges(owlPath)
+
+    nodes = sorted(set([c for c, p, k in edges] + [p for c, p, k in edges]), key=lambda t: t.encode('utf-8'))
+    ids = dict((t, i) for i, t in enumerate(nodes))
+    n = len(nodes)
+    idEdges = sorted((ids[c], ids[p], k) for c, p, k in edges)
+    parents = [[] for i in range(n)]
+    isaParents = [[] for i in range(n)]
+    for c, p, k in idEdges:
+        parents[c].append(p)
+        if k == SUBCLASS:
+            isaParents[c].append(p)
+    up = closure(n, parents)
+    isa = closure(n, isaParents)
+    down = [0] * n
+    for c in range(n):
+        for a in _bits(up[c]):
+            down[a] |= 1 << c
+
+    rowBytes = (n + 7) // 8
+    prefixText = u' '.join(u'%s=%s' % (_text(p), _text(prefixes[p])) for p in sorted(prefixes)).encode('utf-8')
+    encoded = [t.encode('utf-8') for t in nodes]
+    offsets = [0]
+    for b in encoded:
+        offsets.append(offsets[-1] + len(b))
+
+    tmpPath = outPath + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, n, rowBytes, len(idEdges), len(prefixText), mtime, size))
+        f.write(prefixText)
+        f.write(struct.pack('<%dI' % len(offsets), *offsets))
+        f.write(b''.join(encoded))
+        f.write(struct.pack('<%dI' % (3 * len(idEdges)), *[i for e in idEdges for i in e]))
+        for rows in (up, down, isa):
+            for v in rows:
+                f.write(_int_bytes(v, rowBytes))
+    os.rename(tmpPath, outPath)
+    return outPath
+
+
+def is_stale(owlPath, hierPath=None):
+    ''' True if the compiled hierarchy is missing or was built from another version of owlPath '''
+    if hierPath is None:
+        hierPath = hier_path(owlPath)
+    try:
+        with open(hierPath, 'rb') as f:
+            header = f.read(HEADER.size)
+    except (IOError, OSError):
+        return True
+    if len(header) < HEADER.size:
+        return True
+    magic, version, reserved, n, rowBytes, nedges, prefixSize, mtime, size = HEADER.unpack(header)
+    return magic != MAGIC or version != VERSION or (mtime, size) != _signature(owlPath)
+
+
+class Hierarchy(object):
+    ''' Read-only view of a compiled hierarchy '''
+
+    def __init__(self, hierPath):
+        self.path = hierPath
+        with open(hierPath, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, reserved, n, rowBytes, nedges, prefixSize,
+         mtime, size) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a compiled hierarchy" % hierPath)
+        self.nnodes = n
+        self.nedges = nedges
+        self._rowBytes = rowBytes
+        at = HEADER.size
+        self.prefixes = dict(p.split(u'=', 1) for p in self._mm[at:at + prefixSize].decode('utf-8').split())
+        at += prefixSize
+        self._offsetsAt = at
+        at += (n + 1) * 4
+        self._nodesAt = at
+        at += struct.unpack_from('<I', self._mm, self._offsetsAt + n * 4)[0]
+        self._edgesAt = at
+        at += nedges * 12
+        self._upAt = at
+        self._downAt = at + n * rowBytes
+        self._isaAt = at + 2 * n * rowBytes
+        self._edge = struct.Struct('<3I')
+
+    def close(self):
+        self._mm.close()
+
+    def _node_bytes(self, i):
+        start, end = struct.unpack_from('<2I', self._mm, self._offsetsAt + i * 4)
+        return self._mm[self._nodesAt + start:self._nodesAt + end]
+
+    def node(self, i):
+        ''' IRI of node i '''
+        return self._node_bytes(i).decode('utf-8')
+
+    def iri(self, term):
+        ''' full IRI for an IRI, <IRI>, prefixed name, local name (dicom_00280011) or tag '''
+        term = _text(term)
+        if term.startswith(u'<') and term.endswith(u'>'):
+            return term[1:-1]
+        if len(term) == 8 and all(c in u'0123456789abcdefABCDEFx' for c in term):
+            return dicomNamespace + u'dicom_' + term
+        if term.startswith(u'dicom_'):
+            return dicomNamespace + term
+        return owl_reader.expand(term, self.prefixes)
+
+    def node_id(self, term):
+        ''' id of a term, or -1 if it is not in the hierarchy '''
+        b = self.iri(term).encode('utf-8')
+        lo, hi = 0, self.nnodes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._node_bytes(mid) < b:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.nnodes and self._node_bytes(lo) == b:
+            return lo
+        return -1
+
+    def __contains__(self, term):
+        return self.node_id(term) >= 0
+
+    def __len__(self):
+        return self.nnodes
+
+    def _bit(self, at, row, j):
+        return struct.unpack_from('<B', self._mm, at + row * self._rowBytes + (j >> 3))[0] >> (j & 7) & 1 == 1
+
+    def _row(self, at, row):
+        start = at + row * self._rowBytes
+        return [self.node(j) for j in _bits(_bytes_int(self._mm[start:start + self._rowBytes]))]
+
+    def _ids(self, a, b):
+        return self.node_id(a), self.node_id(b)
+
+    def is_descendant(self, term, ancestor):
+        ''' True if term is below ancestor over subClassOf and hasPart '''
+        i, j = self._ids(term, ancestor)
+        return i >= 0 and j >= 0 and self._bit(self._upAt, i, j)
+
+    def is_ancestor(self, term, descendant):
+        return self.is_descendant(descendant, term)
+
+    def is_a(self, term, cls):
+        ''' True if term is cls or a subclass of it over subClassOf only '''
+        i, j = self._ids(term, cls)
+        return i >= 0 and j >= 0 and (i == j or self._bit(self._isaAt, i, j))
+
+    def ancestors(self, term):
+        ''' IRIs above term (both relations), in IRI order '''
+        i = self.node_id(term)
+        return self._row(self._upAt, i) if i >= 0 else []
+
+    def descendants(self, term):
+        ''' IRIs below term (both relations), in IRI order '''
+        i = self.node_id(term)
+        return self._row(self._downAt, i) if i >= 0 else []
+
+    def superclasses(self, term):
+        ''' IRIs term is a subclass of (subClassOf only), in IRI order '''
+        i = self.node_id(term)
+        return self._row(self._isaAt, i) if i >= 0 else []
+
+    def edges(self):
+        ''' (child IRI, parent IRI, kind) of every direct edge '''
+        for e in range(self.nedges):
+            c, p, k = self._edge.unpack_from(self._mm, self._edgesAt + e * 12)
+            yield self.node(c), self.node(p), k
+
+    def parents(self, term):
+        ''' [(parent IRI, kind)] of the direct edges from term '''
+        i = self.node_id(term)
+        if i < 0:
+            return []
+        lo, hi = 0, self.nedges
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._edge.unpack_from(self._mm, self._edgesAt + mid * 12)[0] < i:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.nedges:
+            c, p, k = self._edge.unpack_from(self._mm, self._edgesAt + lo * 12)
+            if c != i:
+                break
+            found.append((self.node(p), k))
+            lo += 1
+        return found
+
+
+def open_hierarchy(owlPath=None):
+    ''' Hierarchy of owlPath (default: ontologyFilename in dicom_dict.dictDir), compiled
+    if missing or stale; opened once per process
+    '''
+    if owlPath is None:
+        owlPath = os.path.join(dicom_dict.dictDir, ontologyFilename)
+    key = os.path.abspath(owlPath)
+    h = _open.get(key)
+    if h is None:
+        hierPath = hier_path(key)
+        if is_stale(key, hierPath):
+            build_hierarchy(key, hierPath)
+        h = _open[key] = Hierarchy(hierPath)
+    return h
+
+
+def main(args):
+    owlPath = None
+    if len(args) > 1 and args[0] == '--owl':
+        owlPath = args[1]
+        args = args[2:]
+    if not args:
+        print (__doc__)
+        return 1
+    if args == ['--build']:
+        if owlPath is None:
+            owlPath = os.path.join(dicom_dict.dictDir, ontologyFilename)
+        path = build_hierarchy(owlPath)
+        h = Hierarchy(path)
+        print ("Wrote %s: %d nodes, %d edges" % (path, len(h), h.nedges))
+        return 0
+    h = open_hierarchy(owlPath)
+    for term in args:
+        if term not in h:
+            print ("%s: not in the hierarchy" % term)
+            continue
+        print (h.iri(term))
+        for p, k in h.parents(term):
+            print ("  %s %s" % ('subClassOf' if k == SUBCLASS else 'part of', p))
+        print ("  %d ancestors, %d descendants" % (len(h.ancestors(term)), len(h.descendants(term))))
+    return 0
+
+
+##############################################################
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,183 @@
+'''
+  Batch matching of DICOM tag labels against the Neurolex DICOM labels.
+
+  This replaces the word-by-word scan of create_dicom_ttl.string_match,
+  which compared each DICOM label with every Neurolex label and then asked
+  on the console whether the best partial match was right.  Here the
+  Neurolex labels are put into an inverted index (token -> label ids) once,
+  each DICOM label only scores the labels it shares a token with, and the
+  candidates above a threshold are written to a tab-separated file that
+  can be reviewed afterwards instead of answered interactively.
+
+  Tokens are the words of a label with at least minTokenLength characters
+  (the old code skipped words of 2 characters or less), compared in lower
+  case.  Two scores are available:
+    tfidf   - cosine similarity of the idf-weighted token vectors, so that
+              rare words ("Collimator") count more than common ones ("Sequence")
+    jaccard - shared tokens / tokens in either label
+
+  Candidate file columns:
+    DICOM label, Neurolex label, Neurolex ID, DICOM ID, VR, score, exact, accepted
+
+  The standalone main() aligns two plain label files (one label per line,
+  optionally followed by tab-separated columns that are copied through).
+
+'''
+
+import io
+import re
+import math
+
+#************************************************
+#input parameters
+minTokenLength = 3          # don't match 2-or-less length words
+scoring = 'tfidf'           # 'tfidf' or 'jaccard'
+threshold = 0.5             # lowest score written to the candidate file
+maxCandidates = 5           # candidates kept per DICOM label
+dicomLabelFile = 'dicom_labels.txt'
+nlxLabelFile = 'nlx_labels.txt'
+matchFile = 'label_match_candidates.tsv'
+#************************************************
+
+_word = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def tokenize(label, minLength=None):
+    ''' lower-cased words of label that are at least minLength characters long '''
+    if minLength is None:
+        minLength = minTokenLength
+    return [w for w in _word.findall(label.lower()) if len(w) >= minLength]
+
+
+class LabelIndex(object):
+    ''' Inverted index over a list of labels; label ids are list positions '''
+
+    def __init__(self, labels, minLength=None):
+        self.labels = list(labels)
+        self.minLength = minTokenLength if minLength is None else minLength
+        self.exact = {}         # label -> first label id
+        self.postings = {}      # token -> list of label ids
+        self.tokens = []        # label id -> set of tokens
+        for i, label in enumerate(self.labels):
+            self.exact.setdefault(label, i)
+            toks = set(tokenize(label, self.minLength))
+            self.tokens.append(toks)
+            for t in toks:
+                self.postings.setdefault(t, []).append(i)
+
+        n = len(self.labels)
+        self.idf = dict((t, math.log((n + 1.0) / len(ids))) for t, ids in self.postings.items())
+        self._unknownIdf = math.log(n + 1.0)
+        self.norms = [math.sqrt(sum(self.idf[t] ** 2 for t in toks)) for toks in self.tokens]
+
+    def find_exact(self, label):
+        return self.exact.get(label)
+
+    def candidates(self, label, method=None, minScore=None, limit=None):
+        ''' Returns [(label id, score)] best first for the labels sharing at least
+        one token with label and scoring at least minScore
+        '''
+        if method is None:
+            method = scoring
+        if minScore is None:
+            minScore = threshold
+        if limit is None:
+            limit = maxCandidates
+
+        query = set(tokenize(label, self.minLength))
+        if not query:
+            return []
+
+        # accumulate the shared tokens (or their weights) per label
+        acc = {}
+        for t in query:
+            ids = self.postings.get(t)
+            if not ids:
+                continue
+            w = self.idf[t] ** 2 if method == 'tfidf' else 1.0
+            for i in ids:
+                acc[i] = acc.get(i, 0.0) + w
+
+        scores = []
+        if method == 'tfidf':
+            qnorm = math.sqrt(sum(self.idf.get(t, self._unknownIdf) ** 2 for t in query))
+            for i, dot in acc.items():
+                denom = qnorm * self.norms[i]
+                if denom:
+                    scores.append((i, dot / denom))
+        elif method == 'jaccard':
+            for i, shared in acc.items():
+                scores.append((i, shared / (len(query) + len(self.tokens[i]) - shared)))
+        else:
+            raise ValueError("unknown scoring method: %s" % method)
+
+        scores = [s for s in scores if s[1] >= minScore]
+        scores.sort(key=lambda s: (-s[1], s[0]))
+        return scores[:limit]
+
+
+def write_candidate_header(f):
+    f.write(u"DICOM label\tNeurolex label\tNeurolex ID\tDICOM ID\tVR\tscore\texact\taccepted\n")
+
+
+def write_candidate(f, label, row, score, exact, accepted):
+    ''' row is a Neurolex row [label, nlxID, dicomID, vr] '''
+    fields = [label, row[0], row[1], row[2], row[3], "%.4f" % score, str(int(exact)), str(int(accepted))]
+    f.write(u"\t".join(_text(x) for x in fields) + u"\n")
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def align_labels(labels, rows, out, method=None, minScore=None, limit=None):
+    ''' Matches every label in labels against the Neurolex rows [label, nlxID, dicomID, vr]
+    and writes all candidates to the open text file out.
+    Returns {label: row of the accepted match or None}; a label is matched
+    to an identical Neurolex label if there is one, otherwise to its best candidate.
+    '''
+    index = LabelIndex([r[0] for r in rows])
+    write_candidate_header(out)
+    matches = {}
+    for label in labels:
+        i = index.find_exact(label)
+        if i is not None:
+            write_candidate(out, label, rows[i], 1.0, True, True)
+            matches[label] = rows[i]
+            continue
+        best = None
+        for i, score in index.candidates(label, method, minScore, limit):
+            write_candidate(out, label, rows[i], score, False, best is None)
+            if best is None:
+                best = rows[i]
+        matches[label] = best
+
+    return matches
+
+
+def read_label_file(fileName):
+    ''' one label per line, further tab-separated columns are kept as the rest of the row '''
+    rows = []
+    with io.open(fileName, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.strip():
+                row = line.split('\t')
+                rows.append((row + ['', '', ''])[:4])
+    return rows
+
+
+def main():
+    dicomLabels = [r[0] for r in read_label_file(dicomLabelFile)]
+    nlxRows = read_label_file(nlxLabelFile)
+    with io.open(matchFile, 'w', encoding='utf-8') as out:
+        matches = align_labels(dicomLabels, nlxRows, out)
+    found = len([m for m in matches.values() if m is not None])
+    print ("Matched %d of %d labels; candidates written to %s" % (found, len(dicomLabels), matchFile))
+
+
+##############################################################
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+'''
+  Instrumentation for the build scripts (vr_generate_dict.py,
+  def_generate_dict_reorg.py, build_dicts.py, check_add_vr.py,
+  create_dicom_ttl.0.4.py).
+
+    stage(name)     context manager adding the wall time of a block to a
+                    named stage; a stage entered several times accumulates
+    count(name, n)  adds n to a named counter (tables, rows, lookups,
+                    cache hits, ...)
+    say(*args)      console output about single entries, as print would
+                    write it; nothing is written in quiet mode, so a run
+                    over thousands of tags does not spend its time on the
+                    terminal
+    start(), finish()
+                    wrap a script's main(): start() takes the options below
+                    off the command line, finish() prints the summary and
+                    writes it as JSON
+
+  Options understood by start():
+
+    --quiet             quiet mode (see say)
+    --profile           run under cProfile; the stats are written to
+                        profileFilename and the top entries are printed
+    --trace-memory      record the peak of tracemalloc (Python 3 only)
+    --metrics <file>    write the summary as JSON to <file>
+
+  The summary holds the script name, total wall time, the stages in the
+  order they were first entered (seconds, calls), the counters, the peak
+  resident size of the process and, when captured, the tracemalloc peak
+  and the profile file.  Everything is kept in module globals: counting is
+  a dict update, cheap enough for the per-row and per-lookup counters.
+
+  Example:
+    import metrics
+    with metrics.stage('parse'):
+        attrs = parse_docbook_stream(f)
+    metrics.count('rows', len(attrs))
+
+'''
+
+import sys
+import io
+import json
+import time
+from contextlib import contextmanager
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#************************************************
+#input parameters
+quiet = False
+profileFilename = 'profile.pstats'
+profileLines = 25           # entries of the profile printed by finish()
+metricsFilename = None      # JSON summary written by finish(), if set
+#************************************************
+
+_stages = OrderedDict()     # name -> [seconds, calls]
+_counters = OrderedDict()   # name -> count
+_run = {'script': None, 'start': None, 'profiler': None, 'tracemalloc': None}
+
+PY3 = sys.version_info[0] >= 3
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8', 'replace')
+    if isinstance(s, type(u'')):
+        return s
+    return u'%s' % (s,)
+
+
+def _bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return _text(s).encode('utf-8')
+
+
+def reset():
+    ''' forgets all stages and counters '''
+    _stages.clear()
+    _counters.clear()
+    _run.update(script=None, start=None, profiler=None, tracemalloc=None)
+
+
+def count(name, n=1):
+    _counters[name] = _counters.get(name, 0) + n
+
+
+def counter(name):
+    return _counters.get(name, 0)
+
+
+@contextmanager
+def stage(name):
+    ''' times the enclosed block under name '''
+    t = time.time()
+    try:
+        yield
+    finally:
+        s = _stages.get(name)
+        if s is None:
+            s = _stages[name] = [0.0, 0]
+        s[0] += time.time() - t
+        s[1] += 1
+
+
+def say(*args):
+    ''' prints args separated by spaces, unless in quiet mode '''
+    if quiet:
+        return
+    if len(args) == 1:
+        print (args[0])
+    elif PY3:
+        print (u' '.join([_text(a) for a in args]))
+    else:
+        # byte strings, as print 'a', s wrote them; unicode would fail on a pipe
+        print (b' '.join([_bytes(a) for a in args]))
+
+
+def start(script, args=None):
+    ''' Starts the run of script; returns args without the options handled here '''
+    global quiet, metricsFilename
+    reset()
+    rest = []
+    args = list(args or [])
+    profile = traceMemory = False
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a == '--quiet':
+            quiet = True
+        elif a == '--profile':
+            profile = True
+        elif a == '--trace-memory':
+            traceMemory = True
+        elif a == '--metrics' and i + 1 < len(args):
+            metricsFilename = args[i + 1]
+            i += 1
+        else:
+            rest.append(a)
+        i += 1
+
+    _run['script'] = script
+    if traceMemory:
+        try:
+            import tracemalloc
+            tracemalloc.start()
+            _run['tracemalloc'] = tracemalloc
+        except ImportError:
+            sys.stderr.write("tracemalloc is not available on Python %s; --trace-memory ignored\n"
+                             % sys.version.split()[0])
+    if profile:
+        import cProfile
+        _run['profiler'] = cProfile.Profile()
+        _run['profiler'].enable()
+    _run['start'] = time.time()
+    return rest
+
+
+def peak_rss_kb():
+    ''' peak resident size of this process in KB, or None '''
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+
+def summary():
+    ''' the metrics collected so far, as a dict ready for json.dump '''
+    result = OrderedDict()
+    result['script'] = _run['script']
+    if _run['start'] is not None:
+        result['wall'] = round(time.time() - _run['start'], 6)
+    result['stages'] = OrderedDict((name, {'seconds': round(s[0], 6), 'calls': s[1]})
+                                   for name, s in _stages.items())
+    result['counters'] = OrderedDict(_counters)
+    memory = OrderedDict()
+    memory['peak_rss_kb'] = peak_rss_kb()
+    if _run['tracemalloc'] is not None:
+        memory['tracemalloc_peak_kb'] = _run['tracemalloc'].get_traced_memory()[1] // 1024
+    result['memory'] = memory
+    if _run['profiler'] is not None:
+        result['profile'] = profileFilename
+    return result
+
+
+def format_summary(result):
+    lines = [u'%s: %.3f s' % (result['script'], result.get('wall', 0.0))]
+    for name, s in result['stages'].items():
+        lines.append(u'  %-24s %9.3f s  %6d calls' % (name, s['seconds'], s['calls']))
+    for name, n in result['counters'].items():
+        lines.append(u'  %-24s %9d' % (name, n))
+    for name, kb in result['memory'].items():
+        if kb is not None:
+            lines.append(u'  %-24s %9d KB' % (name, kb))
+    return u'\n'.join(lines)
+
+
+def finish():
+    ''' Stops the capture started by start(), prints the summary (also in quiet mode)
+    and writes it to metricsFilename; returns the summary
+    '''
+    profiler = _run['profiler']
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profileFilename)
+    result = summary()
+    if _run['tracemalloc'] is not None:
+        _run['tracemalloc'].stop()
+
+    if metricsFilename:
+        text = json.dumps(result, indent=1, separators=(',', ': '))
+        with io.open(metricsFilename, 'w', encoding='utf-8') as f:
+            f.write(_text(text) + u'\n')
+
+    sys.stdout.flush()
+    sys.stderr.write(format_summary(result) + u'\n')
+    if metricsFilename:
+        sys.stderr.write("Wrote %s\n" % metricsFilename)
+    if profiler is not None:
+        import pstats
+        stats = pstats.Stats(profileFilename, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(profileLines)
+    return result
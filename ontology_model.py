@@ -0,0 +1,184 @@
+'''
+  Lazy Python model of an ontology file (e.g. dicom_ontology_nlx.owl).
+
+  LazyOntology keeps only the IRI -> block offsets index of
+  owl_index.OwlIndex in memory.  An entity is parsed the first time it is
+  asked for: its blocks (the Protege file declares an entity once per
+  section) are read through the mmap of the file, run through owl_reader
+  and merged into a Term record.  The most recently used cacheSize Terms
+  are kept; a job that touches a few hundred tags never holds more than
+  those and the index, where reading the whole file into owl_reader
+  Entities holds every block, line and predicate at once.
+
+  Term is a __slots__ record (no per-instance dict) with
+
+    iri, id         full IRI and local name (dicom_00280011)
+    label           rdfs:label
+    definitions     tuple of the obo:IAO_0000115 definitions; definition
+                    is the first one
+    vr              dicom:VR
+    tag             8-character tag, from the dicom:dicom_00000065
+                    "(gggg,eeee)" literal or an ID that is a tag
+    sameAs          tuple of owl:sameAs IRIs (nlx_...)
+    subClassOf      tuple of rdfs:subClassOf IRIs
+    hasPart         tuple of dct:hasPart IRIs
+    types           tuple of rdf:type IRIs
+
+  Literals are given as their text, names as full IRIs; values that are
+  neither (e.g. a bracketed restriction) are kept as written.
+
+  Example:
+    import ontology_model
+    onto = ontology_model.LazyOntology('dicom_ontology_nlx.owl')
+    t = onto['00280011']         # also 'dicom_00280011', 'dicom:dicom_00280011', the IRI
+    t.label, t.vr, t.sameAs      # -> ('Columns', 'US', ('http://uri.neuinfo.org/nif/nifstd/nlx_149722',))
+
+'''
+
+import os
+from collections import OrderedDict
+
+import dicom_db
+import dicom_dict
+import owl_index
+import owl_reader
+
+#************************************************
+#input parameters
+ontologyFilename = 'dicom_ontology_nlx.owl'     # opened by open_ontology() by default
+cacheSize = 1024            # parsed Terms kept per ontology
+labelPredicate = 'rdfs:label'
+definitionPredicate = 'obo:IAO_0000115'
+vrPredicate = 'dicom:VR'
+sameAsPredicate = 'owl:sameAs'
+subClassPredicate = 'rdfs:subClassOf'
+hasPartPredicate = 'dct:hasPart'
+typePredicates = ('rdf:type', 'a')
+#************************************************
+
+
+class Term(object):
+    ''' One ontology entity, merged over all of its blocks '''
+
+    __slots__ = ('iri', 'id', 'label', 'definitions', 'vr', 'tag', 'sameAs', 'subClassOf',
+                 'hasPart', 'types')
+
+    def __init__(self, iri, id, label=None, definitions=(), vr=None, tag=None, sameAs=(),
+                 subClassOf=(), hasPart=(), types=()):
+        self.iri = iri
+        self.id = id
+        self.label = label
+        self.definitions = definitions
+        self.vr = vr
+        self.tag = tag
+        self.sameAs = sameAs
+        self.subClassOf = subClassOf
+        self.hasPart = hasPart
+        self.types = types
+
+    @property
+    def definition(self):
+        return self.definitions[0] if self.definitions else None
+
+    def __repr__(self):
+        return 'Term(%r, label=%r)' % (self.id, self.label)
+
+
+def _unique(values):
+    seen = set()
+    return tuple(v for v in values if not (v in seen or seen.add(v)))
+
+
+class LazyOntology(object):
+    ''' Terms of one ontology file, parsed on first access '''
+
+    def __init__(self, owlPath, maxTerms=None):
+        ''' maxTerms: parsed Terms to keep (default cacheSize, 0 keeps none) '''
+        self.index = owl_index.OwlIndex(owlPath)
+        self.owlPath = owlPath
+        self.maxTerms = maxTerms if maxTerms is not None else cacheSize
+        self._cache = OrderedDict()     # iri -> Term, least recently used first
+        self.parsed = 0                 # Terms built so far, cache misses included
+
+    def close(self):
+        self.index.close()
+
+    def iri(self, term):
+        ''' full IRI for any spelling OwlIndex accepts (IRI, prefixed name, local name, tag) '''
+        return self.index.iri(term)
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index.iris())
+
+    def __getitem__(self, term):
+        iri = self.iri(term)
+        t = self._cache.pop(iri, None)
+        if t is None:
+            if iri not in self.index.blocks:
+                raise KeyError(term)
+            t = self._parse(iri)
+            self.parsed += 1
+            while self._cache and len(self._cache) >= self.maxTerms:
+                self._cache.popitem(last=False)
+        if self.maxTerms > 0:
+            self._cache[iri] = t
+        return t
+
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _name(self, value):
+        return owl_reader.expand(value, self.index.prefixes)
+
+    def _parse(self, iri):
+        localId = iri.rsplit('#', 1)[-1].rsplit('/', 1)[-1]
+        label = vr = tag = None
+        definitions, sameAs, subClassOf, hasPart, types = [], [], [], [], []
+        for entity in self.index.entities(iri):
+            p = entity.predicates
+            for value in p.get(labelPredicate, ()):
+                if label is None:
+                    label = dicom_db.literal_value(value)
+            for value in p.get(vrPredicate, ()):
+                if vr is None:
+                    vr = dicom_db.literal_value(value)
+            if tag is None:
+                tag = dicom_db.entity_tag(localId, p)
+            definitions += [d for d in (dicom_db.literal_value(v) for v in p.get(definitionPredicate, ()))
+                            if d is not None]
+            sameAs += [self._name(v) for v in p.get(sameAsPredicate, ())]
+            subClassOf += [self._name(v) for v in p.get(subClassPredicate, ())]
+            hasPart += [self._name(v) for v in p.get(hasPartPredicate, ())]
+            for pred in typePredicates:
+                types += [self._name(v) for v in p.get(pred, ())]
+        return Term(iri, localId, label, _unique(definitions), vr, tag, _unique(sameAs),
+                    _unique(subClassOf), _unique(hasPart), _unique(types))
+
+
+# open ontologies, keyed by absolute path
+_open = {}
+
+
+def open_ontology(owlPath=None):
+    ''' LazyOntology for owlPath (default: ontologyFilename in dicom_dict.dictDir),
+    opened once per process
+    '''
+    if owlPath is None:
+        owlPath = os.path.join(dicom_dict.dictDir, ontologyFilename)
+    key = os.path.abspath(owlPath)
+    onto = _open.get(key)
+    if onto is None:
+        onto = _open[key] = LazyOntology(key)
+    return onto
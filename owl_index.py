@@ -0,0 +1,196 @@
+'''
+  Byte-offset index of the entity blocks in an ontology file, for looking
+  up single terms without reading the whole file.
+
+  build_index() runs owl_reader over the file once and writes a sidecar
+  next to it (dicom_ontology_nlx.owl -> dicom_ontology_nlx.owl.idx) with
+  one tab-separated line per block:
+
+    IRI <tab> byte offset <tab> length in bytes <tab> section
+
+  The first line records the size and mtime of the ontology file and the
+  @prefix declarations; OwlIndex rebuilds the sidecar whenever the size or
+  mtime of the ontology file no longer match.  Lookups go straight to the
+  blocks through an mmap of the ontology file.
+
+  Terms can be given as a full IRI, <IRI>, a prefixed name
+  (dicom:dicom_00280011), a bare local name (dicom_00280011) or an
+  8-character tag (00280011).  An IRI can have several blocks (the Protege
+  file declares an entity once per section), so lookups return lists.
+
+  Example:
+    import owl_index
+    idx = owl_index.OwlIndex('dicom_ontology_nlx.owl')
+    for text in idx.lookup('dicom:dicom_00280011'):
+        print(text)
+
+'''
+
+import os
+import io
+import re
+import mmap
+from array import array
+
+import owl_reader
+
+#************************************************
+#input parameters
+indexSuffix = '.idx'
+dicomNamespace = 'http://purl.org/nidash/dicom#'
+#************************************************
+
+INDEX_VERSION = '1'
+
+_tag = re.compile(r'^[0-9A-Fa-fx]{8}$')
+
+
+def index_path(owlPath):
+    return owlPath + indexSuffix
+
+
+def _signature(owlPath):
+    st = os.stat(owlPath)
+    return st.st_size, repr(st.st_mtime)
+
+
+def build_index(owlPath, idxPath=None):
+    ''' Scan owlPath once and write its block index; returns the index path '''
+    if idxPath is None:
+        idxPath = index_path(owlPath)
+    size, mtime = _signature(owlPath)
+    prefixes = {}
+    rows = []
+    with open(owlPath, 'rb') as f:
+        for entity in owl_reader.iter_entities(f, prefixes):
+            rows.append(u"%s\t%d\t%d\t%s\n" % (entity.iri, entity.start_byte,
+                        entity.end_byte - entity.start_byte, entity.section or u''))
+
+    tmpPath = idxPath + '.tmp'
+    with io.open(tmpPath, 'w', encoding='utf-8') as f:
+        f.write(u"#owl_index\t%s\t%d\t%s\t%s\n" % (INDEX_VERSION, size, mtime,
+                u" ".join(u"%s=%s" % (p, prefixes[p]) for p in sorted(prefixes))))
+        for row in rows:
+            f.write(row)
+    os.rename(tmpPath, idxPath)
+
+    return idxPath
+
+
+def _read_header(idxPath):
+    with io.open(idxPath, 'r', encoding='utf-8') as f:
+        fields = f.readline().rstrip('\n').split('\t')
+    if len(fields) != 5 or fields[0] != '#owl_index' or fields[1] != INDEX_VERSION:
+        return None
+    return int(fields[2]), fields[3], fields[4]
+
+
+def is_stale(owlPath, idxPath=None):
+    ''' True if the index is missing or was built from another version of owlPath '''
+    if idxPath is None:
+        idxPath = index_path(owlPath)
+    try:
+        header = _read_header(idxPath)
+    except (IOError, OSError):
+        return True
+    if header is None:
+        return True
+    return (header[0], header[1]) != _signature(owlPath)
+
+
+class OwlIndex(object):
+    ''' IRI -> [(offset, length, section)] for the blocks of one ontology file
+
+    The blocks are kept in flat arrays, those of one IRI next to each other in
+    file order, and blocks maps each IRI to a single int (first block << 16 |
+    number of blocks), so the index costs a dict entry per IRI rather than a
+    list and a tuple per block.
+    '''
+
+    def __init__(self, owlPath, idxPath=None):
+        self.owlPath = owlPath
+        self.idxPath = idxPath or index_path(owlPath)
+        if is_stale(owlPath, self.idxPath):
+            build_index(owlPath, self.idxPath)
+
+        self.prefixes = {}
+        self.sectionNames = [None]
+        sectionIds = {'': 0}
+        rows = {}
+        with io.open(self.idxPath, 'r', encoding='utf-8') as f:
+            header = f.readline().rstrip('\n').split('\t')
+            for p in header[4].split():
+                prefix, iri = p.split('=', 1)
+                self.prefixes[prefix] = iri
+            for line in f:
+                iri, start, length, section = line.rstrip('\n').split('\t')
+                sid = sectionIds.get(section)
+                if sid is None:
+                    sid = sectionIds[section] = len(self.sectionNames)
+                    self.sectionNames.append(section)
+                rows.setdefault(iri, []).append((int(start), int(length), sid))
+
+        self.blocks = {}
+        self._starts = array('I')
+        self._lengths = array('I')
+        self._sections = array('H')
+        for iri, blocks in rows.items():
+            self.blocks[iri] = (len(self._starts) << 16) | len(blocks)
+            for start, length, sid in blocks:
+                self._starts.append(start)
+                self._lengths.append(length)
+                self._sections.append(sid)
+
+        with open(owlPath, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def blocks_of(self, iri):
+        ''' [(offset, length, section)] of the blocks of a full IRI, in file order '''
+        packed = self.blocks.get(iri)
+        if packed is None:
+            return []
+        first = packed >> 16
+        return [(self._starts[i], self._lengths[i], self.sectionNames[self._sections[i]])
+                for i in range(first, first + (packed & 0xFFFF))]
+
+    def close(self):
+        self._mm.close()
+
+    def iri(self, term):
+        ''' full IRI for any of the accepted spellings of a term '''
+        if term.startswith('<') and term.endswith('>'):
+            return term[1:-1]
+        if _tag.match(term):
+            return dicomNamespace + 'dicom_' + term
+        if term.startswith('dicom_'):
+            return dicomNamespace + term
+        return owl_reader.expand(term, self.prefixes)
+
+    def __contains__(self, term):
+        return self.iri(term) in self.blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def iris(self):
+        return self.blocks.keys()
+
+    def raw(self, term):
+        ''' the bytes of every block for term, in file order '''
+        return [self._mm[start:start + length] for start, length, section in self.blocks_of(self.iri(term))]
+
+    def lookup(self, term):
+        ''' the text of every block for term, in file order '''
+        return [b.decode('utf-8') for b in self.raw(term)]
+
+    def entities(self, term):
+        ''' the blocks for term parsed into owl_reader.Entity records
+        (line numbers are counted from the start of each block)
+        '''
+        found = []
+        for start, length, section in self.blocks_of(self.iri(term)):
+            block = io.BytesIO(self._mm[start:start + length])
+            for entity in owl_reader.iter_entities(block, dict(self.prefixes)):
+                found.append(entity._replace(section=section, start_byte=start + entity.start_byte,
+                                             end_byte=start + entity.end_byte))
+        return found
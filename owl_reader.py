@@ -0,0 +1,311 @@
+'''
+  Streaming reader for the Turtle files of this repository
+  (dicom_ontology.owl, dicom_ontology_nlx.owl and the .ttl written by
+  create_dicom_ttl).
+
+  The files are a sequence of statements separated by comment banners:
+
+    #################################################################
+    #
+    #    Datatype Properties
+    #
+    #################################################################
+
+    ###  http://purl.org/nidash/dicom#dicom_00280011
+
+    dicom:dicom_00280011 rdf:type owl:DatatypeProperty ;
+
+            rdfs:label "Columns"^^xsd:string ;
+            ...
+            rdfs:subClassOf dc:identifier .
+
+  iter_entities() reads such a file line by line and yields one Entity per
+  statement, holding only the lines of the current statement in memory.
+  A block starts at its "###  <IRI>" comment when there is one (the
+  Annotations section of the Protege files has statements without it) and
+  ends at the line with the statement's closing " .".  Every yielded Entity
+  records
+
+    iri         full IRI of the subject
+    subject     the subject as written (e.g. dicom:dicom_00280011)
+    predicates  OrderedDict predicate -> list of objects, all as written
+                in the file (literals keep their quotes and ^^datatype)
+    section     name of the banner the block is under (e.g. 'Classes')
+    start_line, end_line    first and last line number (1-based)
+    start_byte, end_byte    byte offsets of the block, end exclusive
+    lines       the block's lines as read from the file
+
+  A handful of literals in the checked-in files are not valid Turtle (stray
+  or missing quotes); a statement that cannot be tokenized is closed at its
+  " ." line and split line by line instead (parse_statement_lines).
+
+  The same subject can appear in several blocks (the Protege files have
+  one block per section an entity is declared in).  @prefix lines are
+  collected in the prefixes dict passed in, and the anonymous ontology
+  header ([ rdf:type owl:Ontology ] .) is skipped.
+
+'''
+
+import re
+import sys
+from collections import namedtuple, OrderedDict
+
+PY3 = sys.version_info[0] >= 3
+
+Entity = namedtuple('Entity', 'iri subject predicates section start_line end_line start_byte end_byte lines')
+
+_banner = re.compile(r'^#\s{4}(\S.*?)\s*$')
+_blockIri = re.compile(r'^###\s+(\S+)\s*$')
+_prefix = re.compile(r'^@prefix\s+([^\s:]*):\s*<([^>]*)>\s*\.\s*$')
+
+_ws = re.compile(r'\s+')
+_string = re.compile(r'"""(?:[^"\\]|\\.|"(?!""))*"""|"(?:[^"\\\n]|\\.)*"', re.S)
+_suffix = re.compile(r'\^\^(?:<[^>]*>|[^\s;,"]*[^\s;,".])|@[A-Za-z][A-Za-z0-9-]*')
+_iri = re.compile(r'<[^>\s]*>')
+_name = re.compile(r'[^\s;,"<>\[\]()]*[^\s;,"<>\[\]().]')
+
+_statementEnd = re.compile(r'\s*\.$')
+_clauseEnd = re.compile(r'\s;[ \t]*(?:\r?\n|$)')
+
+
+class Incomplete(Exception):
+    ''' the statement text ends inside a string, IRI or bracket '''
+
+
+def tokenize(text):
+    ''' Split Turtle statement text into terms and the punctuation ; , .
+    Raises Incomplete if the text stops in the middle of a term.
+    '''
+    tokens = []
+    pos = 0
+    end = len(text)
+    while pos < end:
+        c = text[pos]
+        if c.isspace():
+            pos = _ws.match(text, pos).end()
+        elif c in ';,':
+            tokens.append(c)
+            pos += 1
+        elif c == '.':
+            tokens.append('.')
+            pos += 1
+        elif c == '"':
+            m = _string.match(text, pos)
+            if not m:
+                raise Incomplete(text[pos:pos + 40])
+            stop = m.end()
+            s = _suffix.match(text, stop)
+            if s:
+                stop = s.end()
+            tokens.append(text[pos:stop])
+            pos = stop
+        elif c == '<':
+            m = _iri.match(text, pos)
+            if not m:
+                raise Incomplete(text[pos:pos + 40])
+            tokens.append(m.group(0))
+            pos = m.end()
+        elif c in '[(':
+            # anonymous node or collection: keep the raw text as one term
+            close = {'[': ']', '(': ')'}[c]
+            depth = 0
+            i = pos
+            while i < end:
+                if text[i] == c:
+                    depth += 1
+                elif text[i] == close:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif text[i] == '"':
+                    m = _string.match(text, i)
+                    if not m:
+                        raise Incomplete(text[i:i + 40])
+                    i = m.end() - 1
+                i += 1
+            if i >= end:
+                raise Incomplete(text[pos:pos + 40])
+            tokens.append(text[pos:i + 1])
+            pos = i + 1
+        else:
+            m = _name.match(text, pos)
+            if not m or m.end() == pos:
+                raise ValueError("unexpected character %r in: %s" % (c, text[pos:pos + 40]))
+            tokens.append(m.group(0))
+            pos = m.end()
+    return tokens
+
+
+def parse_statement(text):
+    ''' Returns (subject, OrderedDict predicate -> [objects]) for one statement
+    ending in '.', or None if text does not yet hold a complete statement
+    '''
+    try:
+        tokens = tokenize(text)
+    except (Incomplete, ValueError):
+        return None
+    if not tokens or tokens[-1] != '.':
+        return None
+
+    subject = tokens[0]
+    predicates = OrderedDict()
+    pred = None
+    expectPred = True
+    for tok in tokens[1:-1]:
+        if tok == ';':
+            expectPred = True
+        elif tok == ',':
+            continue
+        elif expectPred:
+            pred = tok
+            predicates.setdefault(pred, [])
+            expectPred = False
+        else:
+            predicates[pred].append(tok)
+    return subject, predicates
+
+
+def parse_statement_lines(text):
+    ''' Fallback for statements that are not valid Turtle, e.g. literals with a
+    stray or missing quote ("...triplets.""^^xsd:string).  Relies on the
+    layout of these files instead of the syntax: one "predicate object" per
+    line, each ending in " ;", and the statement ending in " .".
+    Returns (subject, OrderedDict predicate -> [objects]) like parse_statement.
+    '''
+    body = _statementEnd.sub('', text.strip())
+    clauses = [c.strip() for c in _clauseEnd.split(body) if c.strip()]
+    subject = None
+    predicates = OrderedDict()
+    for clause in clauses:
+        if subject is None:
+            parts = clause.split(None, 1)
+            subject = parts[0]
+            clause = parts[1] if len(parts) > 1 else ''
+        parts = clause.split(None, 1)
+        if not parts:
+            continue
+        predicates.setdefault(parts[0], [])
+        if len(parts) > 1:
+            predicates[parts[0]].append(' '.join(parts[1].split()))
+    return subject, predicates
+
+
+def _closes(text, stripped):
+    ''' Does a statement that is not valid Turtle end on this line? '''
+    return (stripped == '.' or stripped.endswith(' .')) and text.count('"""') % 2 == 0
+
+
+def expand(term, prefixes):
+    ''' full IRI for a prefixed name (or <IRI>), term unchanged otherwise '''
+    if term.startswith('<') and term.endswith('>'):
+        return term[1:-1]
+    if ':' in term and not term.startswith('"'):
+        prefix, local = term.split(':', 1)
+        if prefix in prefixes:
+            return prefixes[prefix] + local
+    return term
+
+
+def _text(line):
+    if isinstance(line, bytes):
+        return line.decode('utf-8')
+    return line
+
+
+def iter_entities(f, prefixes=None):
+    ''' Yield an Entity for every statement of the open Turtle file f
+    (text or binary mode).  prefixes, if given, is filled from the @prefix lines.
+    '''
+    if prefixes is None:
+        prefixes = {}
+    section = None
+    lineNo = 0
+    offset = 0
+
+    block = []          # lines of the current block
+    blockIri = None     # IRI from the "###" comment starting the block
+    blockStart = None   # (line number, byte offset) of the block's first line
+    stmt = []           # text lines of the statement being read
+
+    for line in f:
+        lineNo += 1
+        length = len(line) if isinstance(line, bytes) else len(line.encode('utf-8'))
+        text = _text(line)
+        stripped = text.strip()
+
+        if stmt and _blockIri.match(stripped):
+            # a new block starts before the statement was closed: give up on it
+            subject, predicates = parse_statement_lines(''.join(stmt))
+            iri = blockIri or expand(subject, prefixes)
+            yield Entity(iri, subject, predicates, section, blockStart[0], lineNo - 1,
+                         blockStart[1], offset, tuple(block))
+            block = []
+            blockIri = None
+            blockStart = None
+            stmt = []
+
+        if not stmt:
+            if stripped.startswith('#') or not stripped:
+                m = _banner.match(stripped)
+                if m and not blockIri:
+                    section = m.group(1)
+                m = _blockIri.match(stripped)
+                if m:
+                    block = [line]
+                    blockIri = m.group(1)
+                    blockStart = (lineNo, offset)
+                elif block:
+                    block.append(line)
+                offset += length
+                continue
+
+            if stripped.startswith('@'):
+                m = _prefix.match(stripped)
+                if m:
+                    prefixes[m.group(1)] = m.group(2)
+                offset += length
+                continue
+
+            # first line of a statement
+            if not block:
+                blockStart = (lineNo, offset)
+
+        block.append(line)
+        stmt.append(text)
+        offset += length
+
+        # only try to close the statement on lines that could end it
+        if not stripped.endswith('.'):
+            continue
+        stmtText = ''.join(stmt)
+        parsed = parse_statement(stmtText)
+        if parsed is None:
+            if not _closes(stmtText, stripped):
+                continue
+            parsed = parse_statement_lines(stmtText)
+        subject, predicates = parsed
+        if not subject.startswith('['):
+            iri = blockIri or expand(subject, prefixes)
+            yield Entity(iri, subject, predicates, section, blockStart[0], lineNo,
+                         blockStart[1], offset, tuple(block))
+        block = []
+        blockIri = None
+        blockStart = None
+        stmt = []
+
+    if stmt:
+        raise ValueError("statement starting at line %d is not terminated" % blockStart[0])
+
+
+def read_prefixes(f):
+    ''' Only the @prefix declarations of the open Turtle file f '''
+    prefixes = {}
+    for line in f:
+        text = _text(line).strip()
+        if text.startswith('@prefix'):
+            m = _prefix.match(text)
+            if m:
+                prefixes[m.group(1)] = m.group(2)
+        elif text and not text.startswith('#') and not text.startswith('@'):
+            break
+    return prefixes
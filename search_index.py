@@ -0,0 +1,413 @@
+'''
+  Full-text search over the DICOM dictionaries: attribute names and
+  keywords from dicom_dict_vr.dict and definitions from dicom_dict_def.dict,
+  ranked with BM25.
+
+  Every tag is one document with three fields, name, keyword and
+  definition (the name of dicom_dict_def.dict is used for the tags missing
+  from the VR dictionary).  Text is lowercased and split into words;
+  keywords are also split at their capitals (PixelSpacing -> pixelspacing,
+  pixel, spacing) so the words of a keyword match the words of a query.
+  A document scores the sum over the query words of
+
+      idf * sum over fields of  weight * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avglen))
+
+  The index is compiled into a binary sidecar next to the VR dictionary
+  (dicom_dict.idx) and rebuilt by open_index() whenever either dictionary
+  changes, as dict_cache does for the .dict files.
+
+  File layout (integers little endian):
+
+    header    magic 'DCSX', version (H), fields (H), documents (I),
+              terms (I), postings (I), term data size (I), doc id width (B),
+              3 pad bytes, mtime (d) and size (q) of the VR and of the
+              definition dictionary
+    tags      documents * 8 bytes, the ASCII tags in sorted order;
+              a document's id is its rank
+    lengths   fields * documents field lengths in words (H)
+    terms     the sorted terms, utf-8, separated by newlines
+    df        terms * number of documents holding the term (I)
+    starts    (terms * fields + 1) index of the first posting of each
+              term and field (I)
+    docs      postings * document ids (H, or I for more than 65535 documents)
+    tfs       postings * term frequencies (B, capped at 255)
+
+  The postings are fixed width so a term's list is read with a single
+  array() call; the terms, lengths and df are read once when the index is
+  opened and the score lists of the most recent terms are kept.
+
+  A query word matches that word; with prefix=True (the default) the last
+  word also matches every term it starts, as it does while typing, and a
+  word ending in * is always a prefix.  Query words of the form 00280011 or
+  (0028,0011) match that tag.
+
+  Example:
+    import search_index
+    search_index.search('pixel spac')   # -> [('00280030', 14.2...), ...]
+
+  Usage:
+    python search_index.py <query>
+    python search_index.py --build
+
+'''
+
+import os, sys
+import re
+import math
+import mmap
+import heapq
+import struct
+from array import array
+from bisect import bisect_left
+
+import dicom_dict
+import dict_cache
+
+#************************************************
+#input parameters
+indexFilename = 'dicom_dict.idx'    # written next to the VR dictionary
+fields = ('name', 'keyword', 'definition')
+fieldWeights = (3.0, 2.0, 1.0)
+k1 = 1.2
+b = 0.75
+maxExpansions = 50      # terms a prefix expands to, the most frequent ones
+cacheSize = 512         # terms whose score lists are kept
+stopWords = frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'if',
+                       'in', 'is', 'it', 'may', 'of', 'on', 'or', 's', 'shall', 'that', 'the',
+                       'this', 'to', 'which', 'with'])
+#************************************************
+
+MAGIC = b'DCSX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIIIB3xdqdq')
+TAG_WIDTH = 8
+
+PY3 = sys.version_info[0] >= 3
+BIG_ENDIAN = sys.byteorder == 'big'
+
+_word = re.compile(r'[^\W_]+', re.UNICODE)
+_camel = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+_tagQuery = re.compile(r'^\(?([0-9A-Fa-f]{4}),?([0-9A-Fa-f]{4})\)?$')
+
+# open indexes, keyed by absolute path of the index file
+_indexes = {}
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def tokenize(text):
+    ''' lowercased words of text, stop words left out '''
+    return [w for w in _word.findall(_text(text).lower()) if w not in stopWords]
+
+
+def keyword_tokens(keyword):
+    ''' the keyword as one word plus its parts, e.g. PixelSpacing -> pixelspacing, pixel, spacing '''
+    keyword = _text(keyword)
+    words = tokenize(keyword)
+    parts = [p.lower() for p in _camel.findall(keyword)]
+    if len(parts) > 1:
+        words += [p for p in parts if p not in stopWords]
+    return words
+
+
+def index_path(dictPath=None):
+    if dictPath is None:
+        dictPath = os.path.join(dicom_dict.dictDir, dicom_dict.vrFilename)
+    return os.path.join(os.path.dirname(os.path.abspath(dictPath)), indexFilename)
+
+
+def _def_path(vrPath):
+    # the definition dictionary is next to the VR dictionary
+    return os.path.join(os.path.dirname(os.path.abspath(vrPath)), dicom_dict.defFilename)
+
+
+def documents(vrDict, defDict):
+    ''' (tag, [name words, keyword words, definition words]) for every tag, in tag order '''
+    for tag in sorted(set(vrDict) | set(defDict)):
+        if 'x' in _text(tag).lower():
+            continue
+        vr = vrDict.get(tag)
+        defn = defDict.get(tag)
+        if vr is not None:
+            name = vr[dicom_dict.NAME]
+            keyword = vr[dicom_dict.KEYWORD]
+        else:
+            name = defn[0]
+            keyword = u''
+        definition = defn[1] if defn is not None and len(defn) > 1 else u''
+        yield _text(tag), [tokenize(name), keyword_tokens(keyword), tokenize(definition)]
+
+
+def build_index(vrPath=None, defPath=None, outPath=None):
+    ''' Compiles the index of the two dictionaries and returns its path '''
+    if vrPath is None:
+        vrPath = os.path.join(dicom_dict.dictDir, dicom_dict.vrFilename)
+    if defPath is None:
+        defPath = _def_path(vrPath)
+    if outPath is None:
+        outPath = index_path(vrPath)
+    vrSig = dict_cache._source_signature(vrPath)
+    defSig = dict_cache._source_signature(defPath)
+
+    tags = []
+    lengths = [array('H') for f in fields]
+    postings = {}       # term -> [[(doc, tf)] per field]
+    nfields = len(fields)
+    for doc, (tag, fieldWords) in enumerate(documents(dicom_dict.load_vr_dict(vrPath),
+                                                      dicom_dict.load_def_dict(defPath))):
+        tags.append(tag.encode('ascii'))
+        for f, words in enumerate(fieldWords):
+            lengths[f].append(min(len(words), 0xFFFF))
+            counts = {}
+            for w in words:
+                counts[w] = counts.get(w, 0) + 1
+            for w, tf in counts.items():
+                lists = postings.get(w)
+                if lists is None:
+                    lists = postings[w] = [[] for i in range(nfields)]
+                lists[f].append((doc, min(tf, 255)))
+
+    terms = sorted(postings)
+    docType = 'H' if len(tags) <= 0xFFFF else 'I'
+    df = array('I')
+    starts = array('I', [0])
+    docIds = array(docType)
+    tfs = array('B')
+    for term in terms:
+        seen = set()
+        for f in range(nfields):
+            for doc, tf in postings[term][f]:
+                docIds.append(doc)
+                tfs.append(tf)
+                seen.add(doc)
+            starts.append(len(docIds))
+        df.append(len(seen))
+    termData = u'\n'.join(terms).encode('utf-8')
+
+    arrays = [a for a in lengths] + [df, starts, docIds]
+    if BIG_ENDIAN:
+        for a in arrays:
+            a.byteswap()
+
+    tmpPath = outPath + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, nfields, len(tags), len(terms), len(docIds),
+                            len(termData), docIds.itemsize, vrSig[0], vrSig[1], defSig[0], defSig[1]))
+        f.write(b''.join(tags))
+        for a in lengths:
+            f.write(_tobytes(a))
+        f.write(termData)
+        for a in (df, starts, docIds, tfs):
+            f.write(_tobytes(a))
+    os.rename(tmpPath, outPath)
+    return outPath
+
+
+def _tobytes(a):
+    return a.tobytes() if PY3 else a.tostring()
+
+
+def _array(typecode, data):
+    a = array(typecode)
+    if PY3:
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    if BIG_ENDIAN and a.itemsize > 1:
+        a.byteswap()
+    return a
+
+
+def is_stale(indexPath, vrPath, defPath):
+    ''' True if the index is missing, unreadable or built from other versions of the dictionaries '''
+    try:
+        with open(indexPath, 'rb') as f:
+            header = f.read(HEADER.size)
+    except (IOError, OSError):
+        return True
+    if len(header) != HEADER.size:
+        return True
+    values = HEADER.unpack(header)
+    if values[0] != MAGIC or values[1] != VERSION or values[2] != len(fields):
+        return True
+    return (values[8:10] != dict_cache._source_signature(vrPath) or
+            values[10:12] != dict_cache._source_signature(defPath))
+
+
+def open_index(vrPath=None):
+    ''' SearchIndex over the dictionaries in the directory of vrPath (default: dicom_dict.dictDir),
+    (re)building the index file if needed; opened once per process
+    '''
+    if vrPath is None:
+        vrPath = os.path.join(dicom_dict.dictDir, dicom_dict.vrFilename)
+    indexPath = index_path(vrPath)
+    defPath = _def_path(vrPath)
+    index = _indexes.get(indexPath)
+    stale = is_stale(indexPath, vrPath, defPath)
+    if index is not None:
+        if not stale:
+            return index
+        index.close()
+    if stale:
+        build_index(vrPath, defPath, indexPath)
+    index = _indexes[indexPath] = SearchIndex(indexPath)
+    return index
+
+
+class SearchIndex(object):
+    ''' BM25 queries over a compiled index file '''
+
+    def __init__(self, indexPath):
+        self.path = indexPath
+        with open(indexPath, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, nfields, ndocs, nterms, npostings, termSize, docWidth,
+         vrMtime, vrSize, defMtime, defSize) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a search index" % indexPath)
+        if nfields != len(fields):
+            raise ValueError("%s has %d fields, expected %d" % (indexPath, nfields, len(fields)))
+        self.ndocs = ndocs
+        self.nterms = nterms
+        self._docType = 'H' if docWidth == 2 else 'I'
+
+        at = HEADER.size
+        tagData = self._mm[at:at + ndocs * TAG_WIDTH]
+        self.tags = [tagData[i:i + TAG_WIDTH].decode('ascii') for i in range(0, len(tagData), TAG_WIDTH)]
+        self._docOf = dict((tag, i) for i, tag in enumerate(self.tags))
+        at += ndocs * TAG_WIDTH
+
+        # 1 - b + b * len / avglen per field and document, so a score is one division per posting
+        self._norms = []
+        for f in range(nfields):
+            lengths = _array('H', self._mm[at:at + ndocs * 2])
+            at += ndocs * 2
+            avg = float(sum(lengths)) / ndocs if ndocs and sum(lengths) else 1.0
+            self._norms.append([k1 * (1 - b + b * n / avg) for n in lengths])
+
+        self.terms = self._mm[at:at + termSize].decode('utf-8').split(u'\n') if nterms else []
+        at += termSize
+        self._df = _array('I', self._mm[at:at + nterms * 4])
+        at += nterms * 4
+        self._starts = _array('I', self._mm[at:at + (nterms * nfields + 1) * 4])
+        at += (nterms * nfields + 1) * 4
+        self._docsAt = at
+        self._tfsAt = at + npostings * docWidth
+        self._docWidth = docWidth
+        self._scores = {}
+
+    def close(self):
+        self._mm.close()
+
+    def term_id(self, term):
+        ''' position of term in the sorted terms, or -1 '''
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def prefix_ids(self, prefix):
+        ''' ids of the terms starting with prefix, the maxExpansions most frequent ones '''
+        lo = bisect_left(self.terms, prefix)
+        hi = bisect_left(self.terms, prefix + u'\uffff', lo)
+        ids = range(lo, hi)
+        if hi - lo > maxExpansions:
+            ids = heapq.nlargest(maxExpansions, ids, key=self._df.__getitem__)
+        return ids
+
+    def postings(self, termId, field):
+        ''' (document ids, term frequencies) of a term in one field, as arrays '''
+        n = len(fields)
+        start = self._starts[termId * n + field]
+        end = self._starts[termId * n + field + 1]
+        docs = _array(self._docType, self._mm[self._docsAt + start * self._docWidth:
+                                              self._docsAt + end * self._docWidth])
+        tfs = _array('B', self._mm[self._tfsAt + start:self._tfsAt + end])
+        return docs, tfs
+
+    def idf(self, termId):
+        df = self._df[termId]
+        return max(0.0, math.log((self.ndocs - df + 0.5) / (df + 0.5) + 1.0))
+
+    def term_scores(self, termId):
+        ''' document id -> BM25 score of one term '''
+        scores = self._scores.get(termId)
+        if scores is not None:
+            return scores
+        scores = {}
+        idf = self.idf(termId)
+        for f, weight in enumerate(fieldWeights):
+            w = weight * idf * (k1 + 1)
+            norms = self._norms[f]
+            docs, tfs = self.postings(termId, f)
+            for doc, tf in zip(docs, tfs):
+                scores[doc] = scores.get(doc, 0.0) + w * tf / (tf + norms[doc])
+        if len(self._scores) >= cacheSize:
+            self._scores.clear()
+        self._scores[termId] = scores
+        return scores
+
+    def search(self, query, limit=10, prefix=True):
+        ''' [(tag, score)] of the best matches for query, best first '''
+        words = _text(query).split()
+        totals = {}
+        exact = []
+        for n, word in enumerate(words):
+            m = _tagQuery.match(word)
+            if m:
+                doc = self._docOf.get((m.group(1) + m.group(2)).upper())
+                if doc is not None:
+                    exact.append(doc)
+                continue
+            isPrefix = word.endswith(u'*') or (prefix and n == len(words) - 1)
+            for token in tokenize(word):
+                if isPrefix:
+                    # a document matching several expansions counts its best one
+                    best = {}
+                    for termId in self.prefix_ids(token):
+                        for doc, s in self.term_scores(termId).items():
+                            if s > best.get(doc, 0.0):
+                                best[doc] = s
+                else:
+                    termId = self.term_id(token)
+                    best = self.term_scores(termId) if termId >= 0 else {}
+                for doc, s in best.items():
+                    totals[doc] = totals.get(doc, 0.0) + s
+
+        top = heapq.nlargest(limit, totals.items(), key=lambda t: (t[1], -t[0]))
+        results = [(self.tags[doc], score) for doc, score in top]
+        if exact:
+            # tags asked for by number come first
+            exactTags = [self.tags[doc] for doc in exact]
+            results = [(t, float('inf')) for t in exactTags] + [r for r in results if r[0] not in exactTags]
+            results = results[:limit]
+        return results
+
+
+def search(query, limit=10, prefix=True):
+    ''' [(tag, score)] for query over the dictionaries in dicom_dict.dictDir '''
+    return open_index().search(query, limit, prefix)
+
+
+def main(args):
+    if not args:
+        print (__doc__)
+        return 1
+    if args == ['--build']:
+        path = build_index()
+        print ("Wrote %s" % path)
+        return 0
+    vrDict = dicom_dict.load_vr_dict()
+    for tag, score in search(u' '.join(_text(a) for a in args), limit=20):
+        entry = vrDict.get(tag)
+        print ("%s  %6.2f  %s" % (tag, score, entry[dicom_dict.NAME] if entry else ''))
+    return 0
+
+
+##############################################################
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
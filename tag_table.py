@@ -0,0 +1,221 @@
+'''
+  Compact in-memory form of the VR dictionary (dicom_dict_vr.dict).
+
+  A dict of 8-character tag strings to 5-tuples of strings costs a dict
+  entry, a tuple and several string objects per tag.  TagTable keeps the
+  same data in a few flat arrays instead:
+
+    tags       array('I') of the 32-bit tags, sorted
+    vrs, vms   array('B') of codes into the short lists of distinct VR and
+               VM strings (a few dozen each)
+    retired    array('B'), 1 for "Retired"
+    names, keywords
+               StringPool: one utf-8 blob plus array('I') offsets, with
+               each distinct string stored once
+
+  Lookups are a bisect on the tag array.  Values are built on access and
+  have the same (VR, VM, Name, Retired, Keyword) layout as the .dict file,
+  so a TagTable can stand in for dicom_dict.load_vr_dict() wherever a
+  read-only mapping is enough.  Tags can be given as the 8-character
+  string or as an int; tags that are not in the table are matched against
+  the repeating group masks (dicom_dict.MaskTable) if the table has them.
+
+  The table pickles to its arrays, so it is cheap to hand to worker
+  processes.
+
+  Example:
+    import tag_table
+    t = tag_table.load()
+    t['00280011']        # -> ('US', '1', 'Columns', '', 'Columns')
+    t.vr(0x00280011)     # -> 'US'
+
+'''
+
+import sys
+from array import array
+from bisect import bisect_left
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import dicom_dict
+
+PY3 = sys.version_info[0] >= 3
+
+RETIRED = 'Retired'
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def _str(s):
+    # the str type of this Python, as the .dict values are
+    if PY3:
+        return s
+    return s.encode('utf-8')
+
+
+def tag_int(tag):
+    ''' 32-bit int for an 8-character tag string (ints are returned unchanged) '''
+    if isinstance(tag, int):
+        return tag
+    return int(tag, 16)
+
+
+class StringPool(object):
+    ''' Distinct strings stored once in a single utf-8 blob '''
+
+    def __init__(self):
+        self.offsets = array('I', [0])
+        self._parts = []
+        self._ids = {}      # only while adding; dropped by freeze()
+        self.blob = b''
+
+    def add(self, s):
+        ''' id of s, adding it if it is new '''
+        s = _text(s)
+        sid = self._ids.get(s)
+        if sid is None:
+            sid = len(self._ids)
+            self._ids[s] = sid
+            b = s.encode('utf-8')
+            self._parts.append(b)
+            self.offsets.append(self.offsets[-1] + len(b))
+        return sid
+
+    def freeze(self):
+        self.blob = b''.join(self._parts)
+        self._parts = []
+        self._ids = None
+
+    def __getitem__(self, sid):
+        return _str(self.blob[self.offsets[sid]:self.offsets[sid + 1]].decode('utf-8'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getstate__(self):
+        return self.blob, self.offsets
+
+    def __setstate__(self, state):
+        self.blob, self.offsets = state
+        self._parts = []
+        self._ids = None
+
+
+class TagTable(Mapping):
+    ''' Read-only tag -> (VR, VM, Name, Retired, Keyword) mapping over flat arrays '''
+
+    def __init__(self, entries, masks=None):
+        ''' entries: (tag, values) pairs or a mapping, e.g. dicom_dict.load_vr_dict();
+        tags with 'x' (masks) are left out.  masks: an optional dicom_dict.MaskTable
+        '''
+        if isinstance(entries, Mapping):
+            entries = entries.items()
+        rows = sorted((int(tag, 16), values) for tag, values in entries if 'x' not in _text(tag).lower())
+
+        self.tags = array('I')
+        self.vrs = array('B')
+        self.vms = array('B')
+        self.retired = array('B')
+        self.nameIds = array('I')
+        self.keywordIds = array('I')
+        self.vrNames = []
+        self.vmNames = []
+        self.names = StringPool()
+        self.keywords = StringPool()
+        vrCodes = {}
+        vmCodes = {}
+
+        for tag, values in rows:
+            if self.tags and self.tags[-1] == tag:
+                continue        # repeated tag; the mapping passed in decides which one is kept
+            vr, vm, name, retired, keyword = [_text(v) for v in values]
+            if retired not in (u'', RETIRED):
+                raise ValueError("unexpected Retired value %r for %08X" % (retired, tag))
+            self.tags.append(tag)
+            self.vrs.append(self._code(vrCodes, self.vrNames, vr))
+            self.vms.append(self._code(vmCodes, self.vmNames, vm))
+            self.retired.append(retired == RETIRED)
+            self.nameIds.append(self.names.add(name))
+            self.keywordIds.append(self.keywords.add(keyword))
+
+        self.names.freeze()
+        self.keywords.freeze()
+        self.vrNames = [_str(v) for v in self.vrNames]
+        self.vmNames = [_str(v) for v in self.vmNames]
+        self.masks = masks
+
+    @staticmethod
+    def _code(codes, names, value):
+        code = codes.get(value)
+        if code is None:
+            code = len(names)
+            if code > 255:
+                raise ValueError("more than 256 distinct values, cannot store %r in a byte" % value)
+            codes[value] = code
+            names.append(value)
+        return code
+
+    def index(self, tag):
+        ''' position of tag in the table, or -1 '''
+        try:
+            tag = tag_int(tag)
+        except (TypeError, ValueError):
+            return -1
+        i = bisect_left(self.tags, tag)
+        if i < len(self.tags) and self.tags[i] == tag:
+            return i
+        return -1
+
+    def values(self, i):
+        ''' (VR, VM, Name, Retired, Keyword) of the entry at position i '''
+        return (self.vrNames[self.vrs[i]], self.vmNames[self.vms[i]], self.names[self.nameIds[i]],
+                _str(RETIRED) if self.retired[i] else _str(u''), self.keywords[self.keywordIds[i]])
+
+    def __getitem__(self, tag):
+        i = self.index(tag)
+        if i >= 0:
+            return self.values(i)
+        if self.masks is not None:
+            entry = self.masks.get(tag)
+            if entry is not None:
+                return entry
+        raise KeyError(tag)
+
+    def __contains__(self, tag):
+        # like __getitem__, a tag of a repeating group is found through the masks
+        if self.index(tag) >= 0:
+            return True
+        return self.masks is not None and self.masks.get(tag) is not None
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __iter__(self):
+        for tag in self.tags:
+            yield '%08X' % tag
+
+    def vr(self, tag):
+        ''' VR string for tag, or None '''
+        i = self.index(tag)
+        if i >= 0:
+            return self.vrNames[self.vrs[i]]
+        entry = self.masks.get(tag) if self.masks is not None else None
+        if entry is not None:
+            return entry[dicom_dict.VR]
+        return None
+
+
+def load(dictPath=None, maskPath=None):
+    ''' TagTable for the VR dictionary at dictPath (default: the one in dicom_dict.dictDir)
+    with the masks of the mask dictionary next to it
+    '''
+    if maskPath is None and dictPath is not None:
+        maskPath = dicom_dict._mask_path(dictPath)
+    return TagTable(dicom_dict.load_vr_dict(dictPath), dicom_dict.load_mask_table(maskPath))
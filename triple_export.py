@@ -0,0 +1,312 @@
+'''
+  N-Triples and binary triple export of the ontology, for loaders that
+  should not have to parse the pretty-printed Turtle.
+
+  TripleSet collects the statements of an ontology as triples of
+  N-Triples terms (<IRI> or a literal with its datatype IRI).  It is filled
+  either
+
+    - by ttl_writer.TurtleWriter while the generator writes the .ttl
+      (TurtleWriter(..., triples=TripleSet(prefixes))), so both files come
+      from the same statements, or
+    - from an existing .owl/.ttl file read with owl_reader (read_owl)
+
+  and written as
+
+    .nt     N-Triples, one triple per line, sorted and without repeats
+    .trp    sorted dictionary-encoded triples (all integers little endian):
+
+              header    magic 'DCTR', version (H), reserved (H),
+                        number of terms (I), number of triples (I)
+              offsets   (terms + 1) byte offsets (I) into the term data
+              terms     utf-8 N-Triples terms, sorted; a term's id is its rank
+              triples   triples * 3 term ids (I), sorted by subject,
+                        predicate, object
+
+  TripleFile reads a .trp through mmap: term ids are found by bisecting the
+  sorted term table and the triples of a subject by bisecting the triples.
+
+  Statements that cannot be turned into triples (a few literals in the
+  checked-in files are not valid Turtle and come out of owl_reader as
+  bare text) are skipped and counted in TripleSet.skipped.
+
+  Usage:
+    python triple_export.py <file.owl> [<file.owl> ...]
+  writes <file>.nt and <file>.trp next to each file.
+
+'''
+
+import os, sys
+import io
+import re
+import mmap
+import struct
+
+import owl_reader
+
+#************************************************
+#input parameters
+ntSuffix = '.nt'
+binSuffix = '.trp'
+#************************************************
+
+MAGIC = b'DCTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+
+RDF_TYPE = u'<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+
+_longLiteral = re.compile(r'^"""(.*)"""((?:\^\^|@)\S+)?$', re.S)
+_shortLiteral = re.compile(r'^"(.*)"((?:\^\^|@)\S+)?$', re.S)
+_unescape = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)', re.S)
+_ntEscapes = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'}
+_ntEscapeChars = re.compile(r'[\\"\n\r]')
+_simpleEscapes = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+if sys.version_info[0] >= 3:
+    unichr = chr
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def _unescape_char(m):
+    e = m.group(1)
+    if e[0] in 'uU' and len(e) > 1:
+        code = int(e[1:], 16)
+        try:
+            return unichr(code)
+        except ValueError:
+            # narrow Python 2 build: code points above the BMP as a surrogate pair
+            code -= 0x10000
+            return unichr(0xD800 + (code >> 10)) + unichr(0xDC00 + (code & 0x3FF))
+    return _simpleEscapes.get(e, '\\' + e)
+
+
+def nt_iri(term, prefixes):
+    ''' <IRI> for a prefixed name or <IRI>, None if it cannot be expanded
+    (blank node labels, _:x, are returned as they are)
+    '''
+    term = _text(term)
+    if term == u'a':
+        return RDF_TYPE
+    if term.startswith(u'_:'):
+        return term
+    if term.startswith(u'<') and term.endswith(u'>'):
+        return term
+    full = owl_reader.expand(term, prefixes)
+    if full == term:
+        return None
+    return u'<' + full + u'>'
+
+
+def nt_literal(term, prefixes):
+    ''' N-Triples form of a Turtle literal as written in the file, None if it is not one '''
+    term = _text(term)
+    m = _longLiteral.match(term) or _shortLiteral.match(term)
+    if not m:
+        return None
+    value = _unescape.sub(_unescape_char, m.group(1))
+    value = _ntEscapeChars.sub(lambda c: _ntEscapes[c.group(0)], value)
+    suffix = m.group(2)
+    if not suffix:
+        return u'"' + value + u'"'
+    if suffix.startswith(u'@'):
+        return u'"' + value + u'"' + suffix
+    datatype = nt_iri(suffix[2:], prefixes)
+    if datatype is None:
+        return None
+    return u'"' + value + u'"^^' + datatype
+
+
+def nt_term(term, prefixes):
+    if _text(term).startswith(u'"'):
+        return nt_literal(term, prefixes)
+    return nt_iri(term, prefixes)
+
+
+class TripleSet(object):
+    ''' Triples of N-Triples terms, collected from Turtle subjects, predicates and objects '''
+
+    def __init__(self, prefixes):
+        self.prefixes = dict((_text(p), _text(i)) for p, i in dict(prefixes).items())
+        self.triples = set()
+        self.skipped = 0
+        self._terms = {}        # Turtle term -> N-Triples term, for the names that repeat
+
+    def _term(self, term):
+        nt = self._terms.get(term)
+        if nt is None:
+            nt = nt_term(term, self.prefixes)
+            if nt is not None and not nt.startswith(u'"'):
+                self._terms[term] = nt
+        return nt
+
+    def add(self, subject, predicate, obj):
+        s = self._term(subject)
+        p = self._term(predicate)
+        o = self._term(obj)
+        if s is None or p is None or o is None or s.startswith(u'"') or p.startswith(u'"'):
+            self.skipped += 1
+            return False
+        self.triples.add((s, p, o))
+        return True
+
+    def add_statement(self, subject, predicates):
+        ''' predicates: (predicate, [objects]) pairs or an OrderedDict as owl_reader gives '''
+        if hasattr(predicates, 'items'):
+            predicates = predicates.items()
+        for pred, objects in predicates:
+            for o in objects:
+                self.add(subject, pred, o)
+
+    def __len__(self):
+        return len(self.triples)
+
+    def sorted(self):
+        return sorted(self.triples)
+
+    def write_nt(self, f):
+        ''' N-Triples to the open text file f '''
+        lines = []
+        for s, p, o in self.sorted():
+            lines.append(u'%s %s %s .\n' % (s, p, o))
+            if len(lines) >= 4096:
+                f.write(u''.join(lines))
+                lines = []
+        f.write(u''.join(lines))
+
+    def write_binary(self, path):
+        ''' the dictionary-encoded .trp file at path '''
+        terms = set()
+        for t in self.triples:
+            terms.update(t)
+        terms = sorted(terms, key=lambda t: t.encode('utf-8'))
+        ids = dict((t, i) for i, t in enumerate(terms))
+        encoded = [t.encode('utf-8') for t in terms]
+        offsets = [0]
+        for b in encoded:
+            offsets.append(offsets[-1] + len(b))
+        triples = sorted((ids[s], ids[p], ids[o]) for s, p, o in self.triples)
+
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(terms), len(triples)))
+            f.write(struct.pack('<%dI' % len(offsets), *offsets))
+            f.write(b''.join(encoded))
+            f.write(struct.pack('<%dI' % (3 * len(triples)), *[i for t in triples for i in t]))
+        os.rename(tmpPath, path)
+        return path
+
+
+def read_owl(owlPath, triples=None):
+    ''' TripleSet with every statement of the Turtle file at owlPath '''
+    prefixes = {}
+    with open(owlPath, 'rb') as f:
+        prefixes.update(owl_reader.read_prefixes(f))
+    if triples is None:
+        triples = TripleSet(prefixes)
+    with open(owlPath, 'rb') as f:
+        for entity in owl_reader.iter_entities(f, triples.prefixes):
+            triples.add_statement(entity.subject, entity.predicates)
+    return triples
+
+
+def export(triples, basePath):
+    ''' writes basePath.nt and basePath.trp; returns their paths '''
+    ntPath = basePath + ntSuffix
+    with io.open(ntPath, 'w', encoding='utf-8') as f:
+        triples.write_nt(f)
+    binPath = triples.write_binary(basePath + binSuffix)
+    return ntPath, binPath
+
+
+class TripleFile(object):
+    ''' Read-only view of a .trp file '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved, nterms, ntriples = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a triple file" % path)
+        self.nterms = nterms
+        self.ntriples = ntriples
+        self._offsetsAt = HEADER.size
+        self._termsAt = self._offsetsAt + (nterms + 1) * 4
+        end = struct.unpack_from('<I', self._mm, self._offsetsAt + nterms * 4)[0]
+        self._triplesAt = self._termsAt + end
+        self._triple = struct.Struct('<3I')
+
+    def close(self):
+        self._mm.close()
+
+    def _term_bytes(self, i):
+        start, end = struct.unpack_from('<2I', self._mm, self._offsetsAt + i * 4)
+        return self._mm[self._termsAt + start:self._termsAt + end]
+
+    def term(self, i):
+        return self._term_bytes(i).decode('utf-8')
+
+    def term_id(self, term):
+        ''' id of an N-Triples term, or -1 '''
+        b = _text(term).encode('utf-8')
+        lo, hi = 0, self.nterms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < b:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.nterms and self._term_bytes(lo) == b:
+            return lo
+        return -1
+
+    def triple_ids(self, i):
+        return self._triple.unpack_from(self._mm, self._triplesAt + i * 12)
+
+    def __len__(self):
+        return self.ntriples
+
+    def __iter__(self):
+        for i in range(self.ntriples):
+            s, p, o = self.triple_ids(i)
+            yield self.term(s), self.term(p), self.term(o)
+
+    def about(self, subject):
+        ''' (predicate, object) pairs of subject (an N-Triples term) '''
+        sid = self.term_id(subject)
+        if sid < 0:
+            return []
+        lo, hi = 0, self.ntriples
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.triple_ids(mid)[0] < sid:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.ntriples:
+            s, p, o = self.triple_ids(lo)
+            if s != sid:
+                break
+            found.append((self.term(p), self.term(o)))
+            lo += 1
+        return found
+
+
+def main(paths):
+    for owlPath in paths:
+        triples = read_owl(owlPath)
+        ntPath, binPath = export(triples, os.path.splitext(owlPath)[0])
+        print ("%s: %d triples (%d statements skipped) -> %s, %s" % (owlPath, len(triples),
+               triples.skipped, ntPath, binPath))
+
+
+##############################################################
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,285 @@
+'''
+  Turtle serializer for the ontology files of this repository.
+
+  TurtleWriter writes @prefix lines, section banners and entity blocks in
+  either of the two layouts used here:
+
+    owl       the layout of dicom_ontology.owl and of the files written by
+              create_dicom_ttl:
+
+                ###  http://purl.org/nidash/dicom#dicom_00280011
+
+                dicom:dicom_00280011 rdf:type owl:DatatypeProperty ;
+
+                        rdfs:label "Columns"^^xsd:string ;
+
+                        rdfs:subClassOf dc:identifier .
+
+    protege   the layout Protege writes (dicom_ontology_nlx.owl): clauses
+              indented to line up after the subject, separated by
+              whitespace-only lines, object lists split over lines
+
+  Everything written is checked as it is added, so the output parses:
+  prefixed names must use a declared prefix and a valid local name,
+  literals are built with literal(), which escapes quotes, backslashes
+  and line breaks, and every statement is closed with " .".
+  Invalid terms raise ValueError instead of ending up in the file.
+
+  The clauses of each block are collected in a list that is reused for the
+  next block and joined once; finished blocks are kept and written to the
+  file in chunks of about bufferSize characters instead of one write() per
+  line.
+
+  A triple_export.TripleSet passed as triples receives every statement
+  written, so an N-Triples or binary export can be made from the same
+  statements as the Turtle file.
+
+  Example:
+    w = ttl_writer.TurtleWriter(f, ttl_writer.ontologyPrefixes)
+    w.write_prefixes()
+    w.write_ontology_header()
+    w.write_section('Datatype Properties')
+    w.write_entity('dicom:dicom_00280011', [('rdf:type', ['owl:DatatypeProperty']),
+                   ('rdfs:label', [ttl_writer.literal('Columns')])])
+    w.close()
+
+'''
+
+import re
+import sys
+
+#************************************************
+#input parameters
+bufferSize = 1 << 18        # characters collected before each write
+# the prefixes declared in dicom_ontology.owl
+ontologyPrefixes = [
+    ('', 'http://www.semanticweb.org/owl/owlapi/turtle#'),
+    ('owl', 'http://www.w3.org/2002/07/owl#'),
+    ('rdf', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'),
+    ('xml', 'http://www.w3.org/XML/1998/namespace'),
+    ('xsd', 'http://www.w3.org/2001/XMLSchema#'),
+    ('rdfs', 'http://www.w3.org/2000/01/rdf-schema#'),
+    ('nidm', 'http://purl.org/nidash/nidm#'),
+    ('dicom', 'http://purl.org/nidash/dicom#'),
+    ('dc', 'http://purl.org/dc/elements/1.1/'),
+    ('obo', 'http://purl.obolibrary.org/obo/'),
+    ('prov', 'http://www.w3.org/ns/prov#'),
+]
+# and the ones only dicom_ontology_nlx.owl uses
+nlxPrefixes = ontologyPrefixes + [
+    ('dct', 'http://purl.org/dc/terms/'),
+    ('nlx', 'http://uri.neuinfo.org/nif/nifstd/'),
+]
+#************************************************
+
+LAYOUTS = ('owl', 'protege')
+
+if sys.version_info[0] >= 3:
+    unicode = str
+
+_prefixedName = re.compile(r'^([A-Za-z][\w\-.]*[\w\-]|[A-Za-z]?):((?:[\w\-]|\\[\-.])(?:[\w\-.]*[\w\-])?)?$', re.UNICODE)
+_iri = re.compile(r'^<[^<>"{}|^`\\\s]*>$')
+_literal = re.compile(r'^"(?:[^"\\\n\r]|\\.)*"(?:\^\^\S+|@[A-Za-z]+(?:-[A-Za-z0-9]+)*)?$')
+
+_escapes = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+_escapeChars = re.compile(r'[\\"\n\r\t]')
+
+_banner = '#' * 65
+
+
+def _text(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return s
+
+
+def escape(s):
+    ''' s with the characters that cannot appear in a "..." literal escaped '''
+    s = _text(s)
+    if _escapeChars.search(s) is None:
+        return s
+    return _escapeChars.sub(lambda m: _escapes[m.group(0)], s)
+
+
+class Literal(unicode):
+    ''' text of a literal made by literal(), which needs no further checks '''
+    __slots__ = ()
+
+
+def literal(value, datatype='xsd:string', lang=None):
+    ''' a Turtle literal for value, e.g. "Columns"^^xsd:string
+    (datatype=None for a plain literal, lang for a language tag)
+    '''
+    s = u'"' + escape(value) + u'"'
+    if lang:
+        s = s + u'@' + lang
+    elif datatype:
+        s = s + u'^^' + datatype
+    return Literal(s)
+
+
+def iri(value):
+    ''' <value> for a full IRI '''
+    value = _text(value)
+    term = u'<' + value + u'>'
+    if not _iri.match(term):
+        raise ValueError("not a valid IRI: %r" % value)
+    return term
+
+
+class TurtleWriter(object):
+    ''' Writes Turtle to the open text file f '''
+
+    def __init__(self, f, prefixes, layout='owl', base=None, triples=None):
+        if layout not in LAYOUTS:
+            raise ValueError("unknown layout %r, expected one of %s" % (layout, ", ".join(LAYOUTS)))
+        self.f = f
+        self.prefixes = [(_text(p), _text(i)) for p, i in prefixes]
+        self.declared = dict(self.prefixes)
+        self.layout = layout
+        self.base = base
+        self.triples = triples  # triple_export.TripleSet, or None
+        self.blocks = 0
+        self._chunks = []       # finished text waiting to be written
+        self._size = 0
+        self._block = []        # the block being built; reused for every block
+        self._valid = {}        # terms already checked -> their text
+
+    # terms ----------------------------------------------------------------
+
+    def term(self, value):
+        ''' value checked as a subject, predicate or object; returns it as text '''
+        if isinstance(value, Literal):
+            i = value.rfind(u'"^^')
+            if i > 0 and value[i + 3:] not in self._valid:
+                self.term(value[i + 3:])
+            return value
+        # names and predicates repeat in every block; check each one once
+        text = self._valid.get(value)
+        if text is None:
+            text = self._check(_text(value))
+            if not text.startswith(u'"'):
+                self._valid[value] = text
+        return text
+
+    def _check(self, value):
+        if value == u'a':
+            return value
+        if value.startswith(u'"'):
+            if not _literal.match(value):
+                raise ValueError("not a valid literal: %r (use ttl_writer.literal)" % value)
+            datatype = value.rsplit(u'^^', 1)[1] if u'"^^' in value else None
+            if datatype and not datatype.startswith(u'<'):
+                self.term(datatype)
+            return value
+        if value.startswith(u'<'):
+            if not _iri.match(value):
+                raise ValueError("not a valid IRI: %r" % value)
+            return value
+        if value.startswith(u'[') and value.endswith(u']'):
+            return value
+        m = _prefixedName.match(value)
+        if not m:
+            raise ValueError("not a valid prefixed name: %r" % value)
+        if m.group(1) not in self.declared:
+            raise ValueError("prefix %r of %r is not declared" % (m.group(1), value))
+        return value
+
+    def expand(self, value):
+        ''' full IRI of a prefixed name or <IRI> '''
+        value = _text(value)
+        if value.startswith(u'<'):
+            return value[1:-1]
+        prefix, local = value.split(u':', 1)
+        return self.declared[prefix] + local
+
+    # output ---------------------------------------------------------------
+
+    def _emit(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= bufferSize:
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            self.f.write(u''.join(self._chunks))
+            self._chunks = []
+            self._size = 0
+
+    def close(self):
+        ''' writes what is left; the file itself is left open '''
+        self.flush()
+
+    def write_prefixes(self):
+        lines = []
+        for prefix, ns in self.prefixes:
+            if _prefixedName.match(prefix + u':') is None:
+                raise ValueError("not a valid prefix: %r" % prefix)
+            lines.append(u'@prefix %s: %s .\n' % (prefix, iri(ns)))
+        if self.base:
+            lines.append(u'@base %s .\n' % iri(self.base))
+        self._emit(u''.join(lines))
+
+    def write_ontology_header(self, ontologyIri=None):
+        ''' the owl:Ontology statement; anonymous ([ rdf:type owl:Ontology ]) without an IRI '''
+        if ontologyIri:
+            self._emit(u'\n%s rdf:type owl:Ontology .\n' % iri(ontologyIri))
+            if self.triples is not None:
+                self.triples.add(iri(ontologyIri), u'rdf:type', u'owl:Ontology')
+        else:
+            self._emit(u'\n[ rdf:type owl:Ontology ] .\n')
+            if self.triples is not None:
+                self.triples.add(u'_:ontology', u'rdf:type', u'owl:Ontology')
+
+    def write_section(self, name):
+        ''' the comment banner that starts a section, e.g. "Datatype Properties" '''
+        self._emit(u'\n%s\n#\n#    %s\n#\n%s\n\n' % (_banner, _text(name), _banner))
+
+    def write_comment(self, text):
+        self._emit(u''.join(u'# %s\n' % line for line in _text(text).split(u'\n')))
+
+    def write_entity(self, subject, predicates, header=True):
+        ''' One statement about subject.  predicates is a list of (predicate, [objects]);
+        predicates with no objects are left out.  header=False leaves out the
+        "###  <IRI>" comment (Protege does so in its Annotations section).
+        '''
+        term = self.term
+        subject = self._valid.get(subject) or term(subject)
+        if subject.startswith(u'"') or subject == u'a':
+            raise ValueError("%s cannot be the subject of a statement" % subject)
+
+        if self.layout == 'owl':
+            indent = u' ' * 8
+            clauseSeparator = u' ;\n\n' + indent
+        else:
+            indent = u' ' * (len(subject) + 1)
+            clauseSeparator = u' ;\n' + indent + u'\n' + indent
+
+        valid = self._valid
+        b = self._block
+        del b[:]
+        for pred, objects in predicates:
+            if not objects:
+                continue
+            pred = valid.get(pred) or term(pred)
+            texts = [term(o) if o.__class__ is Literal else valid.get(o) or term(o) for o in objects]
+            if self.triples is not None:
+                for o in texts:
+                    self.triples.add(subject, pred, o)
+            if len(texts) == 1:
+                b.append(pred + u' ' + texts[0])
+            elif self.layout == 'owl':
+                b.append(pred + u' ' + u', '.join(texts))
+            else:
+                # one object per line, lined up after the predicate
+                b.append(pred + u' ' + (u' ,\n' + indent + u' ' * (len(pred) + 1)).join(texts))
+        if not b:
+            raise ValueError("no predicates to write for %s" % subject)
+
+        text = subject + u' ' + clauseSeparator.join(b) + u' .\n\n\n\n'
+        if header:
+            text = u'###  ' + self.expand(subject) + u'\n\n' + text
+
+        self.blocks += 1
+        self._emit(text)
@@ -40,12 +40,17 @@
 
 import urllib2
 import xml.etree.ElementTree as ET
-import os
+import os, sys
+
+import metrics
 
 # pydict_filename = '../dicom/_dicom_dict.py'   #this is the filename format expected for pydicom codebase
 pydict_filename = 'dicom_dict_vr.dict'  # KGH 
+maskdict_filename = 'dicom_dict_mask.dict'   # repeating groups, e.g. 60xx0010
 main_dict_name = 'DicomDictionary'   #KGH - not used; only want dict in file, not "name = <dict>"
 mask_dict_name = 'RepeatersDictionary'
+part06Loc = '/home/karl/Work/INCF/DICOM_docbook_latest/source/docbook/part06/part06.xml'  #KGH
+part07Loc = '/home/karl/Work/INCF/DICOM_docbook_latest/source/docbook/part07/part07.xml'  #KGH
 
 def write_dict(f, dict_name, attributes, tagIsString):  #KGH-write out the tag as a string in both cases
     if tagIsString:
@@ -140,110 +145,156 @@ def parse_docbook_table(book_root, caption, empty_field_name="Retired"):
 
             # Get all the Element data from the table
             attrs = [parse_row(field_names, row) for row in table.find('%stbody' %br).iter('%str' %br)]
+            metrics.count('tables')
+            metrics.count('rows', len(attrs))
             return attrs
 
-attrs = []
-
-# KGH - first look in Part 06 for three specific tables (see attrs += statements for table names)
-#url = 'http://medical.nema.org/medical/dicom/current/source/docbook/part06/part06.xml'
-#response = urllib2.urlopen(url)
-fLoc = '/home/karl/Work/INCF/DICOM_docbook_latest/source/docbook/part06/part06.xml'  #KGH
-response = open(fLoc)   #KGH
-tree = ET.parse(response)
-root = tree.getroot()
-response.close()  # KGH
-
-attrs += parse_docbook_table(root, "Registry of DICOM Data Elements")
-attrs += parse_docbook_table(root, "Registry of DICOM File Meta Elements")
-attrs += parse_docbook_table(root, "Registry of DICOM Directory Structuring Elements")
-#KGH ---------------------------------------------------------------
-
-#KGH - Then look at Part 07 that has the command field tables
-fLoc = '/home/karl/Work/INCF/DICOM_docbook_latest/source/docbook/part07/part07.xml'  #KGH
-response = open(fLoc)   #KGH
-#url = 'http://medical.nema.org/medical/dicom/current/source/docbook/part07/part07.xml'
-#response = urllib2.urlopen(url)
-tree = ET.parse(response)
-root = tree.getroot()
-
-command_attrs = parse_docbook_table(root, "Command Fields") # Changed from 2013 standard
-for attr in command_attrs:
-    attr["Name"] = attr["Message Field"]
-    attr["Retired"] = ""
-
-retired_command_attrs = parse_docbook_table(root, "Retired Command Fields")
-for attr in retired_command_attrs:
-    attr["Name"] = attr["Message Field"]
-    attr["Retired"] = "Retired"
-
-attrs += command_attrs
-attrs += retired_command_attrs
-#KGH -------------------------------------------------------------------------------
-
-
-# KGH - attrs dict now populated; sort by tag value
-attrs = sorted(attrs, key=lambda x: x["Tag"])
-
-main_attributes = []
-mask_attributes = []
-
-#KGH -check to see format of attrs key-value pair
-#print attrs[0]["Description of Field"]
-
-for attr in attrs:
-    group, elem = attr['Tag'][1:-1].split(",")
-
-    #KGH - unused as tables in Part 06 doesn't include definitions in tables
-    #KGH check to see if Description of Field exists; if not create key and make value a blank string
-    #if 'Description of Field' in attr:
-    #    pass
-    #else:
-    #    attr['Description of Field'] = 'None'
-
-    # e.g. (FFFE,E000)
-    if attr['VR'] == 'See Note':
-        attr['VR'] = 'NONE'
-
-    # e.g. (0018,1153), (0018,8150) and (0018,8151)
-    attr["Name"] = attr["Name"].replace(u"µ", "u") # replace micro symbol
-
-    # e.g. (0014,0023) and (0018,9445)
-    if attr['Retired'] in ['RET', 'RET - See Note']:
-        attr['Retired'] = 'Retired'
-
-    # e.g. (0008,0102), (0014,0025), (0040, A170)
-    if attr['Retired'] in ['DICOS', 'DICONDE', 'See Note']:
-        attr['Retired'] = ''
-
-    # e.g. (0028,1200)
-    attr['VM'] = attr['VM'].replace(" or ", " ")
-
-    # If blank then add dummy vals
-    # e.g. (0018,9445) and (0028,0020)
-    if attr['VR'] == '' and attr['VM'] == '':
-        attr['VR'] = 'OB'
-        attr['VM'] = '1'
-        attr['Name'] = 'Retired-blank'
-
-    # handle retired 'repeating group' tags
-    # e.g. (50xx,eeee) or (gggg,31xx)
-    if 'x' in group or 'x' in elem:
-        attr["Tag"] = group + elem
-        mask_attributes.append(attr)
-    else:
-        #attr["Tag"] = '0x%s%s' %(group, elem)  
-        attr["Tag"] = '%s%s' %(group, elem)   #KGH - writing out as string; don't need 32-bit value
-        main_attributes.append(attr)
-
-py_file = file(pydict_filename, "wb")
-#KGH - the following 3 write lines are for pydicom only and not needed for NIDM
-#py_file.write("# %s\n" % os.path.basename(pydict_filename))
-#py_file.write('"""DICOM data dictionary auto-generated by %s"""\n' % os.path.basename(__file__))
-#py_file.write('from __future__ import absolute_import\n')
-write_dict(py_file, main_dict_name, main_attributes, tagIsString=False)
-#write_dict(py_file, mask_dict_name, mask_attributes, tagIsString=True)
-
-py_file.close()
-
-print ("Finished creating python file %s containing the dicom dictionary" % pydict_filename)
-print ("Wrote %d tags" % (len(main_attributes) + len(mask_attributes)))
+def parse_part06(source):
+    """ Returns the Element dicts of the three registry tables in the Part 06 docbook
+    source (a filename or file object)
+    """
+    attrs = []
+
+    # KGH - first look in Part 06 for three specific tables (see attrs += statements for table names)
+    tree = ET.parse(source)
+    root = tree.getroot()
+
+    attrs += parse_docbook_table(root, "Registry of DICOM Data Elements")
+    attrs += parse_docbook_table(root, "Registry of DICOM File Meta Elements")
+    attrs += parse_docbook_table(root, "Registry of DICOM Directory Structuring Elements")
+    return attrs
+
+
+def parse_part07(source):
+    """ Returns the Element dicts of the "Command Fields" and "Retired Command Fields" 
+    tables in the Part 07 docbook source (a filename or file object)
+    """
+    #KGH - Then look at Part 07 that has the command field tables
+    tree = ET.parse(source)
+    root = tree.getroot()
+
+    command_attrs = parse_docbook_table(root, "Command Fields") # Changed from 2013 standard
+    for attr in command_attrs:
+        attr["Name"] = attr["Message Field"]
+        attr["Retired"] = ""
+
+    retired_command_attrs = parse_docbook_table(root, "Retired Command Fields")
+    for attr in retired_command_attrs:
+        attr["Name"] = attr["Message Field"]
+        attr["Retired"] = "Retired"
+
+    return command_attrs + retired_command_attrs
+
+
+def build_attributes(attrs):
+    """ Sorts and cleans up the Element dicts from Parts 06 and 07
+    Returns (main_attributes, mask_attributes), the latter being the repeating groups
+    """
+    # KGH - attrs dict now populated; sort by tag value
+    attrs = sorted(attrs, key=lambda x: x["Tag"])
+
+    main_attributes = []
+    mask_attributes = []
+
+    #KGH -check to see format of attrs key-value pair
+    #print attrs[0]["Description of Field"]
+
+    for attr in attrs:
+        group, elem = attr['Tag'][1:-1].split(",")
+
+        #KGH - unused as tables in Part 06 doesn't include definitions in tables
+        #KGH check to see if Description of Field exists; if not create key and make value a blank string
+        #if 'Description of Field' in attr:
+        #    pass
+        #else:
+        #    attr['Description of Field'] = 'None'
+
+        # e.g. (FFFE,E000)
+        if attr['VR'] == 'See Note':
+            attr['VR'] = 'NONE'
+
+        # e.g. (0018,1153), (0018,8150) and (0018,8151)
+        attr["Name"] = attr["Name"].replace(u"µ", "u") # replace micro symbol
+
+        # e.g. (0014,0023) and (0018,9445)
+        if attr['Retired'] in ['RET', 'RET - See Note']:
+            attr['Retired'] = 'Retired'
+
+        # e.g. (0008,0102), (0014,0025), (0040, A170)
+        if attr['Retired'] in ['DICOS', 'DICONDE', 'See Note']:
+            attr['Retired'] = ''
+
+        # e.g. (0028,1200)
+        attr['VM'] = attr['VM'].replace(" or ", " ")
+
+        # If blank then add dummy vals
+        # e.g. (0018,9445) and (0028,0020)
+        if attr['VR'] == '' and attr['VM'] == '':
+            attr['VR'] = 'OB'
+            attr['VM'] = '1'
+            attr['Name'] = 'Retired-blank'
+
+        # handle retired 'repeating group' tags
+        # e.g. (50xx,eeee) or (gggg,31xx)
+        if 'x' in group or 'x' in elem:
+            attr["Tag"] = group + elem
+            mask_attributes.append(attr)
+        else:
+            #attr["Tag"] = '0x%s%s' %(group, elem)  
+            attr["Tag"] = '%s%s' %(group, elem)   #KGH - writing out as string; don't need 32-bit value
+            main_attributes.append(attr)
+
+    return main_attributes, mask_attributes
+
+
+def write_vr_dict(main_attributes, mask_attributes):
+    py_file = file(pydict_filename, "wb")
+    #KGH - the following 3 write lines are for pydicom only and not needed for NIDM
+    #py_file.write("# %s\n" % os.path.basename(pydict_filename))
+    #py_file.write('"""DICOM data dictionary auto-generated by %s"""\n' % os.path.basename(__file__))
+    #py_file.write('from __future__ import absolute_import\n')
+    write_dict(py_file, main_dict_name, main_attributes, tagIsString=False)
+    py_file.close()
+
+    # the masks go in their own file so both files stay a single dict literal
+    mask_file = open(maskdict_filename, "wb")
+    write_dict(mask_file, mask_dict_name, mask_attributes, tagIsString=True)
+    mask_file.close()
+
+    print ("Finished creating python files %s and %s containing the dicom dictionary" % (pydict_filename, maskdict_filename))
+    print ("Wrote %d tags and %d masks" % (len(main_attributes), len(mask_attributes)))
+
+
+def main():
+    attrs = []
+
+    #url = 'http://medical.nema.org/medical/dicom/current/source/docbook/part06/part06.xml'
+    #response = urllib2.urlopen(url)
+    with metrics.stage('parse_part06'):
+        response = open(part06Loc)   #KGH
+        attrs += parse_part06(response)
+        response.close()  # KGH
+    #KGH ---------------------------------------------------------------
+
+    with metrics.stage('parse_part07'):
+        response = open(part07Loc)   #KGH
+        #url = 'http://medical.nema.org/medical/dicom/current/source/docbook/part07/part07.xml'
+        #response = urllib2.urlopen(url)
+        attrs += parse_part07(response)
+        response.close()
+    #KGH -------------------------------------------------------------------------------
+
+    with metrics.stage('build_attributes'):
+        main_attributes, mask_attributes = build_attributes(attrs)
+    with metrics.stage('write'):
+        write_vr_dict(main_attributes, mask_attributes)
+    metrics.count('tags written', len(main_attributes))
+    metrics.count('masks written', len(mask_attributes))
+
+
+##############################################################
+if __name__ == "__main__":
+    # --quiet, --profile, --trace-memory, --metrics <file>: see metrics.py
+    metrics.start('vr_generate_dict', sys.argv[1:])
+    main()
+    metrics.finish()